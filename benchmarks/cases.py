@@ -0,0 +1,176 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmark cases
+
+Each case is a function of size parameter n, returning dict with entries:
+
+x : ndarray
+    point of evaluation
+f : callable(x)
+    function evaluated for numpy and sparsegrad values
+sparsity : bool, optional
+    if True, sparsity pattern is calculated instead of Jacobian
+"""
+
+import numpy as np
+import scipy.sparse
+import sparsegrad.functions as sg
+from sparsegrad.sparsevec import sparsesum_bare
+
+__all__ = ['cases']
+
+cases = []
+
+
+def case(name, sizes, quick_sizes):
+    def register(func):
+        cases.append(dict(name=name, func=func, sizes=sizes,
+                          quick_sizes=quick_sizes))
+        return func
+    return register
+
+
+class shallow_water(object):
+    "Shallow water equations on periodic n x n mesh, as in examples/shallow-water.ipynb"
+
+    def __init__(self, n):
+        self.n = n
+        self.ndof = n * n
+        self.h = 1. / n
+        self.g = 1.
+        idx = np.arange(self.ndof).reshape(n, n)
+        self.idx_p = [np.roll(idx, -1, axis).flatten() for axis in (0, 1)]
+        self.idx_m = [np.roll(idx, 1, axis).flatten() for axis in (0, 1)]
+        x, y = np.mgrid[:n, :n]
+        self.eta0 = np.where((x - n / 2.)**2 + (y - n / 2.)**2 <
+                             (n / 20.)**2, 1.1, 1.).flatten()
+
+    def d(self, axis, x):
+        return (x[self.idx_p[axis]] - x[self.idx_m[axis]]) / (2 * self.h)
+
+    def residuals(self, x):
+        m, g = self.ndof, self.g
+        eta, u, v = x[:m], x[m:2 * m], x[2 * m:]
+        deta_dt = -self.d(0, eta * u) - self.d(1, eta * v)
+        du_dt = (deta_dt * u - self.d(0, eta * u**2 + 1. / 2 * g *
+                                      eta**2) - self.d(1, eta * u * v)) / eta
+        dv_dt = (deta_dt * v - self.d(0, eta * u * v) -
+                 self.d(1, eta * v**2 + 1. / 2 * g * eta**2)) / eta
+        return sg.stack(deta_dt, du_dt, dv_dt)
+
+    def x0(self):
+        r = np.random.RandomState(0)
+        return np.hstack([self.eta0, 0.01 * r.rand(self.ndof),
+                          0.01 * r.rand(self.ndof)])
+
+
+@case('shallow_water', [50, 100, 200], [20])
+def shallow_water_case(n):
+    model = shallow_water(n)
+    return dict(x=model.x0(), f=model.residuals)
+
+
+def stencil(shape):
+    "Return index arrays of neighbours on periodic grid of given shape"
+    idx = np.arange(np.prod(shape)).reshape(shape)
+    return [np.roll(idx, shift, axis).flatten()
+            for axis in range(len(shape)) for shift in (-1, 1)]
+
+
+def stencil_case(shape):
+    neighbours = stencil(shape)
+
+    def f(x):
+        lap = -2. * len(shape) * x
+        for idx in neighbours:
+            lap = lap + x[idx]
+        return lap + x**3 - sg.exp(-x)
+    return dict(x=np.linspace(0., 1., np.prod(shape)), f=f)
+
+
+@case('stencil_1d', [10**5, 10**6], [10**3])
+def stencil_1d(n):
+    return stencil_case((n,))
+
+
+@case('stencil_2d', [300, 1000], [30])
+def stencil_2d(n):
+    return stencil_case((n, n))
+
+
+@case('stencil_3d', [40, 100], [10])
+def stencil_3d(n):
+    return stencil_case((n, n, n))
+
+
+def random_mesh(n, degree=6, seed=0):
+    "Return edges (i,j) of random unstructured mesh with n nodes"
+    r = np.random.RandomState(seed)
+    i = np.repeat(np.arange(n), degree // 2)
+    j = (i + r.randint(1, n, size=len(i))) % n
+    return i, j
+
+
+@case('unstructured_gather', [10**5, 10**6], [10**3])
+def unstructured_gather(n):
+    i, j = random_mesh(n)
+
+    def f(x):
+        flux = (x[i] - x[j]) * (1. + x[i]**2 + x[j]**2)
+        return flux**2
+    return dict(x=np.linspace(0., 1., n), f=f)
+
+
+@case('sparsesum_assembly', [10**5, 10**6], [10**3])
+def sparsesum_assembly(n):
+    i, j = random_mesh(n)
+
+    def f(x):
+        flux = (x[i] - x[j]) * sg.exp(-x[i] * x[j])
+        return sparsesum_bare(n, [(i, flux), (j, -flux)])
+    return dict(x=np.linspace(0., 1., n), f=f)
+
+
+@case('where_branch', [10**5, 10**6], [10**3])
+def where_branch(n):
+    def f(x):
+        y = sg.where(x > 0.5, x**2, sg.sin(x))
+        z = sg.branch(x > 0.25, lambda idx: sg.exp(x[idx]),
+                      lambda idx: -x[idx])
+        return y * z
+    return dict(x=np.linspace(0., 1., n), f=f)
+
+
+@case('dot_large', [10**5, 10**6], [10**3])
+def dot_large(n):
+    r = np.random.RandomState(0)
+    nnz = 10 * n
+    A = scipy.sparse.csr_matrix((r.rand(nnz), (r.randint(0, n, nnz), r.randint(
+        0, n, nnz))), shape=(n, n))
+
+    def f(x):
+        return sg.dot(A, x**2) * x
+    return dict(x=np.linspace(0., 1., n), f=f)
+
+
+@case('sparsity_detection', [50, 100], [20])
+def sparsity_detection(n):
+    model = shallow_water(n)
+    return dict(x=model.x0(), f=model.residuals, sparsity=True)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks of sparsegrad
+
+Each case is run in a separate process, so that the peak resident set size
+is measured for that case only. Results are written as JSON, and two result
+files can be compared.
+
+Examples::
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --case stencil --quick
+    python benchmarks/run.py --compare before.json after.json
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(_here)
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def peak_rss_kb():
+    "Return peak resident set size of this process in kB, or None"
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def measure(func, repeat, prepare=None):
+    """
+    Return timings of func() in seconds, and the last result
+
+    If prepare is given, func is called as func(prepare()), and only func is
+    timed. prepare is called again in each repetition.
+    """
+    times = []
+    result = None
+    for i in range(repeat):
+        args = () if prepare is None else (prepare(),)
+        start = _clock()
+        result = func(*args)
+        times.append(_clock() - start)
+    return dict(min=min(times), mean=sum(times) / len(times), repeat=repeat), result
+
+
+def run_case(name, n, repeat):
+    "Run case name with size n in this process, return result as dict"
+    sys.path.insert(0, _root)
+    sys.path.insert(0, _here)
+    import numpy as np
+    from sparsegrad import forward
+    from cases import cases
+    spec = [c for c in cases if c['name'] == name][0]
+    setup = spec['func'](n)
+    x, f = setup['x'], setup['f']
+    phases = {}
+    phases['numpy'], _ = measure(lambda: f(x), repeat)
+    if setup.get('sparsity', False):
+        phases['forward'], y = measure(
+            lambda: f(forward.seed_sparsity(x)), repeat)
+        phases['dvalue'], J = measure(lambda y: y.sparsity, repeat,
+                                      lambda: f(forward.seed_sparsity(x)))
+    else:
+        phases['forward'], y = measure(lambda: f(forward.seed(x)), repeat)
+        phases['dvalue'], J = measure(lambda y: y.dvalue, repeat,
+                                      lambda: f(forward.seed(x)))
+    return dict(name=name, n=n, ndof=len(x), nnz=int(J.nnz), phases=phases,
+                time_per_evaluation=phases['forward'][
+                    'min'] + phases['dvalue']['min'],
+                peak_rss_kb=peak_rss_kb())
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=_root,
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+
+def metadata():
+    import numpy
+    import scipy
+    return dict(commit=_git_commit(), python=platform.python_version(),
+                numpy=numpy.__version__, scipy=scipy.__version__,
+                platform=platform.platform(), date=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def run_all(pattern, quick, repeat):
+    sys.path.insert(0, _root)
+    sys.path.insert(0, _here)
+    from cases import cases
+    results = []
+    for spec in cases:
+        if pattern is not None and not re.search(pattern, spec['name']):
+            continue
+        for n in spec['quick_sizes'] if quick else spec['sizes']:
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                           '--worker', spec['name'], str(n), str(repeat)])
+            result = json.loads(out.decode())
+            print('{name:>20} n={n:<8} nnz={nnz:<10} {t:10.4f} s  {rss} kB'.format(
+                t=result['time_per_evaluation'], rss=result['peak_rss_kb'], **result),
+                file=sys.stderr)
+            results.append(result)
+    return dict(meta=metadata(), results=results)
+
+
+def compare(old, new):
+    "Print comparison of two result files"
+    def key(r):
+        return r['name'], r['n']
+    old_results = dict((key(r), r) for r in old['results'])
+    print('{:>20} {:>8} {:>12} {:>12} {:>8} {:>10}'.format(
+        'case', 'n', 'old [s]', 'new [s]', 'ratio', 'rss ratio'))
+    for r in new['results']:
+        o = old_results.get(key(r))
+        if o is None:
+            continue
+        ratio = r['time_per_evaluation'] / max(o['time_per_evaluation'], 1e-12)
+        rss = None
+        if r['peak_rss_kb'] and o['peak_rss_kb']:
+            rss = float(r['peak_rss_kb']) / o['peak_rss_kb']
+        print('{:>20} {:>8} {:12.4f} {:12.4f} {:8.2f} {:>10}'.format(
+            r['name'], r['n'], o['time_per_evaluation'], r['time_per_evaluation'],
+            ratio, '-' if rss is None else '{:.2f}'.format(rss)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run sparsegrad benchmarks')
+    parser.add_argument('--case', help='regular expression selecting cases')
+    parser.add_argument('--quick', action='store_true',
+                        help='use small problem sizes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of evaluations in each case')
+    parser.add_argument('--output', help='write results as JSON to file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files')
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        name, n, repeat = args.worker
+        print(json.dumps(run_case(name, int(n), int(repeat))))
+        return
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            compare(json.load(f_old), json.load(f_new))
+        return
+    results = run_all(args.case, args.quick, args.repeat)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -30,7 +30,13 @@ setup(name='sparsegrad',
                 'sparsegrad.impl.sparse',
                 'sparsegrad.impl.sparsevec',
                 'sparsegrad.impl.multipledispatch',
+                'sparsegrad.impl.threadpool',
+                'sparsegrad.optimize',
+                'sparsegrad.parallel',
+                'sparsegrad.reverse',
+                'sparsegrad.solve',
                 'sparsegrad.sparsevec',
+                'sparsegrad.streaming',
                 'sparsegrad.testing',
                 'sparsegrad.functions'],
       url='http://www.marekszymanski.com/software/sparsegrad',
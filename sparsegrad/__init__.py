@@ -20,5 +20,6 @@
 
 from numpy.testing import Tester
 from ._version import version
+from .impl.sparse import gather_plan
 
 test = Tester().test
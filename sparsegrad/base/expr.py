@@ -16,6 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import numpy as np
+from sparsegrad.impl.multipledispatch.dispatch import dispatchSignature
 from sparsegrad.functions import ufunc, ufunc_routing, routing, utils
 
 
@@ -94,6 +96,74 @@ class expr_base(object):
     def compare(self, operator, other):
         raise NotImplementedError()
 
+    def __array_ufunc__(self, func, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs:
+            return NotImplemented
+        name = func.__name__
+        if name in _unary_operator_ufuncs:
+            return getattr(inputs[0], _unary_operator_ufuncs[name])()
+        if name in _operator_ufuncs:
+            if isinstance(inputs[0], expr_base):
+                return getattr(inputs[0], _operator_ufuncs[name][0])(inputs[1])
+            return getattr(inputs[1], _operator_ufuncs[name][1])(inputs[0])
+        if name in _numeric_ufuncs:
+            return func(*[utils.nvalue(x) for x in inputs])
+        f = ufunc.known_funcs.get(name)
+        if f is None:
+            return NotImplemented
+        if f.nin == 1:
+            return inputs[0].apply1(f)
+        impl = routing.find_implementation(inputs, default=expr_base)
+        return impl.__class__.apply(f, inputs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        generic = _array_functions.get(func)
+        if generic is utils.hstack:
+            if len(args) == 1 and not kwargs:
+                return utils.hstack(args[0])
+        elif generic is not None:
+            impl = generic.dispatch(*dispatchSignature(args))
+            if impl is not generic.dispatch(*((object,) * len(args))):
+                return impl(*args, **kwargs)
+        return func._implementation(*args, **kwargs)
+
+
+# binary ufuncs mapped to (operator, reflected operator), so that the
+# optimized operator overloads of subclasses are used
+_operator_ufuncs = {
+    'add': ('__add__', '__radd__'),
+    'subtract': ('__sub__', '__rsub__'),
+    'multiply': ('__mul__', '__rmul__'),
+    'divide': ('__truediv__', '__rtruediv__'),
+    'true_divide': ('__truediv__', '__rtruediv__'),
+    'power': ('__pow__', '__rpow__')
+}
+
+# unary ufuncs mapped to operators
+_unary_operator_ufuncs = {
+    'positive': '__pos__'
+}
+
+# ufuncs without meaningful derivative, evaluated on numeric values
+_numeric_ufuncs = set(['less', 'less_equal', 'equal', 'not_equal',
+                       'greater_equal', 'greater', 'logical_and',
+                       'logical_or', 'logical_xor', 'logical_not', 'isnan',
+                       'isinf', 'isfinite', 'signbit', 'floor', 'ceil',
+                       'trunc', 'rint'])
+
+# numpy functions routed to generic functions
+_array_functions = {
+    np.dot: utils.dot,
+    np.where: utils.where,
+    np.sum: utils.sum,
+    np.cumsum: utils.cumsum,
+    np.cumprod: utils.cumprod,
+    np.diff: utils.diff,
+    np.roll: utils.roll,
+    np.broadcast_to: utils.broadcast_to,
+    np.hstack: utils.hstack
+}
+
 
 class _comparison_proxy(object):
     def __init__(self, operator):
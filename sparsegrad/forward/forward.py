@@ -18,12 +18,17 @@
 
 import numpy as np
 import numbers
+import threading
+import weakref
+import zlib
+from sparsegrad import impl
 from sparsegrad.impl import sparse
 from sparsegrad.impl import sparsevec as sparsevec_impl
 from sparsegrad.base import expr_base
 from sparsegrad import functions
 
-__all__ = ['value', 'seed', 'seed_sparse_gradient', 'seed_sparsity', 'nvalue']
+__all__ = ['value', 'matrix', 'seed', 'seed_sparse_gradient',
+           'seed_sparsity', 'seed_many', 'seed_dae', 'nvalue', 'cse']
 
 
 def nvalue(x):
@@ -36,6 +41,122 @@ def nvalue(x):
         return np.asarray(x)
 
 
+def _rebuild_forward_value(cls, value, deriv):
+    return cls(value=value, deriv=deriv)
+
+
+class _cse_stack(threading.local):
+    "Active scopes of common subexpression elimination, separate for each thread"
+
+    def __init__(self):
+        self.scopes = []
+
+
+_cse_state = _cse_stack()
+
+
+class cse(object):
+    """
+    Scope of common subexpression elimination, used as context manager
+
+    Inside the scope, operations on forward values are cached by operation,
+    identities of forward value operands and fingerprints of constant operands.
+    Repeated subexpressions, such as eta*u computed in several places, return
+    the cached result instead of building a new Jacobian. Operands are held by
+    weak references, so that a result is released when its operands are, and
+    all results are released when the scope ends. The scope applies only to
+    the thread which entered it.
+
+    Counts of hits and misses are accumulated in stats.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        self.stats = dict(hits=0, misses=0)
+
+    def __enter__(self):
+        _cse_state.scopes.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _cse_state.scopes.remove(self)
+        self.cache.clear()
+
+    def _key(self, x, refs, consts):
+        "Return key of operand x, or None if x cannot be cached"
+        if isinstance(x, expr_base):
+            refs.append(x)
+            return ('v', id(x))
+        if isinstance(x, np.ndarray):
+            if x.dtype.hasobject:
+                return None
+            consts.append(x)
+            b = np.ascontiguousarray(x).reshape(-1).view(np.uint8)
+            return ('a', x.shape, x.dtype.str, zlib.crc32(b))
+        if isinstance(x, tuple):
+            keys = tuple(self._key(a, refs, consts) for a in x)
+            return None if None in keys else ('t',) + keys
+        if isinstance(x, slice):
+            return self._key((x.start, x.stop, x.step), refs, consts)
+        try:
+            hash(x)
+        except TypeError:
+            return None
+        return ('h', type(x), x)
+
+    def _valid(self, entry, refs, consts):
+        erefs, econsts, _ = entry
+        return all(r() is x for r, x in zip(erefs, refs)) and \
+            all(a is b or np.array_equal(
+                np.ascontiguousarray(a).reshape(-1).view(np.uint8),
+                np.ascontiguousarray(b).reshape(-1).view(np.uint8))
+                for a, b in zip(econsts, consts))
+
+    def lookup(self, name, method, obj, args):
+        "Return method(obj, *args), cached by name and operands"
+        refs = []
+        consts = []
+        key = self._key((obj,) + args, refs, consts)
+        if key is None:
+            return method(obj, *args)
+        if name in _commutative and len(key) == 3 and \
+                key[1][0] == 'v' and key[2][0] == 'v' and key[1] > key[2]:
+            key = (key[0], key[2], key[1])
+            refs = refs[::-1]
+        key = (name, key)
+        entry = self.cache.get(key)
+        if entry is not None and self._valid(entry, refs, consts):
+            self.stats['hits'] += 1
+            return entry[2]
+        result = method(obj, *args)
+        self.stats['misses'] += 1
+        cache = self.cache
+
+        def expire(r):
+            cached = cache.get(key)
+            if cached is not None and r in cached[0]:
+                del cache[key]
+        self.cache[key] = ([weakref.ref(x, expire) for x in refs], consts, result)
+        return result
+
+
+_commutative = set(['__add__', '__mul__'])
+
+
+def _cse(method):
+    "Decorator caching method in active cse scope"
+    name = method.__name__
+
+    def wrapper(self, *args):
+        scopes = _cse_state.scopes
+        if scopes:
+            return scopes[-1].lookup(name, method, self, args)
+        return method(self, *args)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
 class forward_value(expr_base):
     def __new__(cls, *args, **kwargs):
         value = kwargs.pop('value')
@@ -51,6 +172,9 @@ class forward_value(expr_base):
         obj.deriv = deriv
         return obj
 
+    def __reduce_ex__(self, protocol):
+        return (_rebuild_forward_value, (self.__class__, self.value, self.deriv))
+
     # getting values
     @property
     def gradient(self):
@@ -59,7 +183,18 @@ class forward_value(expr_base):
     dvalue = gradient
     sparsity = gradient
 
+    @property
+    def dfactors(self):
+        "Return Jacobian as (S, U, V), with S CSR and U, V dense, such that Jacobian is S + U V^T. See sparse.lowrank_sdcsr."
+        return self.deriv.factors()
+
+    @property
+    def doperator(self):
+        "Return Jacobian as scipy LinearOperator, without assembling its low rank part"
+        return self.deriv.aslinearoperator()
+
     # basic arithmetic: + - * /
+    @_cse
     def __add__(self, other):
         if isinstance(other, forward_value):
             y = self.value + other.value
@@ -70,6 +205,7 @@ class forward_value(expr_base):
         return self.__class__(value=y, deriv=dy)
     __radd__ = __add__
 
+    @_cse
     def __mul__(self, other):
         if isinstance(other, forward_value):
             y = self.value * other.value
@@ -82,6 +218,7 @@ class forward_value(expr_base):
         return self.__class__(value=y, deriv=dy)
     __rmul__ = __mul__
 
+    @_cse
     def __sub__(self, other):
         if isinstance(other, forward_value):
             y = self.value - other.value
@@ -91,6 +228,7 @@ class forward_value(expr_base):
             dy = self.deriv.broadcast(y)
         return self.__class__(value=y, deriv=dy)
 
+    @_cse
     def __rsub__(self, other):
         if isinstance(other, forward_value):
             y = other.value - self.value
@@ -100,6 +238,7 @@ class forward_value(expr_base):
             dy = self.deriv.chain(y, -1.)
         return self.__class__(value=y, deriv=dy)
 
+    @_cse
     def __div__(self, other):
         x = self.value
         if isinstance(other, forward_value):
@@ -116,6 +255,7 @@ class forward_value(expr_base):
             dy = self.deriv.chain(y, t)
         return self.__class__(value=y, deriv=dy)
 
+    @_cse
     def __rdiv__(self, other):
         #t = 1. / self.value
         z = self.value
@@ -139,15 +279,18 @@ class forward_value(expr_base):
     def __pos__(self):
         return self
 
+    @_cse
     def __neg__(self):
         y = -self.value
         return self._onearg(y, -1.)
 
+    @_cse
     def apply1(self, func):
         y, (dy_,) = func.f_df((self.value,))
         return self.__class__(value=y, deriv=self.deriv.chain(y, dy_()))
 
     @classmethod
+    @_cse
     def apply(cls, func, args):
         nargs = tuple(map(nvalue, args))
         y, df = func.f_df(nargs)
@@ -161,20 +304,30 @@ class forward_value(expr_base):
         if idx.dtype == np.bool:
             idx = np.arange(len(idx))[idx]
         y = np.take(x, idx)
-        n = len(idx)
-        if n and np.amin(idx) < 0:
+        n = len(x)
+        if len(idx) and np.amin(idx) < 0:
             idx = (idx + n) % n
         return self.__class__(value=y, deriv=self.deriv.getitem_arrayp(y, idx))
 
+    def getitem_plan(self, plan):
+        y = plan.take(self.value)
+        return self.__class__(value=y, deriv=self.deriv.getitem_plan(y, plan))
+
     def getitem_slice(self, idx):
         y = np.asarray(self.value[idx])
         return self.__class__(
             value=y, deriv=self.deriv.getitem_general(y, idx))
     getitem_scalar = getitem_slice
 
+    @_cse
     def __getitem__(self, idx):
+        if isinstance(idx, sparse.gather_plan):
+            return self.getitem_plan(idx)
         if isinstance(idx, np.ndarray):
             if idx.shape:
+                plan = sparse.gather_plan.cached(idx)
+                if plan is not None:
+                    return self.getitem_plan(plan)
                 return self.getitem_array(idx)
             else:
                 return self.getitem_scalar(idx)
@@ -187,7 +340,8 @@ class forward_value(expr_base):
     @classmethod
     def dot_(cls, A, x):
         if isinstance(A, value) or not isinstance(x, value):
-            raise NotImplementedError('only supported dot(const,value)')
+            raise NotImplementedError(
+                'only supported dot(const,value) and dot(matrix,value)')
         A = sparse.csr_matrix.fromcsr(A)
         y = A.dot(x.value)
         dy = x.deriv.rdot(y, A)
@@ -196,29 +350,104 @@ class forward_value(expr_base):
     @classmethod
     def where(cls, cond, a, b):
         # could be improved and has problems with propagation of NaN
-        return np.where(cond, 1., 0.) * a + \
-            np.where(np.logical_not(cond), 1., 0.) * b
+        cond = np.asarray(cond)
+        t = np.where(cond, 1., 0.)
+        f = np.where(np.logical_not(cond), 1., 0.)
+        # exact zero for the unused branch, so that its Jacobian is not built
+        if np.all(cond):
+            f = 0.
+        elif not np.any(cond):
+            t = 0.
+        return t * a + f * b
 
     def sparsesum(self, terms, **kwargs):
-        def wrap(idx, v, y):
-            n = len(y)
-            M = v.deriv.tovalue().tocsc()
-            rows = np.take(idx, M.indices)
-            M = sparse.csc_matrix(
-                (M.data, rows, M.indptr), shape=(
-                    n, M.shape[1]))
-            M.sort_indices()
-            M = M.tocsr()
-            return forward_value(
-                value=y, deriv=self.deriv.__class__(mshape=M.shape, M=M))
+        def wrap(plan, v, y):
+            return v.__class__(value=y, deriv=v.deriv.sparsesum(y, plan))
         return sparsevec_impl.sparsesum(
             terms, hstack=self.hstack, nvalue=nvalue, wrap=wrap, **kwargs)
 
+    def segment_sum(self, segment_ids, n, plan=None):
+        plan = sparsevec_impl.segment_plan(segment_ids, n, plan)
+        y = sparsevec_impl.segment_sum(self.value, None, n, plan=plan)
+        return self.__class__(value=y, deriv=self.deriv.sparsesum(y, plan))
+
+    def segment_prod(self, segment_ids, n, plan=None):
+        plan = sparsevec_impl.segment_plan(segment_ids, n, plan)
+        x = self.value
+        y = sparsevec_impl.segment_prod(x, None, n, plan=plan)
+        w = sparsevec_impl.segment_others(plan, x)
+        return self.__class__(
+            value=y, deriv=self.deriv.chain(x, w).sparsesum(y, plan))
+
+    def _segment_extremum(self, func, segment_ids, n, plan):
+        plan = sparsevec_impl.segment_plan(segment_ids, n, plan)
+        y = func(self.value, None, n, plan=plan)
+        # derivative of the first extremal entry of each nonempty segment
+        sel = sparsevec_impl.segment_selection(plan, self.value, y)
+        if len(sel) == n:
+            return self.__class__(
+                value=y, deriv=self.deriv.getitem_arrayp(y, sel))
+        dy = self.deriv.getitem_arrayp(np.take(y, plan.nonempty), sel)
+        return self.__class__(
+            value=y, deriv=dy.sparsesum(y, plan.placement()))
+
+    def segment_max(self, segment_ids, n, plan=None):
+        return self._segment_extremum(
+            sparsevec_impl.segment_max, segment_ids, n, plan)
+
+    def segment_min(self, segment_ids, n, plan=None):
+        return self._segment_extremum(
+            sparsevec_impl.segment_min, segment_ids, n, plan)
+
     def sum(self):
         y = np.sum(self.value)
         dy = self.deriv.sum()
         return self.__class__(value=y, deriv=dy)
 
+    def cumsum(self):
+        y = np.cumsum(self.value)
+        return self.__class__(value=y, deriv=self.deriv.cumsum(y))
+
+    def cumprod(self):
+        x = self.value
+        y = np.cumprod(x)
+        if not x.shape:
+            return self.__class__(value=y, deriv=self.deriv.broadcast(y))
+        zero = x == 0
+        xs = np.where(zero, 1, x)
+        # dy_i = y_i * sum_{j<=i} dx_j / x_j, exact while there are no zeros
+        # in x[:i+1]. Otherwise, y_i is zero, and dy_i is nonzero only for the
+        # rows up to the second zero.
+        dy = self.deriv.chain(x, np.reciprocal(
+            xs.astype(y.dtype))).cumsum(y).chain(y, y)
+        zeros = np.flatnonzero(zero)
+        if len(zeros):
+            first = zeros[0]
+            second = zeros[1] if len(zeros) > 1 else len(x)
+            w = np.cumprod(xs)[first:second]
+            rows = self.deriv.getitem_arrayp(w, np.full(
+                len(w), first, dtype=int)).chain(w, w)
+            dy = dy + self.deriv.vstack(y, [self.deriv.zero(y[:first]), rows,
+                                            self.deriv.zero(y[second:])])
+        return self.__class__(value=y, deriv=dy)
+
+    def diff(self, n=1):
+        y = self
+        for i in range(n):
+            m = len(y.value)
+            k = max(m - 1, 0)
+            D = sparse.csr_matrix.fromarrays(np.tile([-1., 1.], k), (np.arange(
+                k)[:, np.newaxis] + [0, 1]).ravel(), 2 * np.arange(k + 1), (k, m))
+            value = np.diff(y.value)
+            y = self.__class__(value=value, deriv=y.deriv.rdot(value, D))
+        return y
+
+    def roll(self, shift):
+        y = np.roll(self.value, shift)
+        n = len(y)
+        idx = (np.arange(n) - shift) % n if n else np.arange(0)
+        return self.__class__(value=y, deriv=self.deriv.getitem_arrayp(y, idx))
+
     def hstack(self, arrays):
         y = np.hstack([nvalue(a) for a in arrays])
 
@@ -239,6 +468,64 @@ class forward_value(expr_base):
         return getattr(self.value, operator)(other)
 
 
+class forward_matrix(object):
+    """
+    Sparse matrix in CSR format, with forward value as data
+
+    The structure of the matrix is sparse.csr_structure, which is constant and
+    should be reused between evaluations. data is forward value with one entry
+    for each stored element.
+    """
+
+    def __init__(self, data, structure):
+        if len(nvalue(data)) != structure.nnz:
+            raise ValueError('length of data does not match the structure')
+        self.data = data
+        self.structure = structure
+
+    @classmethod
+    def fromcsr(cls, csr, data):
+        "Return matrix with structure of scipy matrix csr, and data"
+        return cls(data, sparse.csr_structure.fromcsr(csr))
+
+    @property
+    def shape(self):
+        return self.structure.shape
+
+    @property
+    def value(self):
+        "Return numeric value as CSR matrix"
+        return self.structure.tocsr(nvalue(self.data))
+
+    def dot(self, x):
+        r"""
+        Return forward value of :math:`\mathbf{y}=\mathbf{A}\cdot\mathbf{x}`
+
+        The Jacobian is :math:`\mathbf{A}\cdot\mathbf{J_x} + \mathbf{D}\cdot\mathbf{J_{data}}`,
+        where :math:`\mathbf{D}` is the derivative of the product with respect to data.
+        """
+        A = self.value
+        x_ = nvalue(x)
+        y = A.dot(x_)
+        dy = None
+        if isinstance(self.data, forward_value):
+            dy = self.data.deriv.dot_data(y, self.structure, x_)
+        if isinstance(x, forward_value):
+            dx = x.deriv.rdot(y, A)
+            dy = dx if dy is None else dy + dx
+        if dy is None:
+            return y
+        T = x.__class__ if isinstance(
+            x, forward_value) else self.data.__class__
+        return T(value=y, deriv=dy)
+
+    __matmul__ = dot
+
+
+def forward_matrix_dot(A, x):
+    return A.dot(x)
+
+
 def forward_value_isscalar(x):
     return not x.value.shape
 
@@ -250,7 +537,17 @@ def forward_value_nvalue(x):
 functions.where.add((object, forward_value, object), forward_value.where)
 functions.where.add((object, object, forward_value), forward_value.where)
 functions.dot.add((object, forward_value), forward_value.dot_)
+functions.dot.add((forward_matrix, object), forward_matrix_dot)
+functions.dot.add((forward_matrix, forward_value), forward_matrix_dot)
 functions.sum.add((forward_value,), forward_value.sum)
+functions.cumsum.add((forward_value,), forward_value.cumsum)
+functions.cumprod.add((forward_value,), forward_value.cumprod)
+functions.diff.add((forward_value,), forward_value.diff)
+functions.segment_sum.add((forward_value, object, object), forward_value.segment_sum)
+functions.segment_max.add((forward_value, object, object), forward_value.segment_max)
+functions.segment_min.add((forward_value, object, object), forward_value.segment_min)
+functions.segment_prod.add((forward_value, object, object), forward_value.segment_prod)
+functions.roll.add((forward_value, object), forward_value.roll)
 functions.broadcast_to.add((forward_value, object), forward_value.broadcast_to)
 functions.nvalue.add((forward_value, ), forward_value_nvalue)
 functions.isscalar.add((forward_value,), forward_value_isscalar)
@@ -263,29 +560,312 @@ class forward_value_sparsity(forward_value):
         return self.where(cond, iftrue(t), iffalse(t))
 
 
-def seed(x, T=forward_value):
-    x = np.asarray(x)
-    if x.shape:
-        return T(value=x, deriv=sparse.sdcsr(mshape=(x.shape[0], x.shape[0])))
+def _seed_matrix(x, columns, dx):
+    "Return initial Jacobian of x, or None for identity"
+    if columns is not None:
+        if dx is not None:
+            raise ValueError('only one of columns, dx can be given')
+        if not x.shape:
+            raise ValueError('columns can only be selected for vector x')
+        return sparse.selection_matrix(len(x), np.arange(len(x))[columns])
+    if dx is None:
+        return None
+    n = len(x) if x.shape else 1
+    if impl.scipy.sparse.issparse(dx):
+        dx = sparse.csr_matrix.fromcsr(dx)
     else:
-        return T(value=x, deriv=sparse.sdcsr(mshape=(None, None)))
+        dx = sparse.csr_matrix(np.asarray(dx).reshape(n, -1))
+    if dx.shape[0] != n:
+        raise ValueError('dx must have %d rows' % n)
+    return dx
 
 
-def seed_sparsity(x, T=forward_value_sparsity):
+def _seed(x, T, D, columns, dx, dense=False):
     x = np.asarray(x)
-    if x.shape:
-        return T(value=x, deriv=sparse.sparsity_csr(
-            mshape=(x.shape[0], x.shape[0])))
-    else:
-        return T(value=x, deriv=sparse.sparsity_csr(mshape=(None, None)))
+    M = _seed_matrix(x, columns, dx)
+    n = x.shape[0] if x.shape else None
+    k = n if M is None else M.shape[1]
+    if dense is None:
+        # seeds with few nonzero entries, such as selections of columns, stay sparse
+        nnz = n if M is None else M.nnz
+        dense = n is not None and k <= sparse.dense_sdcsr.max_columns and \
+            2 * nnz >= n * k
+    if dense:
+        if n is None:
+            raise ValueError('dense Jacobian is only supported for vector x')
+        if M is None:
+            # identity has the same dtype as the sparse seed
+            I = D(mshape=(n, n))
+            M = np.eye(n, dtype=np.result_type(I.s, I.diag))
+        else:
+            M = M.toarray()
+        return T(value=x, deriv=sparse.dense_sdcsr(mshape=(n, k), M=M))
+    if M is None:
+        return T(value=x, deriv=D(mshape=(n, n)))
+    return T(value=x, deriv=D(mshape=(n, k), M=M))
+
+
+def seed(x, T=forward_value, columns=None, dx=None, dense=None):
+    """
+    Return forward value of x, for calculating derivatives with respect to x
+
+    By default, derivatives with respect to all entries of x are calculated.
+    Derivatives are restricted to entries of x given by columns, or to directions
+    given by dx, which is initial Jacobian of shape (len(x), k) with arbitrary k.
+    The cost of propagation of derivatives scales with the number of columns of the
+    initial Jacobian.
+
+    Parameters
+    ----------
+    x : scalar or vector
+        value
+    T : class
+        forward value class
+    columns : int array or bool array, optional
+        entries of x with respect to which derivatives are calculated
+    dx : sparse or dense matrix, optional
+        initial Jacobian
+    dense : bool, optional
+        whether Jacobians are propagated as dense arrays (sparse.dense_sdcsr).
+        By default, dense arrays are used for vector x with at most
+        sparse.dense_sdcsr.max_columns columns of the initial Jacobian, if at
+        least half of its entries are nonzero.
+    """
+    return _seed(x, T, sparse.sdcsr, columns, dx, dense)
+
+
+def seed_sparsity(x, T=forward_value_sparsity, columns=None, dx=None):
+    "Return forward value of x, for calculating sparsity pattern. Arguments are the same as for seed."
+    return _seed(x, T, sparse.sparsity_csr, columns, dx)
+
+
+def _named(pairs, kwargs):
+    return list(pairs) + list(kwargs.items())
+
+
+class multi_seed(object):
+    """
+    Forward values of several variables, sharing one Jacobian column space
+
+    Each variable has derivatives with respect to its own block of columns. Forward
+    values are accessed by name, or by iteration in order of blocks.
+    """
+
+    def __init__(self, pairs, T=forward_value, D=sparse.sdcsr):
+        self.names = [name for name, _ in pairs]
+        values = [np.asarray(x) for _, x in pairs]
+        self.sizes = [len(x) if x.shape else 1 for x in values]
+        self.offsets = np.hstack([[0], np.cumsum(self.sizes)]).astype(int)
+        n = self.offsets[-1]
+        self.values = {}
+        for name, x, offset, size in zip(
+                self.names, values, self.offsets, self.sizes):
+            M = sparse.csr_matrix.fromarrays(np.ones(size), np.arange(
+                offset, offset + size), np.arange(size + 1), (size, n))
+            mshape = (size if x.shape else None, n)
+            self.values[name] = T(value=x, deriv=D(mshape, M=M))
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def __iter__(self):
+        return iter([self.values[name] for name in self.names])
+
+    def __len__(self):
+        return len(self.names)
+
+    def columns(self, name):
+        "Return slice of Jacobian columns corresponding to variable name"
+        i = self.names.index(name)
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def jacobian(self, *outputs, **named_outputs):
+        """
+        Return block Jacobian of outputs with respect to seeded variables
+
+        outputs are either a single value, or (name,value) pairs and keyword
+        arguments, one for each row block.
+        """
+        if len(outputs) == 1 and not named_outputs and not isinstance(
+                outputs[0], tuple):
+            return block_jacobian([(None, outputs[0])], self)
+        return block_jacobian(_named(outputs, named_outputs), self)
+
+
+def seed_many(*pairs, **variables):
+    """
+    Seed several variables at once
+
+    Variables are given as (name,value) pairs or keyword arguments. Each
+    returned forward value has derivatives with respect to its own block of
+    columns. This avoids stacking the variables into a single vector, and
+    slicing it apart.
+
+    Returns multi_seed, which gives forward values by name or by iteration.
+    """
+    return multi_seed(_named(pairs, variables))
+
+
+class block_jacobian(object):
+    """
+    Jacobian of outputs with respect to variables of multi_seed, split into blocks
+
+    Blocks are accessed as J[column_name] for single output, or J[row_name, column_name].
+    The blocks and the whole matrix are only assembled on request.
+    """
+
+    def __init__(self, rows, seeds):
+        self.seeds = seeds
+        self.row_names = [name for name, _ in rows]
+        self.rows = dict(rows)
+        self._dvalues = {}
+        self._blocks = {}
+
+    def dvalue(self, row=None):
+        "Return Jacobian of output row with respect to all variables"
+        try:
+            return self._dvalues[row]
+        except KeyError:
+            pass
+        y = self.rows[row]
+        n = self.seeds.offsets[-1]
+        if isinstance(y, forward_value):
+            d = y.deriv.tovalue()
+        else:
+            y = np.asarray(y)
+            d = sparse.csr_matrix((len(y) if y.shape else 1, n))
+        d = sparse.csr_matrix.fromcsr(d)
+        self._dvalues[row] = d
+        return d
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            row, column = key
+        else:
+            row, column = None, key
+        try:
+            return self._blocks[row, column]
+        except KeyError:
+            pass
+        block = self.dvalue(row)[:, self.seeds.columns(column)]
+        self._blocks[row, column] = block
+        return block
+
+    def bmat(self):
+        "Return the whole Jacobian as single CSR matrix"
+        parts = [self.dvalue(row) for row in self.row_names]
+        return sparse.csr_join(parts, (sum(p.shape[0] for p in parts), self.seeds.offsets[-1]))
+
+
+class dae_seed(multi_seed):
+    """
+    Forward values of x and xdot for differentiation of DAE residual F(x, xdot)
+
+    x and xdot are seeded in separate blocks of columns, so that one evaluation
+    of F gives both dF/dx and dF/dxdot.
+    """
+
+    def __init__(self, x, xdot):
+        super(dae_seed, self).__init__([('x', x), ('xdot', xdot)])
+
+    def jacobian(self, y, previous=None):
+        """
+        Return dae_jacobian of output y
+
+        If previous dae_jacobian is given, and the pattern of the Jacobian is
+        not changed, its union pattern is reused.
+        """
+        d = super(dae_seed, self).jacobian(y).dvalue()
+        return dae_jacobian(d, self.sizes[0], previous)
+
+
+def seed_dae(x, xdot):
+    """
+    Seed x and xdot of DAE residual F(x, xdot)
+
+    Returns dae_seed, with forward values seeds['x'] and seeds['xdot']. The
+    Jacobian J(alpha) = dF/dx + alpha dF/dxdot, needed by implicit integrators,
+    is given by seeds.jacobian(F)(alpha) for any alpha.
+    """
+    return dae_seed(x, xdot)
+
+
+class dae_jacobian(object):
+    """
+    Jacobian dF/dx + alpha dF/dxdot of DAE residual, for any alpha
+
+    The union pattern of dF/dx and dF/dxdot, and the map of entries to it, are
+    computed once. Each J(alpha) is then a single weighted sum of entries.
+    Blocks are available as dx and dxdot.
+    """
+
+    def __init__(self, d, n, previous=None):
+        self.d = d
+        self.n = n
+        if previous is not None and sparse.same_pattern(d, previous.d):
+            self.pattern = previous.pattern
+            self.map = previous.map
+            self.isdot = previous.isdot
+        else:
+            self._analyse()
+
+    def _analyse(self):
+        d = self.d
+        n = self.n
+        nnz = d.indptr[-1]
+        indices = d.indices[:nnz]
+        self.isdot = indices >= n
+        # there are no entries for n=0
+        m = max(n, 1)
+        rows = np.repeat(np.arange(d.shape[0], dtype=np.int64), np.diff(d.indptr))
+        keys = rows * m + np.where(self.isdot, indices - n, indices)
+        keys, self.map = np.unique(keys, return_inverse=True)
+        counts = np.bincount(keys // m, minlength=d.shape[0])
+        self.pattern = sparse.csr_pattern(
+            (keys % m).astype(d.indices.dtype),
+            np.hstack([[0], np.cumsum(counts)]).astype(d.indptr.dtype),
+            (d.shape[0], n))
+
+    @property
+    def dx(self):
+        "Return dF/dx"
+        return self.d[:, :self.n]
+
+    @property
+    def dxdot(self):
+        "Return dF/dxdot"
+        return self.d[:, self.n:]
+
+    def __call__(self, alpha, out=None):
+        """
+        Return dF/dx + alpha dF/dxdot
+
+        If out is given, the result is written into out, which must be CSR
+        matrix with pattern containing the union pattern.
+        """
+        data = self.d.data[:self.d.indptr[-1]]
+        data = np.where(self.isdot, alpha * data, data)
+        nnz = self.pattern.nnz
+        if np.iscomplexobj(data):
+            # np.bincount does not accept complex weights
+            data = np.bincount(self.map, weights=data.real, minlength=nnz) + \
+                1j * np.bincount(self.map, weights=data.imag, minlength=nnz)
+        else:
+            data = np.bincount(self.map, weights=data, minlength=nnz)
+        J = sparse.csr_matrix.fromarrays(
+            data, self.pattern.indices, self.pattern.indptr, self.pattern.shape)
+        if out is not None:
+            return sparse.csr_assign(out, J)
+        return J
+
 
 # dvalue
-def _dvalue_simple(y, x):
-    return y.dvalue
-def _dvalue_zero_scalar(y, x):
-    return _dvalue_zero_array(np.asarray(y), x)
-def _dvalue_zero_array(y, x):
-    return x.deriv.zero(y).tovalue()
+def _dvalue_simple(y, x, out=None):
+    return y.deriv.tovalue(out)
+def _dvalue_zero_scalar(y, x, out=None):
+    return _dvalue_zero_array(np.asarray(y), x, out)
+def _dvalue_zero_array(y, x, out=None):
+    return x.deriv.zero(y).tovalue(out)
 functions.dvalue.add((forward_value, forward_value), _dvalue_simple)
 functions.dvalue.add((numbers.Number, forward_value), _dvalue_zero_scalar)
 functions.dvalue.add((np.ndarray, forward_value), _dvalue_zero_array)
@@ -293,3 +873,5 @@ functions.dvalue.add((np.ndarray, forward_value), _dvalue_zero_array)
 seed_sparse_gradient = seed
 
 value = forward_value
+
+matrix = forward_matrix
@@ -16,12 +16,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-__all__ = ['dot', 'where', 'sum', 'broadcast_to', 'hstack', 'stack',
+__all__ = ['dot', 'where', 'sum', 'cumsum', 'cumprod', 'diff', 'roll',
+           'broadcast_to', 'hstack', 'stack',
+           'segment_sum', 'segment_max', 'segment_min', 'segment_prod',
            'branch', 'isscalar', 'nvalue', 'apply', 'isnvalue', 'dvalue']
 
 import numbers
 import numpy as np
 from sparsegrad import impl
+import sparsegrad.impl.sparsevec as impl_sparsevec
 from sparsegrad.impl.multipledispatch import dispatch, GenericFunction
 from . import routing
 
@@ -37,10 +40,30 @@ where.add((object, object, object), np.where)
 sum = GenericFunction('sum')
 sum.add((object,), np.sum)
 
+# cumsum / cumprod / diff / roll
+cumsum = GenericFunction('cumsum')
+cumsum.add((object,), np.cumsum)
+cumprod = GenericFunction('cumprod')
+cumprod.add((object,), np.cumprod)
+diff = GenericFunction('diff')
+diff.add((object,), np.diff)
+roll = GenericFunction('roll')
+roll.add((object, object), np.roll)
+
 # broadcast_to
 broadcast_to = GenericFunction('broadcast_to')
 broadcast_to.add((object, object), np.broadcast_to)
 
+# segment_sum / segment_max / segment_min / segment_prod
+segment_sum = GenericFunction('segment_sum', doc="segment_sum(values, segment_ids, n): Return y of length n, with y[k] being the sum of values[segment_ids == k], as by numpy.add.at. Plan of reduction is cached when segment_ids is read-only array, or can be given as plan=sparsegrad.impl.sparsevec.segment_plan(segment_ids, n).")
+segment_sum.add((object, object, object), impl_sparsevec.segment_sum)
+segment_max = GenericFunction('segment_max', doc="segment_max(values, segment_ids, n): Return y of length n, with y[k] being the maximum of values[segment_ids == k], or -inf if there are no such values. For integer values, empty segments are the minimum of the integer dtype.")
+segment_max.add((object, object, object), impl_sparsevec.segment_max)
+segment_min = GenericFunction('segment_min', doc="segment_min(values, segment_ids, n): Return y of length n, with y[k] being the minimum of values[segment_ids == k], or inf if there are no such values. For integer values, empty segments are the maximum of the integer dtype.")
+segment_min.add((object, object, object), impl_sparsevec.segment_min)
+segment_prod = GenericFunction('segment_prod', doc="segment_prod(values, segment_ids, n): Return y of length n, with y[k] being the product of values[segment_ids == k], or 1 if there are no such values")
+segment_prod.add((object, object, object), impl_sparsevec.segment_prod)
+
 # hstack / stack
 def hstack(arrays):
     "Generalized version of numpy.hstack"
@@ -69,6 +92,8 @@ def branch(cond, iftrue, iffalse):
 
     """
 
+    from sparsegrad.sparsevec import sparsesum
+
     def _branch(cond, iftrue, iffalse):
         if not cond.shape:
             if cond:
@@ -120,4 +145,4 @@ def _is_ndarray_numeric(x):
 isnvalue.add((numbers.Number,), _is_pynumber_numeric)
 isnvalue.add((np.ndarray,), _is_ndarray_numeric)
 
-dvalue = GenericFunction('dvalue', doc='dvalue(y,x): Helper function for extracting Jacobian. It is assumed that y is calculated using seed x. Case when y does not depend on x is handled correctly.')
+dvalue = GenericFunction('dvalue', doc='dvalue(y,x): Helper function for extracting Jacobian. It is assumed that y is calculated using seed x. Case when y does not depend on x is handled correctly. If out=CSR matrix is given, the Jacobian is written into out, which must have pattern containing the pattern of the Jacobian.')
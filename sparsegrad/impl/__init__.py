@@ -19,6 +19,7 @@
 "This module can be imported before everything else and used to redirect some of scipy functionality. Rest of sparsegrad uses scipy functions imported here."
 
 import scipy.sparse
+import scipy.sparse.linalg
 
 
 def __parse_scipy_version():
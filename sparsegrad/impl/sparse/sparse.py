@@ -20,14 +20,34 @@
 This module contains implementation details sparse matrix operations
 """
 
+import weakref
 import numpy as np
 from sparsegrad import impl
+from sparsegrad.impl import threadpool
 __all__ = [
     'sdcsr',
     'sparsity_csr',
     'sample_csr_rows',
+    'csr_scale_rows',
+    'csr_rows',
+    'csr_join',
+    'csr_add',
+    'csr_matmul',
     'csr_matrix',
-    'csc_matrix']
+    'csc_matrix',
+    'csr_structure',
+    'csr_pattern',
+    'selection_matrix',
+    'same_pattern',
+    'intern_csr',
+    'gather_plan',
+    'readonly_cached',
+    'csr_assign',
+    'csr_cumsum',
+    'zero_matrix',
+    'lowrank_sdcsr',
+    'dense_sdcsr',
+    'index_dtype']
 
 scipy_sparse = impl.scipy.sparse
 
@@ -41,10 +61,24 @@ def sample_csr_rows(csr, rows):
     indptr = np.empty(len(rows) + 1, dtype=csr.indptr.dtype)
     indptr[0] = 0
     np.cumsum(count, out=indptr[1:])
-    ix = np.repeat(start - indptr[:-1], count) + np.arange(indptr[-1])
+    if not threadpool.enabled(indptr[-1]):
+        ix = np.repeat(start - indptr[:-1], count) + np.arange(indptr[-1])
+        return indptr, ix
+    ix = np.empty(indptr[-1], dtype=indptr.dtype)
+
+    def sample(a, b):
+        ea, eb = indptr[a], indptr[b]
+        np.add(np.repeat(start[a:b] - indptr[a:b], count[a:b]),
+               np.arange(ea, eb), out=ix[ea:eb])
+    threadpool.map_chunks(sample, threadpool.row_chunks(indptr))
     return indptr, ix
 
 
+def _entry_rows(indptr):
+    "Return row index of each entry of CSR matrix"
+    return np.repeat(np.arange(len(indptr) - 1, dtype=index_dtype), np.diff(indptr))
+
+
 class csr_matrix_nochecking(scipy_sparse.csr_matrix):
     """
 
@@ -80,7 +114,9 @@ class csr_matrix_nochecking(scipy_sparse.csr_matrix):
     def fromcsr(cls, csr):
         "Optimized matrix construction from CSR matrix, returns csr_matrix(csr)"
         self = cls()
-        if not isinstance(csr, scipy_sparse.csr_matrix):
+        if isinstance(csr, np.ndarray):
+            csr = scipy_sparse.csr_matrix(csr)
+        elif not isinstance(csr, scipy_sparse.csr_matrix):
             csr = csr.tocsr()
         self.data = csr.data
         self.indices = csr.indices
@@ -98,6 +134,16 @@ class csr_matrix_nochecking(scipy_sparse.csr_matrix):
     def check_format(self, full_check=True):
         pass
 
+    def __reduce_ex__(self, protocol):
+        # only the stored entries are pickled, as arrays which can be passed out-of-band
+        nnz = self.indptr[-1]
+        return (_rebuild_csr, (self.data[:nnz], self.indices[
+                :nnz], self.indptr, self.shape))
+
+
+def _rebuild_csr(data, indices, indptr, shape):
+    return csr_matrix_nochecking.fromarrays(data, indices, indptr, shape)
+
 
 csr_matrix = csr_matrix_nochecking
 
@@ -130,11 +176,576 @@ if (impl.scipy_version_major, impl.scipy_version_minor) < (0, 18):
         return mat
 
 
+def csr_scale_rows(M, p):
+    "Return data array of diag(p)*M, M being CSR matrix"
+    indptr = M.indptr
+    nnz = indptr[-1]
+    if not threadpool.enabled(nnz):
+        return M.data[:nnz] * np.repeat(p, np.diff(indptr))
+    data = np.empty(nnz, dtype=np.result_type(M.data, p))
+
+    def scale(a, b):
+        ea, eb = indptr[a], indptr[b]
+        np.multiply(M.data[ea:eb], np.repeat(p[a:b], np.diff(
+            indptr[a:b + 1])), out=data[ea:eb])
+    threadpool.map_chunks(scale, threadpool.row_chunks(indptr))
+    return data
+
+
+def csr_rows(M, start, stop):
+    "Return rows start:stop of CSR matrix M, sharing the data with M"
+    ea, eb = M.indptr[start], M.indptr[stop]
+    return csr_matrix.fromarrays(M.data[ea:eb], M.indices[ea:eb], M.indptr[
+                                 start:stop + 1] - ea, (stop - start, M.shape[1]))
+
+
+def csr_join(parts, shape):
+    "Return vertical concatenation of CSR matrices parts, joined by offsetting indptr"
+    indptr = np.empty(shape[0] + 1, dtype=index_dtype)
+    indptr[0] = 0
+    row, offset = 0, 0
+    for p in parts:
+        k = p.shape[0]
+        np.add(p.indptr[1:], offset, out=indptr[row + 1:row + k + 1])
+        row += k
+        offset += p.indptr[-1]
+    data = np.concatenate([p.data[:p.indptr[-1]] for p in parts])
+    indices = np.concatenate([p.indices[:p.indptr[-1]] for p in parts])
+    return csr_matrix.fromarrays(data, indices, indptr, shape)
+
+
+def csr_add(a, b):
+    "Return a+b for CSR matrices a, b"
+    if not (scipy_sparse.isspmatrix_csr(a) and scipy_sparse.isspmatrix_csr(b)) or \
+            not threadpool.enabled(a.indptr[-1] + b.indptr[-1]):
+        return a + b
+    chunks = threadpool.row_chunks(a.indptr + b.indptr)
+    return csr_join(threadpool.map_chunks(lambda start, stop: csr_rows(
+        a, start, stop) + csr_rows(b, start, stop), chunks), a.shape)
+
+
+def csr_matmul(a, b):
+    "Return a*b for CSR matrix a, and matrix b"
+    if not scipy_sparse.isspmatrix_csr(
+            b) or not threadpool.enabled(a.indptr[-1] + b.indptr[-1]):
+        return a * b
+    chunks = threadpool.row_chunks(a.indptr)
+    return csr_join(threadpool.map_chunks(lambda start, stop: csr_rows(
+        a, start, stop) * b, chunks), (a.shape[0], b.shape[1]))
+
+
+def same_pattern(a, b):
+    "Return if CSR matrices a, b have the same pattern of stored entries"
+    if a is None or b is None or a.shape != b.shape:
+        return False
+    nnz = a.indptr[-1]
+    if nnz != b.indptr[-1]:
+        return False
+    return (a.indptr is b.indptr or np.array_equal(a.indptr, b.indptr)) and (
+        a.indices is b.indices or np.array_equal(a.indices[:nnz], b.indices[:nnz]))
+
+
+# generated matrices by fingerprint, see intern_csr
+_interned = weakref.WeakValueDictionary()
+
+
+def _checksum(a):
+    "Return cheap checksum of integer array a, collisions are resolved by comparison"
+    if not len(a):
+        return 0
+    return (int(a[0]), int(a[-1]), int(np.sum(a, dtype=np.uint64)))
+
+
+def intern_csr(M):
+    """
+    Return canonical instance of CSR matrix M
+
+    Matrices generated by indexing and broadcasting are looked up by cheap
+    fingerprint of shape and pattern, and equal matrices are replaced by one
+    object. Operands with the same M are then summed by adding their row
+    scalings, without sparse addition. Matrices are held by weak references,
+    and a found matrix is only used if it is equal to M.
+
+    Interned matrices are shared by unrelated Jacobians, therefore they are
+    marked by attribute interned, and tovalue returns their copies.
+    """
+    nnz = M.indptr[-1]
+    data = M.data[:nnz]
+    key = (M.shape, M.dtype.str, nnz, _checksum(M.indices[:nnz]))
+    found = _interned.get(key)
+    if found is not None and same_pattern(found, M) and \
+            np.array_equal(found.data[:nnz], data):
+        return found
+    M.interned = True
+    _interned[key] = M
+    return M
+
+
+# maps of entries for csr_assign, by id of out. Entries are removed when out
+# is garbage collected.
+_assign_maps = {}
+
+
+def _assign_map(out, indices, indptr):
+    "Return map of entries of CSR matrix with indices and indptr to entries of out"
+    nnz = out.indptr[-1]
+    m = out.shape[1]
+    keys = _entry_rows(out.indptr).astype(np.int64) * m + out.indices[:nnz]
+    order = np.argsort(keys, kind='mergesort')
+    source = _entry_rows(indptr).astype(np.int64) * \
+        m + indices[:indptr[-1]]
+    pos = np.searchsorted(keys, source, sorter=order)
+    found = pos < nnz
+    found[found] = np.take(keys, np.take(order, pos[found])) == source[found]
+    if not np.all(found):
+        k = source[np.logical_not(found)][0]
+        raise ValueError(
+            'entry ({}, {}) is not in the pattern of out'.format(k // m, k % m))
+    pos = np.take(order, pos)
+    counts = np.bincount(pos, minlength=nnz)
+    duplicates = bool(np.any(counts > 1))
+    full = not duplicates and bool(np.all(counts == 1))
+    if full and np.array_equal(pos, np.arange(nnz)):
+        pos = None
+    return dict(pos=pos, full=full, duplicates=duplicates,
+                rows=_entry_rows(indptr), buffer=None)
+
+
+def csr_assign(out, M, p=1., shape=None):
+    """
+    Write diag(p)*M into data of preallocated CSR matrix out, and return out
+
+    M is CSR matrix or csr_pattern (with ones as data), or None for identity matrix.
+    shape of the identity matrix is given by shape, or by length of p. If both
+    are missing, it is taken from out. Pattern of out must contain pattern of M,
+    other entries of out are set to zero. ValueError is raised otherwise.
+
+    The map of entries is cached for out, and reused while the pattern of M
+    does not change. In this case, no arrays proportional to the number of
+    nonzeros are allocated.
+    """
+    if not scipy_sparse.isspmatrix_csr(out):
+        raise ValueError('out must be CSR matrix')
+    if M is not None:
+        shape = M.shape
+    elif shape is None:
+        shape = (len(p), len(p)) if np.shape(p) else out.shape
+    shape = tuple(shape)
+    if out.shape != shape:
+        raise ValueError(
+            'out has shape {}, expected {}'.format(out.shape, shape))
+    entry = _assign_maps.get(id(out))
+    if entry is None or entry['out']() is not out or entry['indices'] is not out.indices or entry['indptr'] is not out.indptr or not (
+            same_pattern(entry['source'], M) if M is not None else entry['source'] is None):
+        if M is None:
+            n = shape[0]
+            source = None
+            entry = _assign_map(out, np.arange(n), np.arange(n + 1))
+        else:
+            source = csr_pattern(M.indices, M.indptr, M.shape)
+            entry = _assign_map(out, M.indices, M.indptr)
+        entry['source'] = source
+        entry['indices'], entry['indptr'] = out.indices, out.indptr
+        key = id(out)
+        entry['out'] = weakref.ref(
+            out, lambda ref: _assign_maps.pop(key, None))
+        _assign_maps[key] = entry
+    target = out.data[:out.indptr[-1]]
+    pos = entry['pos']
+    if pos is None:
+        buf = target
+    else:
+        buf = entry['buffer']
+        if buf is None or buf.dtype != target.dtype:
+            buf = entry['buffer'] = np.empty(
+                len(entry['rows']), dtype=target.dtype)
+    data = None if M is None else getattr(M, 'data', None)
+    p = np.asarray(p)
+    if p.shape:
+        if p.dtype == buf.dtype:
+            np.take(p, entry['rows'], out=buf)
+        else:
+            buf[...] = np.take(p, entry['rows'])
+        if data is not None:
+            np.multiply(buf, data[:len(buf)], out=buf)
+    elif data is not None:
+        np.multiply(data[:len(buf)], p, out=buf)
+    else:
+        buf.fill(p)
+    if pos is not None:
+        if not entry['full']:
+            target.fill(0)
+        if entry['duplicates']:
+            np.add.at(target, pos, buf)
+        else:
+            target[pos] = buf
+    return out
+
+
+def _segmented_cumsum(data, indptr):
+    "Return cumulative sums of data, restarted at each segment indptr[i]:indptr[i+1]"
+    n = len(data)
+    start = np.repeat(indptr[:-1], np.diff(indptr))
+    entries = np.arange(n)
+    result = np.array(data)
+    offset = 1
+    # Hillis-Steele scan, in log2(longest segment) steps
+    while n and offset <= np.amax(entries - start):
+        mask = entries - offset >= start
+        prev = result[np.flatnonzero(mask) - offset]
+        result[mask] += prev
+        offset *= 2
+    return result
+
+
+def csr_cumsum(M):
+    r"""
+    Return CSR matrix :math:`\mathbf{L} \cdot \mathbf{M}`, cumulative sum of rows of M
+
+    L is lower triangular matrix of ones, which is not formed. Each column of
+    the result has entries from its first nonzero row in M to the last row.
+    """
+    n, m = M.shape
+    C = scipy_sparse.csc_matrix(M)
+    C.sum_duplicates()
+    counts = np.diff(C.indptr)
+    first = np.take(C.indices, C.indptr[:-1][counts > 0])
+    nout = np.zeros(m, dtype=index_dtype)
+    nout[counts > 0] = n - first
+    indptr = np.zeros(m + 1, dtype=index_dtype)
+    np.cumsum(nout, out=indptr[1:])
+    # rows and columns of output entries, in CSC order
+    start = np.zeros(m, dtype=np.int64)
+    start[counts > 0] = first
+    col = np.repeat(np.arange(m, dtype=np.int64), nout)
+    rows = np.arange(indptr[-1]) + np.repeat(start - indptr[:-1], nout)
+    # last entry of M in the same column, with row not greater than output row
+    keys = np.repeat(np.arange(m, dtype=np.int64), counts) * n + C.indices
+    pos = np.searchsorted(keys, col * n + rows, side='right') - 1
+    data = np.take(_segmented_cumsum(C.data, C.indptr), pos)
+    return csr_matrix.fromcsr(scipy_sparse.csc_matrix(
+        (data, rows, indptr), shape=(n, m)).tocsr())
+
+
+def selection_matrix(n, columns):
+    "Return n x len(columns) matrix M with M[columns[j],j]=1, that is identity restricted to columns"
+    columns = np.asarray(columns, dtype=index_dtype)
+    order = np.argsort(columns, kind='mergesort')
+    indptr = np.zeros(n + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(columns, minlength=n), out=indptr[1:])
+    return csr_matrix.fromarrays(
+        np.ones(len(columns)), order, indptr, (n, len(columns)))
+
+
 def diagonal(x, n):
     "Return n x n matrix diag(x)"
     return csr_matrix.fromarrays(x, np.arange(n), np.arange(n + 1), (n, n))
 
 
+def _frozen(a):
+    "Return if a is ndarray which, with arrays it is view of, is read-only"
+    if not isinstance(a, np.ndarray):
+        return False
+    while isinstance(a, np.ndarray):
+        if a.flags.writeable:
+            return False
+        a = a.base
+    return True
+
+
+def readonly_cached(cache, key, arrays, build):
+    """
+    Return build(), cached in dict cache while read-only arrays are alive
+
+    The result is stored under key and ids of arrays, and it is removed when any
+    of arrays is garbage collected. Writeable arrays can change, therefore None
+    is returned without calling build if any of arrays is writeable.
+    """
+    if not all(_frozen(a) for a in arrays):
+        return None
+    key = tuple(key) + tuple(id(a) for a in arrays)
+    try:
+        refs, result = cache[key]
+        if all(r() is a for r, a in zip(refs, arrays)):
+            return result
+    except KeyError:
+        pass
+    result = build()
+    cache[key] = ([weakref.ref(a, lambda r: cache.pop(key, None))
+                   for a in arrays], result)
+    return result
+
+
+# plans for read-only index arrays, by ids of the arrays
+_plans = {}
+
+
+class gather_plan(object):
+    """
+    Plan of repeated gather x[idx] with fixed index array idx
+
+    The plan normalizes idx once: boolean masks are converted to indices, and
+    negative indices are wrapped. Jacobians of gathers are calculated from
+    maps of rows cached for each source pattern, so that a repeated gather
+    consists of two np.take calls, for the value and for the Jacobian data.
+
+    Plans can be passed as indices to forward values, and converted to index
+    arrays by numpy. Read-only index arrays get plans automatically.
+    """
+
+    def __init__(self, idx):
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        idx = np.array(idx, dtype=np.result_type(idx, index_dtype))
+        idx.flags.writeable = False
+        self.idx = idx
+        self.minimum = np.amin(idx) if len(idx) else 0
+        self._normalized = {}
+        self._selections = {}
+        self._maps = {}
+
+    @classmethod
+    def cached(cls, idx):
+        "Return plan of read-only index array idx, or None if idx is writeable"
+        return readonly_cached(_plans, (cls,), [idx], lambda: cls(idx))
+
+    def __len__(self):
+        return len(self.idx)
+
+    def __array__(self, dtype=None):
+        if dtype is None:
+            return self.idx
+        return self.idx.astype(dtype)
+
+    def normalized(self, n):
+        "Return indices into source of length n, with negative indices wrapped"
+        if self.minimum >= 0:
+            return self.idx
+        try:
+            return self._normalized[n]
+        except KeyError:
+            pass
+        idx = np.where(self.idx < 0, self.idx + n, self.idx)
+        idx.flags.writeable = False
+        self._normalized[n] = idx
+        return idx
+
+    def take(self, x):
+        "Return x[idx]"
+        return np.take(x, self.idx)
+
+    def selection(self, n, dtype):
+        "Return selection matrix of rows idx of n x n identity matrix"
+        key = (n, np.dtype(dtype).str)
+        try:
+            return self._selections[key]
+        except KeyError:
+            pass
+        idx = self.normalized(n)
+        P = csr_matrix.fromarrays(np.ones(len(idx), dtype=dtype), idx, np.arange(
+            len(idx) + 1, dtype=index_dtype), (len(idx), n))
+        self._selections[key] = P
+        return P
+
+    def getrows(self, M):
+        """
+        Return M[idx]
+
+        Maps of rows are cached while indptr and indices of M are alive. The
+        last result is returned again for the same data of M.
+        """
+        key = (id(M.indptr), id(M.indices))
+        entry = self._maps.get(key)
+        if entry is None or entry[0]() is not M.indptr or entry[1]() is not M.indices:
+            indptr, ix = sample_csr_rows(M, self.normalized(M.shape[0]))
+            maps = self._maps
+
+            def expire(r):
+                maps.pop(key, None)
+            entry = [weakref.ref(M.indptr, expire), weakref.ref(M.indices, expire),
+                     indptr, ix, np.take(M.indices, ix), None, None]
+            self._maps[key] = entry
+        last = entry[6]() if entry[6] is not None else None
+        if entry[5] is not None and entry[5]() is M.data and last is not None:
+            return last
+        _, _, indptr, ix, indices, _, _ = entry
+        result = csr_matrix.fromarrays(np.take(M.data, ix), indices, indptr,
+                                       (len(self.idx), M.shape[1]))
+        entry[5] = weakref.ref(M.data)
+        entry[6] = weakref.ref(result)
+        return result
+
+
+class csr_structure(object):
+    """
+    Constant structure (indices, indptr, shape) of CSR matrix, to be reused
+    by matrices with different data
+    """
+
+    def __init__(self, indices, indptr, shape):
+        self.indices = np.asarray(indices, dtype=index_dtype)
+        self.indptr = np.asarray(indptr, dtype=index_dtype)
+        self.shape = shape
+        self._entries = None
+
+    @classmethod
+    def fromcsr(cls, csr):
+        "Return structure of CSR matrix csr"
+        csr = csr_matrix.fromcsr(csr)
+        nnz = csr.indptr[-1]
+        return cls(csr.indices[:nnz], csr.indptr, csr.shape)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    @property
+    def entries(self):
+        "Indices of entries, np.arange(nnz). The result is cached."
+        if self._entries is None:
+            self._entries = np.arange(self.nnz, dtype=index_dtype)
+        return self._entries
+
+    def tocsr(self, data):
+        "Return CSR matrix with this structure and given data"
+        return csr_matrix.fromarrays(data, self.indices, self.indptr, self.shape)
+
+    def dot_data(self, x, weights=1.):
+        r"""
+        Return CSR matrix :math:`\mathbf{D}` such that :math:`\mathbf{A}\cdot\mathbf{x} = \mathbf{D}\cdot\mathbf{data}`,
+        with columns of :math:`\mathbf{D}` scaled by weights
+        """
+        return csr_matrix.fromarrays(np.take(x, self.indices) * weights,
+                                     self.entries, self.indptr, (self.shape[0], self.nnz))
+
+
+class csr_pattern(object):
+    """
+    Sparsity pattern of CSR matrix, stored as indptr and indices only
+
+    Indices in each row are sorted and unique. Union and product of patterns
+    are computed by scipy kernels on temporary boolean data, so that no
+    numerical cancellation can occur.
+    """
+
+    def __init__(self, indices, indptr, shape):
+        self.indices = np.asarray(indices, dtype=index_dtype)
+        self.indptr = np.asarray(indptr, dtype=index_dtype)
+        self.shape = shape
+
+    @classmethod
+    def fromcsr(cls, csr):
+        "Return pattern of stored entries of sparse matrix csr"
+        if not scipy_sparse.issparse(csr):
+            csr = scipy_sparse.csr_matrix(np.atleast_2d(csr))
+        elif not isinstance(csr, scipy_sparse.csr_matrix):
+            csr = csr.tocsr()
+        nnz = csr.indptr[-1]
+        if not csr.has_canonical_format:
+            csr = csr_matrix.fromarrays(np.ones(nnz, dtype=bool), csr.indices[
+                                        :nnz].copy(), csr.indptr.copy(), csr.shape)
+            csr.sum_duplicates()
+            nnz = csr.indptr[-1]
+        return cls._fromcsr(csr)
+
+    @classmethod
+    def _fromcsr(cls, csr):
+        return cls(csr.indices[:csr.indptr[-1]], csr.indptr, csr.shape)
+
+    @classmethod
+    def identity(cls, n):
+        return cls(np.arange(n), np.arange(n + 1), (n, n))
+
+    @classmethod
+    def empty(cls, shape):
+        return cls(np.zeros(0), np.zeros(shape[0] + 1), shape)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def getrows(self, rows):
+        "Return pattern of rows"
+        indptr, ix = sample_csr_rows(self, rows)
+        return self.__class__(np.take(self.indices, ix),
+                              indptr, (len(rows), self.shape[1]))
+
+    def __getitem__(self, idx):
+        rows = np.atleast_1d(np.arange(self.shape[0])[idx])
+        return self.getrows(rows)
+
+    def _bool(self):
+        M = self.tocsr(dtype=bool)
+        M.has_canonical_format = True
+        return M
+
+    def union(self, other):
+        "Return pattern of self+other"
+        if other is self or not other.nnz or same_pattern(self, other):
+            return self
+        if not self.nnz:
+            return other
+        return self._fromcsr(csr_add(self._bool(), other._bool()))
+
+    def dot(self, other):
+        "Return pattern of self*other"
+        M = csr_matmul(self._bool(), other._bool())
+        M.sort_indices()
+        return self._fromcsr(M)
+
+    def sum(self):
+        "Return pattern of sum over rows, as matrix with single row"
+        indices = np.unique(self.indices)
+        return self.__class__(indices, [0, len(indices)], (1, self.shape[1]))
+
+    @classmethod
+    def vstack(cls, parts):
+        "Return vertical concatenation of patterns"
+        parts = list(parts)
+        offsets = np.cumsum([0] + [p.nnz for p in parts[:-1]])
+        indptr = np.hstack([[0]] + [p.indptr[1:] + offset for p,
+                                    offset in zip(parts, offsets)])
+        indices = np.hstack([np.zeros(0, dtype=index_dtype)] +
+                            [p.indices for p in parts])
+        return cls(indices, indptr, (len(indptr) - 1, parts[0].shape[1]))
+
+    def tocsr(self, dtype=np.float64):
+        "Return CSR matrix with ones at entries of this pattern"
+        return csr_matrix.fromarrays(
+            np.ones(self.nnz, dtype=dtype), self.indices, self.indptr, self.shape)
+
+
+class _zero_matrix(object):
+    "Marker of Jacobian which is exactly zero"
+
+    def __repr__(self):
+        return 'zero_matrix'
+
+    def __reduce__(self):
+        return 'zero_matrix'
+
+
+zero_matrix = _zero_matrix()
+
+
+def _nbytes(a):
+    "Return memory used by arrays of a, which is array, CSR matrix or pattern"
+    if a is None or a is zero_matrix:
+        return 0
+    if isinstance(a, np.ndarray):
+        return a.nbytes
+    if hasattr(a, 'indptr'):
+        data = getattr(a, 'data', None)
+        return a.indices.nbytes + a.indptr.nbytes + _nbytes(data)
+    return np.asarray(a).nbytes
+
+
+def _iszero(x):
+    "Return if x is exact scalar zero"
+    return not np.shape(x) and x == 0
+
+
 class sdcsr(object):
     r"""
     Scaled matrix, which is stored as
@@ -144,14 +755,21 @@ class sdcsr(object):
        s \cdot diag( \mathbf{diag} ) \cdot \mathbf{M}
 
     where s is scalar, diag is row scaling vector (scalar and vector allowed), and
-    M is general part (None is allowed to indicate diagonal matrix).
+    M is general part (None is allowed to indicate diagonal matrix). M being
+    zero_matrix denotes Jacobian which is exactly zero. It is propagated without
+    storage, until it is added to another Jacobian or converted to value.
 
     mshape stores matrix shape. None for mshape[0] denotes differentation of scalar.
     None for mshape[1] denotes differentiation with repsect to scalar.
 
     No copies of M, diag are made, therefore they must be constant objects.
+
+    Broadcasts of scalars depending on at least lowrank_threshold entries are
+    stored as lowrank_sdcsr. None for lowrank_threshold disables this.
     """
 
+    lowrank_threshold = 32
+
     def __init__(self, mshape, s=np.asarray(1), diag=np.asarray(1), M=None):
         self.mshape = mshape
         self.s = s
@@ -160,7 +778,26 @@ class sdcsr(object):
         self.M = M
         self._value = None
 
+    @property
+    def iszero(self):
+        "Return if this Jacobian is exactly zero"
+        return self.M is zero_matrix
+
+    @property
+    def nbytes(self):
+        "Memory used by arrays of this matrix, including the cached value"
+        value = 0 if self._value is self.M else _nbytes(self._value)
+        return _nbytes(self.diag) + _nbytes(self.M) + value
+
+    def _evaluate_zero(self):
+        n, m = self.mshape
+        if n is None and m is None:
+            return np.asarray(0.)
+        return csr_matrix((1 if n is None else n, 1 if m is None else m))
+
     def _evaluate(self):
+        if self.iszero:
+            return self._evaluate_zero()
         p = self.s * self.diag
         if self.M is None:
             if self.mshape == (None, None):
@@ -175,17 +812,30 @@ class sdcsr(object):
                 return diagonal(p, n)
         else:
             if p.shape:
-                return csr_matrix.fromarrays(self.M.data[:self.M.indptr[-1]] * np.repeat(
-                    p, np.diff(self.M.indptr)), self.M.indices, self.M.indptr, self.M.shape)
+                return csr_matrix.fromarrays(csr_scale_rows(
+                    self.M, p), self.M.indices, self.M.indptr, self.M.shape)
             else:
                 if p != 1.:
                     return csr_matrix.fromarrays(
                         self.M.data * p, self.M.indices, self.M.indptr, self.M.shape)
+                elif getattr(self.M, 'interned', False):
+                    return self.M.copy()
                 else:
                     return self.M
 
-    def tovalue(self):
-        "Return this matrix as standard CSR matrix. The result is cached."
+    def tovalue(self, out=None):
+        """
+        Return this matrix as standard CSR matrix. The result is cached.
+
+        If out is given, values are written into preallocated CSR matrix out,
+        whose pattern must contain the pattern of this matrix. See csr_assign.
+        """
+        if out is not None:
+            if self.mshape == (None, None):
+                raise ValueError('out is not supported for scalar derivative')
+            if self.iszero:
+                return csr_assign(out, self._evaluate_zero())
+            return csr_assign(out, self.M, self.s * self.diag, self.mshape)
         if self._value is None:
             self._value = self._evaluate()
         return self._value
@@ -193,11 +843,13 @@ class sdcsr(object):
     def getitem_general(self, output, idx):
         "Generate Jacobian matrix for operation output=x[idx], this matrix being Jacobian of x. General version."
         mshape = self._mshape(output)
+        if self.iszero:
+            return self.zero(output)
         if self.M is None:
-            v = self.tovalue()[idx]
+            v = intern_csr(self.tovalue()[idx])
             return self.__class__(mshape=mshape, M=v)
         else:
-            M = self.M[idx]
+            M = intern_csr(self.M[idx])
             if self.diag.shape:
                 diag = np.asarray(self.diag[idx])
             else:
@@ -206,6 +858,8 @@ class sdcsr(object):
 
     def getitem_arrayp(self, output, idx):
         "Generate Jacobian matrix for operation output=x[idx], this matrix being Jacobian of x. idx is array with all entries positive."
+        if self.iszero:
+            return self.zero(output)
         if self.diag.shape:
             p = self.s * np.take(self.diag, idx)
         else:
@@ -216,9 +870,9 @@ class sdcsr(object):
             data = np.ones(n, dtype=p.dtype)
             indptr = np.arange(len(idx) + 1)
             P = csr_matrix.fromarrays(data, idx, indptr, mshape)
-            return self.new(mshape, p, P)
+            return self.new(mshape, p, intern_csr(P))
         else:
-            return self.new(mshape, p, csr_matrix.getrows(self.M, idx))
+            return self.new(mshape, p, intern_csr(csr_matrix.getrows(self.M, idx)))
         #
         #P = csr_matrix.fromarrays(np.ones(n,dtype=dtype),idx,np.arange(len(idx)+1),mshape)
         # if self.M is not None:
@@ -226,6 +880,19 @@ class sdcsr(object):
         # else:
         #    return self.new(mshape,p,P)
 
+    def getitem_plan(self, output, plan):
+        "Generate Jacobian matrix for operation output=x[plan], this matrix being Jacobian of x. plan is gather_plan."
+        if self.iszero:
+            return self.zero(output)
+        mshape = self._mshape(output)
+        if self.diag.shape:
+            p = self.s * np.take(self.diag, plan.normalized(self.mshape[0]))
+        else:
+            p = self.s * self.diag
+        if self.M is None:
+            return self.new(mshape, p, plan.selection(self.mshape[0], p.dtype))
+        return self.new(mshape, p, plan.getrows(self.M))
+
     @classmethod
     def new(cls, mshape, diag=np.asarray(1), M=None):
         "Alternative constructor, which checks dimension of diag and assigns to scalar/vector part properly"
@@ -236,16 +903,7 @@ class sdcsr(object):
 
     def zero(self, output):
         "Return empty Jacobian, which would result from output=0*x, this matrix being Jacobian of x."
-        mshape = self._mshape(output)
-        if mshape == (None, None):
-            return self.__class__(mshape, s=np.asarray(0.))
-        else:
-            n, m = mshape
-            if n is None:
-                n = 1
-            if m is None:
-                m = 1
-            return self.__class__(mshape, M=csr_matrix((n, m)))
+        return self.__class__(self._mshape(output), M=zero_matrix)
 
     def _mshape(self, output):
         if output.shape:
@@ -263,30 +921,43 @@ class sdcsr(object):
             np.ones(n), np.zeros(n), np.arange(
                 n + 1), (n, 1))
         if self.M is None:
-            return B
+            return intern_csr(B)
         else:
-            return B * self.M
+            return intern_csr(B * self.M)
+
+    def _broadcast_to(self, mshape, p):
+        r"Return :math:`diag(\mathbf{p}) \cdot \mathbf{B} \cdot \mathbf{M}`, with B broadcasting single row of M to mshape"
+        M = self.M
+        threshold = self.lowrank_threshold
+        if threshold is not None and M is not None and mshape[0] is not None and M.indptr[
+                -1] >= threshold:
+            p = np.asarray(p)
+            U = np.empty((mshape[0], 1), dtype=p.dtype)
+            U[:, 0] = p
+            return lowrank_sdcsr(mshape, self.__class__(mshape, M=zero_matrix), U, (M,))
+        return self.new(mshape, p, self._broadcast(mshape[0]))
 
     def broadcast(self, output):
         r"Return broadcast matrix :math:`\mathbf{B_{output}}` for broadcasting x to output, this matrix being Jacobian of x"
         mshape = self._mshape(output)
         if mshape[0] == self.mshape[0]:
             return self
-        return self.__class__(
-            mshape, s=self.s, diag=self.diag, M=self._broadcast(mshape[0]))
+        if self.iszero:
+            return self.zero(output)
+        return self._broadcast_to(mshape, self.s * self.diag)
 
     def chain(self, output, x):
         r"""Apply chain rule for elementwise operation
 
         Jacobian of elementwise operation is :math:`diag(\mathbf{x})`. Return :math:`diag(\mathbf{B_{output}} \cdot \mathbf{x})\cdot\mathbf{B_{output}}\cdot\mathbf{self}`
         """
+        if self.iszero or _iszero(x):
+            return self.zero(output)
         diag = (self.s * x) * self.diag
         mshape = self._mshape(output)
         if mshape[0] != self.mshape[0]:
-            M = self._broadcast(mshape[0])
-        else:
-            M = self.M
-        return self.new(mshape, diag, M)
+            return self._broadcast_to(mshape, diag)
+        return self.new(mshape, diag, self.M)
 
     @classmethod
     def fma(cls, output, *terms):
@@ -295,77 +966,559 @@ class sdcsr(object):
 
         Returns sum(d.chain(output,x) for x,d in terms)
         """
+        nonzero = _nonzero_terms(terms)
+        if not nonzero:
+            return terms[0][1].zero(output)
+        if len(nonzero) == 1:
+            return nonzero[0][1].chain(output, nonzero[0][0])
+        terms = nonzero
         xfirst, dfirst = terms[0]
         if output.shape:
             mshape = (output.shape[0], dfirst.mshape[1])
         else:
             mshape = (None, dfirst.mshape[1])
         M = dfirst.M
-        if all(d.M is M for x, d in terms[1:]):
+        if all(d.M is M and not isinstance(d, lowrank_sdcsr) for x, d in terms):
             diag = sum((d.s * x) * d.diag for x, d in terms)
             if mshape[0] != dfirst.mshape[0]:
-                M = dfirst._broadcast(mshape[0])
+                return dfirst._broadcast_to(mshape, diag)
             return cls.new(mshape, diag, M)
-        v = dfirst.chain(output, xfirst).tovalue()
-        for x, d in terms[1:]:
-            v = v + d.chain(output, x).tovalue()
+        return cls._sum(mshape, [d.chain(output, x) for x, d in terms])
+
+    @classmethod
+    def _sum(cls, mshape, parts):
+        "Return sum of nonzero Jacobians parts, which do not share general part"
+        if any(isinstance(d, lowrank_sdcsr) for d in parts):
+            return lowrank_sdcsr.combine(mshape, parts)
+        v = parts[0].tovalue()
+        for d in parts[1:]:
+            v = csr_add(v, d.tovalue())
         return cls(mshape, M=v)
 
     fma2 = fma
 
     def __add__(self, other):
+        if other.iszero:
+            return self
+        if self.iszero:
+            return other
+        if isinstance(other, lowrank_sdcsr):
+            return other + self
         if other.M is self.M:
             return self.new(self.mshape, self.s * self.diag +
                             other.s * other.diag, self.M)
         else:
-            return self.__class__(
-                self.mshape, M=self.tovalue() + other.tovalue())
+            return self._sum(self.mshape, [self, other])
 
     def __repr__(self):
         return '<sdcsr mshape=%r s=%r diag=%r M=%r>' % (
             self.mshape, self.s, self.diag, self.M)
 
+    def __reduce_ex__(self, protocol):
+        # factored form is kept, the cached value is not pickled
+        M = self.M
+        if scipy_sparse.issparse(M) and not isinstance(M, csr_matrix):
+            M = csr_matrix.fromcsr(M)
+        return (_rebuild_sdcsr, (self.__class__, self.mshape, self.s, self.diag, M))
+
     def rdot(self, y, other):
         r"Return Jacobian of :math:`\mathbf{y} = \mathbf{other} \cdot \mathbf{self}`, with :math:`\cdot` denoting matrix multiplication."
-        d = csr_matrix.fromcsr(other) * self.tovalue()
+        if self.iszero:
+            return self.zero(y)
+        d = csr_matmul(csr_matrix.fromcsr(other), self.tovalue())
         if d.shape:
             return self.__class__(d.shape, M=d)
         else:
             return self.__class__((None, self.mshape[1]), s=d)
 
+    def sparsesum(self, output, plan):
+        "Return Jacobian of output, which is sum of entries of x by sparsesum_plan plan, this matrix being Jacobian of x"
+        if self.iszero:
+            return self.zero(output)
+        M = plan.reduce_rows(csr_matrix.fromcsr(self.tovalue()))
+        return self.__class__(M.shape, M=M)
+
+    def dot_data(self, y, structure, x):
+        r"Return Jacobian of :math:`\mathbf{y} = \mathbf{A} \cdot \mathbf{x}` with respect to A, with A having CSR structure, and this matrix being Jacobian of A.data"
+        if self.iszero:
+            return self.zero(y)
+        D = structure.dot_data(x, self.s * self.diag)
+        if self.M is not None:
+            D = csr_matmul(D, self.M)
+        return self.__class__(D.shape, M=D)
+
     def sum(self):
         "Return Jacobian of y=sum(x), this matrix being Jacobian of x"
+        if self.iszero:
+            return self.__class__((None, self.mshape[1]), M=zero_matrix)
         v = self.tovalue()
         mshape = (None, self.mshape[1])
         if v.shape:
             return self.__class__(
-                mshape, M=csr_matrix(self.tovalue().sum(axis=0)))
+                mshape, M=intern_csr(csr_matrix(self.tovalue().sum(axis=0))))
         else:
             return self.__class__(mshape, s=v)
 
+    def cumsum(self, output):
+        "Return Jacobian of output=cumsum(x), this matrix being Jacobian of x"
+        if self.iszero:
+            return self.zero(output)
+        if self.mshape[0] is None:
+            return self.broadcast(output)
+        return self.__class__(self._mshape(output), M=csr_cumsum(self.tovalue()))
+
     def vstack(self, output, parts):
         "Return Jacobian of output=hstack(parts)"
         mshape = self._mshape(output)
+        parts = list(parts)
+        if all(p.iszero for p in parts):
+            return self.__class__(mshape, M=zero_matrix)
         M = scipy_sparse.vstack(_stackconv(p.tovalue()) for p in parts).tocsr()
         return self.new(mshape, M=M)
 
+    def factors(self):
+        r"Return (S, U, V), such that this matrix is :math:`\mathbf{S} + \mathbf{U} \cdot \mathbf{V}^T`, with S being CSR matrix and U, V dense"
+        S = self.tovalue()
+        dtype = S.dtype
+        return S, np.zeros((S.shape[0], 0), dtype=dtype), np.zeros(
+            (S.shape[1], 0), dtype=dtype)
+
+    def aslinearoperator(self):
+        "Return this matrix as scipy LinearOperator"
+        return impl.scipy.sparse.linalg.aslinearoperator(self.tovalue())
+
+
+def _nonzero_terms(terms):
+    "Return terms (x,d) of fma, which are not exactly zero"
+    return tuple((x, d) for x, d in terms if not (d.iszero or _iszero(x)))
+
+
+def _rebuild_sdcsr(cls, mshape, s, diag, M):
+    self = cls.__new__(cls)
+    sdcsr.__init__(self, mshape, s=s, diag=diag, M=M)
+    return self
+
+
+def _scale_rows(U, x):
+    "Return diag(x)*U for dense U, with x being scalar or vector"
+    x = np.asarray(x)
+    if x.shape:
+        return x[:, np.newaxis] * U
+    return x * U
+
+
+class lowrank_sdcsr(sdcsr):
+    r"""
+    Matrix stored as sum of sparse and low rank parts
+
+    .. math::
+
+       \mathbf{S} + \mathbf{U} \cdot \mathbf{W}
+
+    where S is sdcsr, U is dense matrix of shape (n,k) and W is CSR matrix of
+    shape (k,m), stored as tuple rows of single row matrices. This results from
+    broadcasting scalars depending on many entries, for example in x-mean(x),
+    which would be dense n x m matrix otherwise. Elementwise operations, sums,
+    indexing and products by constant matrices are applied to S and U, with rows
+    of W shared. Columns of U for the same row of W are merged. Other operations,
+    and tovalue, assemble the matrix.
+
+    The factors are returned by factors(), for use in Sherman-Morrison-Woodbury
+    formula, and aslinearoperator() returns the matrix without assembling it.
+    """
+
+    def __init__(self, mshape, S, U, rows):
+        super(lowrank_sdcsr, self).__init__(mshape)
+        self.S = S
+        self.U = U
+        self.rows = tuple(rows)
+        self._W = None
+
+    @property
+    def W(self):
+        "Matrix W, stacked from rows"
+        if self._W is None:
+            if len(self.rows) == 1:
+                self._W = self.rows[0]
+            else:
+                self._W = csr_matrix.fromcsr(
+                    scipy_sparse.vstack(self.rows, format='csr'))
+        return self._W
+
+    @property
+    def nbytes(self):
+        W = 0 if len(self.rows) == 1 else _nbytes(self._W)
+        return self.S.nbytes + self.U.nbytes + sum(
+            _nbytes(r) for r in self.rows) + W + _nbytes(self._value)
+
+    @classmethod
+    def create(cls, mshape, S, U, rows):
+        "Return S+U*W as lowrank_sdcsr, or as sdcsr if rank is zero or output is scalar"
+        if not U.shape[1]:
+            return S
+        self = cls(mshape, S, U, rows)
+        if mshape[0] is None:
+            M = csr_matmul(csr_matrix(U.reshape(1, -1)), self.W)
+            return S + S.__class__(mshape, M=M)
+        return self
+
+    @classmethod
+    def combine(cls, mshape, parts):
+        "Return sum of parts, being sdcsr or lowrank_sdcsr"
+        S = None
+        U = []
+        rows = []
+        for p in parts:
+            if not isinstance(p, lowrank_sdcsr):
+                S = p if S is None else S + p
+                continue
+            S = p.S if S is None else S + p.S
+            for j, w in enumerate(p.rows):
+                u = p.U[:, j:j + 1]
+                for i, r in enumerate(rows):
+                    if r is w:
+                        U[i] = U[i] + u
+                        break
+                else:
+                    U.append(u)
+                    rows.append(w)
+        return cls.create(mshape, S, np.hstack(U), rows)
+
+    @property
+    def iszero(self):
+        return False
+
+    def zero(self, output):
+        return self.S.zero(output)
+
+    def _evaluate(self):
+        UW = csr_matmul(csr_matrix(self.U), self.W)
+        return csr_add(self.S.tovalue(), UW)
+
+    def tovalue(self, out=None):
+        if out is not None:
+            return csr_assign(out, self.tovalue())
+        if self._value is None:
+            self._value = self._evaluate()
+        return self._value
+
+    def _assembled(self):
+        return self.S.__class__(self.mshape, M=self.tovalue())
+
+    def factors(self):
+        return self.S.tovalue(), self.U, self.W.T.toarray()
+
+    def aslinearoperator(self):
+        S = self.S.tovalue()
+        U = self.U
+        W = self.W
+        return impl.scipy.sparse.linalg.LinearOperator(
+            S.shape, matvec=lambda v: S.dot(v) + U.dot(W.dot(v)),
+            rmatvec=lambda v: S.conj().T.dot(v) + W.conj().T.dot(U.conj().T.dot(v)),
+            dtype=np.result_type(S.dtype, U.dtype, W.dtype))
+
+    def getitem_general(self, output, idx):
+        mshape = self._mshape(output)
+        return self.create(mshape, self.S.getitem_general(
+            output, idx), np.atleast_2d(self.U[idx]), self.rows)
+
+    def getitem_arrayp(self, output, idx):
+        return self.create(self._mshape(output), self.S.getitem_arrayp(
+            output, idx), np.take(self.U, idx, axis=0), self.rows)
+
+    def getitem_plan(self, output, plan):
+        return self.create(self._mshape(output), self.S.getitem_plan(
+            output, plan), np.take(self.U, plan.normalized(self.mshape[0]), axis=0), self.rows)
+
+    def broadcast(self, output):
+        return self
+
+    def chain(self, output, x):
+        if _iszero(x):
+            return self.zero(output)
+        return self.create(self._mshape(output), self.S.chain(
+            output, x), _scale_rows(self.U, x), self.rows)
+
+    @classmethod
+    def fma(cls, output, *terms):
+        nonzero = _nonzero_terms(terms)
+        if not nonzero:
+            return terms[0][1].zero(output)
+        return cls.combine(nonzero[0][1]._mshape(output), [
+            d.chain(output, x) for x, d in nonzero])
+
+    fma2 = fma
+
+    def __add__(self, other):
+        if other.iszero:
+            return self
+        return self.combine(self.mshape, [self, other])
+
+    def __repr__(self):
+        return '<lowrank_sdcsr mshape=%r S=%r U=%r rows=%r>' % (
+            self.mshape, self.S, self.U, self.rows)
+
+    def __reduce_ex__(self, protocol):
+        return (lowrank_sdcsr, (self.mshape, self.S, self.U, self.rows))
+
+    def rdot(self, y, other):
+        other = csr_matrix.fromcsr(other)
+        return self.create(self._mshape(y), self.S.rdot(y, other),
+                           np.atleast_2d(other.dot(self.U)), self.rows)
+
+    def sparsesum(self, output, plan):
+        U = np.column_stack([plan.reduce(u) for u in self.U.T])
+        return self.create(self._mshape(output),
+                           self.S.sparsesum(output, plan), U, self.rows)
+
+    def dot_data(self, y, structure, x):
+        return self._assembled().dot_data(y, structure, x)
+
+    def sum(self):
+        return self.create((None, self.mshape[1]), self.S.sum(),
+                           np.sum(self.U, axis=0)[np.newaxis, :], self.rows)
+
+    def cumsum(self, output):
+        return self.create(self._mshape(output), self.S.cumsum(output),
+                           np.cumsum(self.U, axis=0), self.rows)
+
+    def vstack(self, output, parts):
+        return self._assembled().vstack(output, parts)
+
+
+def _todense(d):
+    "Return Jacobian d as dense array"
+    if isinstance(d, dense_sdcsr):
+        return d.dense()
+    return d.tovalue().toarray()
+
+
+def _dense_tocsr(D):
+    "Return CSR matrix with all entries of dense 2d array D, including zeros"
+    n, k = D.shape
+    indices = np.tile(np.arange(k, dtype=index_dtype), n)
+    indptr = k * np.arange(n + 1, dtype=index_dtype)
+    return csr_matrix.fromarrays(np.ascontiguousarray(D).ravel(), indices, indptr, (n, k))
+
+
+class dense_sdcsr(sdcsr):
+    """
+    This is a variant of matrix with general part M stored as dense array
+
+    It is used for derivatives with respect to few variables, such as parameters
+    of a model, when Jacobians have few columns and are mostly dense. M is
+    always given as array of shape (n,k), possibly a broadcast view. Chain rule
+    is then applied by broadcasting multiplications and products by dense
+    arrays, without building CSR matrices. tovalue converts the result to CSR
+    matrix with all n*k entries stored, so that its pattern does not depend on
+    values.
+
+    seed uses this variant when the number of columns is at most max_columns,
+    and the initial Jacobian is mostly dense.
+    """
+
+    max_columns = 16
+    lowrank_threshold = None
+
+    def _scaling(self):
+        p = self.s * self.diag
+        if p.shape:
+            return p[:, np.newaxis]
+        return p
+
+    def _broadcast_columns(self):
+        "Return nonzero columns of M, if M is broadcast single row with few nonzero entries"
+        M = self.M
+        if M.shape[0] > 1 and M.strides[0] == 0:
+            columns = np.flatnonzero(M[0])
+            if 2 * len(columns) <= M.shape[1]:
+                return columns
+        return None
+
+    def dense(self):
+        "Return this matrix as dense array of shape (n,k), with n=1 for scalar"
+        if self.iszero:
+            n, m = self.mshape
+            return np.zeros((1 if n is None else n, 1 if m is None else m))
+        p = self._scaling()
+        columns = self._broadcast_columns()
+        if columns is not None:
+            row = self.M[0]
+            out = np.zeros(self.M.shape, dtype=np.result_type(p, row))
+            out[:, columns] = p * row[columns]
+            return out
+        return p * self.M
+
+    def _addto(self, out, work):
+        "Add this matrix to dense array out, using work as temporary array of the same shape. Return (out, work)."
+        p = self._scaling()
+        dtype = np.result_type(p, self.M)
+        if not np.can_cast(dtype, out.dtype):
+            return out + p * self.M, work
+        columns = self._broadcast_columns()
+        if columns is not None:
+            out[:, columns] += p * self.M[0, columns]
+            return out, work
+        if work is None or work.dtype != dtype:
+            work = np.empty(out.shape, dtype=dtype)
+        np.multiply(p, self.M, out=work)
+        out += work
+        return out, work
+
+    def _evaluate(self):
+        if self.iszero:
+            return self._evaluate_zero()
+        return _dense_tocsr(self.dense())
+
+    def tovalue(self, out=None):
+        if out is not None:
+            return csr_assign(out, self._evaluate())
+        return super(dense_sdcsr, self).tovalue()
+
+    def getitem_general(self, output, idx):
+        if self.iszero:
+            return self.zero(output)
+        M = np.atleast_2d(self.M[idx])
+        diag = np.asarray(self.diag[idx]) if self.diag.shape else self.diag
+        return self.__class__(self._mshape(output), s=self.s, diag=diag, M=M)
+
+    def getitem_arrayp(self, output, idx):
+        if self.iszero:
+            return self.zero(output)
+        if self.diag.shape:
+            p = self.s * np.take(self.diag, idx)
+        else:
+            p = self.s * self.diag
+        return self.new(self._mshape(output), p, np.take(self.M, idx, axis=0))
+
+    def getitem_plan(self, output, plan):
+        return self.getitem_arrayp(output, plan.normalized(self.mshape[0]))
+
+    def _broadcast(self, n):
+        if n is None:
+            n = 1
+        return np.broadcast_to(self.M, (n, self.M.shape[1]))
+
+    @classmethod
+    def _sum(cls, mshape, parts):
+        M = _todense(parts[0])
+        work = None
+        for d in parts[1:]:
+            if d.iszero:
+                continue
+            if isinstance(d, dense_sdcsr):
+                M, work = d._addto(M, work)
+            else:
+                M = M + _todense(d)
+        return cls(mshape, M=M)
+
+    def rdot(self, y, other):
+        if self.iszero:
+            return self.zero(y)
+        return self.__class__(self._mshape(y), M=np.atleast_2d(
+            csr_matrix.fromcsr(other).dot(self.dense())))
+
+    def sparsesum(self, output, plan):
+        if self.iszero:
+            return self.zero(output)
+        return self.__class__(self._mshape(output),
+                              M=plan.matrix().dot(self.dense()))
+
+    def dot_data(self, y, structure, x):
+        if self.iszero:
+            return self.zero(y)
+        D = structure.dot_data(x, self.s * self.diag)
+        return self.__class__(self._mshape(y), M=D.dot(self.M))
+
+    def sum(self):
+        mshape = (None, self.mshape[1])
+        if self.iszero:
+            return self.__class__(mshape, M=zero_matrix)
+        return self.__class__(mshape, M=np.sum(
+            self.dense(), axis=0)[np.newaxis, :])
+
+    def cumsum(self, output):
+        if self.iszero:
+            return self.zero(output)
+        if self.mshape[0] is None:
+            return self.broadcast(output)
+        return self.__class__(self._mshape(output),
+                              M=np.cumsum(self.dense(), axis=0))
+
+    def vstack(self, output, parts):
+        parts = list(parts)
+        if all(p.iszero for p in parts):
+            return self.zero(output)
+        return self.__class__(self._mshape(output),
+                              M=np.vstack([_todense(p) for p in parts]))
+
 
 class sparsity_csr(sdcsr):
-    "This is a variant of matrix only propagating sparsity information"
+    """
+    This is a variant of matrix only propagating sparsity information
+
+    M is stored as csr_pattern, without data. Numerical values (ones) are only
+    generated by tovalue. The pattern does not depend on values, therefore only
+    Jacobians of constants are treated as zero.
+    """
+
+    lowrank_threshold = None
 
     def __init__(self, mshape, s=None, diag=None, M=None):
-        if M is not None:
-            if not isinstance(M, scipy_sparse.csr_matrix):
-                M = csr_matrix(M)
-            M.sort_indices()
-            M.data.fill(1)
+        if M is not None and M is not zero_matrix and not isinstance(
+                M, csr_pattern):
+            M = csr_pattern.fromcsr(M)
         super(sparsity_csr, self).__init__(mshape, M=M)
 
+    def _pattern(self):
+        if self.iszero:
+            n, m = self.mshape
+            return csr_pattern.empty((1 if n is None else n, 1 if m is None else m))
+        if self.M is not None:
+            return self.M
+        return csr_pattern.identity(
+            1 if self.mshape[0] is None else self.mshape[0])
+
+    def _evaluate(self):
+        if self.iszero:
+            return self._evaluate_zero()
+        if self.M is None and self.mshape == (None, None):
+            return self.s * self.diag
+        return self._pattern().tocsr()
+
+    def getitem_general(self, output, idx):
+        if self.iszero:
+            return self.zero(output)
+        return self.__class__(self._mshape(output), M=self._pattern()[idx])
+
+    def getitem_arrayp(self, output, idx):
+        mshape = self._mshape(output)
+        if self.iszero:
+            return self.zero(output)
+        if self.M is None:
+            return self.__class__(mshape, M=csr_pattern(
+                idx, np.arange(len(idx) + 1), (len(idx), self.mshape[1])))
+        return self.__class__(mshape, M=self.M.getrows(idx))
+
+    def getitem_plan(self, output, plan):
+        return self.getitem_arrayp(output, plan.normalized(self.mshape[0]))
+
+    def _broadcast(self, n):
+        if n is None:
+            n = 1
+        if self.M is None:
+            return csr_pattern(np.zeros(n), np.arange(n + 1), (n, 1))
+        return self.M.getrows(np.zeros(n, dtype=index_dtype))
+
     def chain(self, output, x):
         return self.broadcast(output)
 
     @classmethod
     def fma(cls, output, *terms):
+        nonzero = tuple((x, d) for x, d in terms if not d.iszero)
+        if not nonzero:
+            return terms[0][1].zero(output)
+        terms = nonzero
         xfirst, dfirst = terms[0]
         if output.shape:
             mshape = (output.shape[0], dfirst.mshape[1])
@@ -376,20 +1529,48 @@ class sparsity_csr(sdcsr):
             if mshape[0] != dfirst.mshape[0]:
                 M = dfirst._broadcast(mshape[0])
             return cls.new(mshape, M=M)
-        v = dfirst.chain(output, xfirst).tovalue()
+        M = dfirst.broadcast(output)._pattern()
         for x, d in terms[1:]:
-            v = v + d.chain(output, x).tovalue()
-        return cls(mshape, M=v)
+            M = M.union(d.broadcast(output)._pattern())
+        return cls(mshape, M=M)
 
     fma2 = fma
 
+    def __add__(self, other):
+        if other.M is self.M or other.iszero:
+            return self
+        if self.iszero:
+            return other
+        return self.__class__(
+            self.mshape, M=self._pattern().union(other._pattern()))
+
     def rdot(self, y, other):
-        # must convert other to sparsity pattern, otherwise cancellation could
-        # occur
-        x = csr_matrix(other).sorted_indices()
-        x.data.fill(1.)
-        d = x.dot(self.tovalue())
-        if d.shape:
-            return self.__class__(d.shape, M=d)
-        else:
-            return self.__class__((None, self.mshape[1]), s=d)
+        # pattern product is symbolic, therefore no cancellation can occur
+        if self.iszero:
+            return self.zero(y)
+        M = csr_pattern.fromcsr(other).dot(self._pattern())
+        return self.__class__(M.shape, M=M)
+
+    def sparsesum(self, output, plan):
+        return self.rdot(output, plan.matrix())
+
+    def dot_data(self, y, structure, x):
+        if self.iszero:
+            return self.zero(y)
+        D = csr_pattern(structure.entries, structure.indptr,
+                        (structure.shape[0], structure.nnz))
+        M = D.dot(self._pattern())
+        return self.__class__(M.shape, M=M)
+
+    def sum(self):
+        mshape = (None, self.mshape[1])
+        if self.mshape[0] is None or self.iszero:
+            return self.__class__(mshape, M=self.M)
+        return self.__class__(mshape, M=self._pattern().sum())
+
+    def vstack(self, output, parts):
+        parts = list(parts)
+        if all(p.iszero for p in parts):
+            return self.zero(output)
+        return self.__class__(self._mshape(output), M=csr_pattern.vstack(
+            p._pattern() for p in parts))
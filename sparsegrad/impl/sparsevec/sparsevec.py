@@ -19,7 +19,7 @@
 "This module contains implementation details of summing sparse vectors."
 
 import numpy as np
-from sparsegrad.impl.sparse import csr_matrix
+from sparsegrad.impl.sparse import csr_matrix, csc_matrix, csr_pattern, same_pattern, index_dtype, readonly_cached
 
 
 class sparsevec(object):
@@ -35,8 +35,173 @@ class sparsevec(object):
         self.shape = (n,)
 
 
+# plans for read-only index arrays, by ids of the arrays
+_plans = {}
+
+
+def _counting_order(keys, nkeys):
+    """
+    Return (order, indptr) of stable sort of integer keys in range(nkeys)
+
+    Entries order[indptr[k]:indptr[k+1]] have key k. The sort is a conversion of
+    CSC to CSR matrix, which is counting sort in linear time.
+    """
+    n = len(keys)
+    A = csc_matrix((np.zeros(n, dtype=bool), keys, np.arange(
+        n + 1, dtype=index_dtype)), shape=(nkeys, n)).tocsr()
+    return A.indices, A.indptr
+
+
+class sparsesum_plan(object):
+    """
+    Plan of summing sparse vectors of length n with fixed indices of entries
+
+    Values are summed by np.bincount over the concatenated indices idx. The
+    first Jacobian with given pattern is summed by conversion to CSC and back,
+    as in single use. When the pattern repeats, entries are sorted once by
+    (index, column) with stable counting sorts, and the following Jacobians are
+    summed by np.add.reduceat without any conversions.
+
+    Parameters
+    ----------
+    n : int
+        length of vectors
+    idx : list of index arrays
+        indices of entries of terms, in order of terms
+    compressed : bool
+        whether the result is sparse vector (return_sparse in sparsesum)
+    """
+
+    def __init__(self, n, idx, compressed=False):
+        self.n = n
+        self.compressed = compressed
+        idx = np.hstack([np.atleast_1d(i) for i in idx]).astype(
+            index_dtype) if len(idx) else np.zeros(0, dtype=index_dtype)
+        if len(idx) and (np.amin(idx) < 0 or np.amax(idx) >= n):
+            raise ValueError('indices out of range')
+        self.idx = idx
+        counts = np.bincount(idx, minlength=n)
+        self.owners = np.flatnonzero(counts)
+        if compressed:
+            rank = np.cumsum(counts > 0) - 1
+            self.rows = np.take(rank, idx).astype(index_dtype)
+        else:
+            self.rows = idx
+        self._seen = None
+        self._pattern = None
+        self._segments = None
+        self._placement = None
+
+    @classmethod
+    def cached(cls, n, idx, compressed=False):
+        "Return plan for read-only index arrays idx, or None if any is writeable"
+        return readonly_cached(_plans, (cls, n, compressed), idx,
+                               lambda: cls(n, idx, compressed))
+
+    @property
+    def size(self):
+        "Length of the result"
+        return len(self.owners) if self.compressed else self.n
+
+    @property
+    def unique(self):
+        "Return if indices of entries are unique"
+        return len(self.owners) == len(self.idx)
+
+    def reduce(self, v):
+        "Return sum of entries v, in order of concatenated idx"
+        v = np.asarray(v)
+        if v.dtype.kind == 'f':
+            return np.bincount(self.rows, weights=v,
+                               minlength=self.size).astype(v.dtype, copy=False)
+        if v.dtype.kind == 'c':
+            return self.reduce(v.real) + 1j * self.reduce(v.imag)
+        return csr_matrix((v, self.rows, np.asarray(
+            [0, len(self.rows)])), shape=(1, self.size)).toarray().ravel()
+
+    def _convert(self, J):
+        M = J.tocsc()
+        M = csc_matrix((M.data, np.take(self.rows, M.indices),
+                        M.indptr), shape=(self.size, M.shape[1]))
+        M.sort_indices()
+        return csr_matrix.fromcsr(M.tocsr())
+
+    def _analyse(self, J):
+        nnz = J.indptr[-1]
+        indices = J.indices[:nnz]
+        rows = np.repeat(self.rows, np.diff(J.indptr))
+        by_column, _ = _counting_order(indices, J.shape[1])
+        by_row, indptr = _counting_order(np.take(rows, by_column), self.size)
+        perm = np.take(by_column, by_row)
+        columns = np.take(indices, perm)
+        first = np.ones(nnz, dtype=bool)
+        first[1:] = columns[1:] != columns[:-1]
+        first[indptr[:-1][np.diff(indptr) > 0]] = True
+        starts = np.flatnonzero(first)
+        pattern = csr_pattern(J.indices, J.indptr, J.shape)
+        self._pattern = (pattern, perm, starts, np.take(columns, starts),
+                         np.searchsorted(starts, indptr).astype(index_dtype))
+
+    def reduce_rows(self, J):
+        """
+        Return CSR matrix, with rows being sums of rows of J, in order of concatenated idx
+
+        The sort of entries is made on the second use of the pattern of J, and
+        cached while the pattern does not change. Only the pattern of J is kept.
+        """
+        if self._pattern is None or not same_pattern(self._pattern[0], J):
+            if not same_pattern(self._seen, J):
+                self._seen = csr_pattern(J.indices, J.indptr, J.shape)
+                return self._convert(J)
+            self._analyse(J)
+        _, perm, starts, indices, indptr = self._pattern
+        data = J.data[:J.indptr[-1]]
+        if len(data):
+            data = np.add.reduceat(np.take(data, perm), starts)
+        return csr_matrix.fromarrays(data, indices, indptr, (self.size, J.shape[1]))
+
+    def segments(self):
+        """
+        Return (order, indptr), with entries order[indptr[k]:indptr[k+1]] summed into k-th entry of the result
+
+        Entries are in order of concatenated idx within each segment.
+        """
+        if self._segments is None:
+            self._segments = _counting_order(self.rows, self.size)
+        return self._segments
+
+    def reduceat(self, v, ufunc, initial):
+        "Return reduction of entries v by ufunc, with initial being the value of empty segments"
+        v = np.asarray(v)
+        order, indptr = self.segments()
+        y = np.full(self.size, initial, dtype=v.dtype)
+        if len(v):
+            starts = np.take(indptr, self.nonempty)
+            y[self.nonempty] = ufunc.reduceat(np.take(v, order), starts)
+        return y
+
+    @property
+    def nonempty(self):
+        "Indices of nonempty segments of the result"
+        return np.arange(len(self.owners)) if self.compressed else self.owners
+
+    def placement(self):
+        "Return plan placing one entry for each nonempty segment into the result"
+        if self._placement is None:
+            self._placement = sparsesum_plan(
+                self.size, [self.nonempty], self.compressed)
+        return self._placement
+
+    def matrix(self):
+        "Return matrix S, such that sum of entries v is S*v"
+        order, indptr = self.segments()
+        return csr_matrix.fromarrays(np.ones(len(self.idx)), order, indptr,
+                                     (self.size, len(self.idx)))
+
+
 def sparsesum(terms, hstack=np.hstack, nvalue=lambda x: x,
-              wrap=lambda idx, v, y: y, check_unique=False, return_sparse=False):
+              wrap=lambda plan, v, y: y, check_unique=False, return_sparse=False,
+              plan=None):
     """
     Sum sparse vectors
 
@@ -52,36 +217,116 @@ def sparsesum(terms, hstack=np.hstack, nvalue=lambda x: x,
         function to use for concatenating vectors
     nvalue : callable(vector)
         function to use for extracting numerical value
-    wrap : callable(idx, v, result)
-        function to use for wrapping the result, with idx, v being concatenated inputs
+    wrap : callable(plan, v, result)
+        function to use for wrapping the result, with v being concatenated values
+        and plan being sparsesum_plan
     check_unique : bool
         whether to perform test for double assignments (useful when this function is
         used to replace item assignment)
     return_sparse : bool
         whether to calculate sparse results
+    plan : sparsesum_plan, optional
+        plan built for indices of terms. Plans are cached automatically when
+        indices of terms are read-only arrays.
     """
     terms = list(terms)
     n, = terms[0].shape
     if not all(t.shape == (n,) for t in terms[1:]):
         raise ValueError('different shapes of terms')
     idx, v = zip(*((t.idx, t.v) for t in terms))
-    idx = np.hstack(idx)
+    if plan is None:
+        plan = sparsesum_plan.cached(n, idx, return_sparse)
+    if plan is None:
+        plan = sparsesum_plan(n, idx, return_sparse)
+    elif plan.n != n or plan.compressed != bool(return_sparse):
+        raise ValueError('plan does not match terms')
     v = hstack(v)
-    if check_unique:
-        if len(np.unique(idx)) < len(idx):
-            raise ValueError('indices not unique')
-
-    def process_dense(n, idx, v):
-        y = csr_matrix((nvalue(v), idx, np.asarray(
-            [0, len(idx)])), shape=(1, n)).toarray().ravel()
-        return wrap(idx, v, y)
-
-    def process_compressed(n, idx, v):
-        cidx = np.unique(idx)
-        idx = np.searchsorted(cidx, idx)
-        v = process_dense(len(cidx), idx, v)
-        return sparsevec(n, cidx, v)
+    if check_unique and not plan.unique:
+        raise ValueError('indices not unique')
+    y = wrap(plan, v, plan.reduce(nvalue(v)))
     if return_sparse:
-        return process_compressed(n, idx, v)
-    else:
-        return process_dense(n, idx, v)
+        return sparsevec(n, plan.owners, y)
+    return y
+
+
+def segment_plan(segment_ids, n, plan=None):
+    "Return sparsesum_plan for reductions of entries with segment_ids into vector of length n"
+    if plan is None:
+        segment_ids = np.asarray(segment_ids)
+        plan = sparsesum_plan.cached(n, [segment_ids])
+    if plan is None:
+        plan = sparsesum_plan(n, [segment_ids])
+    elif plan.n != n or plan.compressed:
+        raise ValueError('plan does not match segments')
+    return plan
+
+
+def _segment_values(values, plan):
+    values = np.asarray(values)
+    if values.shape != plan.idx.shape:
+        raise ValueError('values and segment_ids must be vectors of the same length')
+    return values
+
+
+def _initial(dtype, largest):
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        return info.max if largest else info.min
+    return np.inf if largest else -np.inf
+
+
+def segment_selection(plan, values, y):
+    """
+    Return indices of entries of values equal to y of their segments, one for each nonempty segment
+
+    For ties, the first entry is returned. This gives derivatives of segment_max and segment_min.
+    """
+    order, indptr = plan.segments()
+    counts = np.diff(indptr)[plan.nonempty]
+    v = np.take(values, order)
+    m = np.repeat(np.take(y, plan.nonempty), counts)
+    pos = np.flatnonzero((v == m) | ((m != m) & (v != v)))
+    segment = np.repeat(np.arange(len(counts)), counts)[pos]
+    first = np.ones(len(pos), dtype=bool)
+    first[1:] = segment[1:] != segment[:-1]
+    return np.take(order, pos[first])
+
+
+def segment_others(plan, values):
+    "Return products of entries of values in their segments, excluding the entry itself"
+    if not len(values):
+        return np.ones(0, dtype=values.dtype)
+    zero = values == 0
+    nonzero = plan.reduceat(np.where(zero, 1, values), np.multiply, 1)
+    zeros = plan.reduce(zero.astype(int))
+    p = np.take(nonzero, plan.rows)
+    z = np.take(zeros, plan.rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = np.where(z == 0, p / np.where(zero, 1, values), 0)
+    return np.where(zero & (z == 1), p, w)
+
+
+def segment_sum(values, segment_ids, n, plan=None):
+    "Return vector y of length n, with y[k] being the sum of values[segment_ids == k]"
+    plan = segment_plan(segment_ids, n, plan)
+    return plan.reduce(_segment_values(values, plan))
+
+
+def segment_prod(values, segment_ids, n, plan=None):
+    "Return vector y of length n, with y[k] being the product of values[segment_ids == k]"
+    plan = segment_plan(segment_ids, n, plan)
+    return plan.reduceat(_segment_values(values, plan), np.multiply, 1)
+
+
+def segment_max(values, segment_ids, n, plan=None):
+    "Return vector y of length n, with y[k] being the maximum of values[segment_ids == k], or -inf (the minimum of integer dtype) if there are no such values"
+    plan = segment_plan(segment_ids, n, plan)
+    values = _segment_values(values, plan)
+    return plan.reduceat(values, np.maximum, _initial(values.dtype, False))
+
+
+def segment_min(values, segment_ids, n, plan=None):
+    "Return vector y of length n, with y[k] being the minimum of values[segment_ids == k], or inf (the maximum of integer dtype) if there are no such values"
+    plan = segment_plan(segment_ids, n, plan)
+    values = _segment_values(values, plan)
+    return plan.reduceat(values, np.minimum, _initial(values.dtype, True))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains thread pool used to split sparse matrix kernels by row ranges.
+
+numpy and scipy.sparse release GIL in the heavy array operations, therefore
+large kernels scale with the number of threads. Kernels operating on less than
+threshold nonzeros are run serially.
+
+The default number of threads is taken from SPARSEGRAD_THREADS environment
+variable, and is 1 (serial execution) if it is not set.
+"""
+
+import os
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+__all__ = ['settings', 'configure', 'enabled', 'row_chunks', 'map_chunks']
+
+settings = dict(threads=int(os.environ.get('SPARSEGRAD_THREADS', 1)),
+                threshold=1 << 20)
+
+_pool = dict(pool=None, threads=None)
+
+
+def configure(threads=None, threshold=None):
+    """
+    Configure thread pool
+
+    Parameters
+    ----------
+    threads : int, optional
+        number of threads, 1 disables parallel execution
+    threshold : int, optional
+        minimum number of nonzeros in a kernel, for which parallel execution is used
+    """
+    if threads is not None:
+        settings['threads'] = max(int(threads), 1)
+    if threshold is not None:
+        settings['threshold'] = int(threshold)
+
+
+def enabled(nnz):
+    "Return if kernel operating on nnz nonzeros should be run in parallel"
+    return settings['threads'] > 1 and nnz >= settings['threshold']
+
+
+def _get_pool():
+    threads = settings['threads']
+    if _pool['threads'] != threads:
+        if _pool['pool'] is not None:
+            _pool['pool'].close()
+        _pool['pool'] = ThreadPool(threads)
+        _pool['threads'] = threads
+    return _pool['pool']
+
+
+def row_chunks(indptr):
+    """
+    Split rows of CSR matrix with row pointers indptr into ranges of rows with balanced number of nonzeros
+
+    Returns list of (start,stop) row ranges.
+    """
+    nrows = len(indptr) - 1
+    targets = np.linspace(indptr[0], indptr[-1], settings['threads'] + 1)
+    bounds = np.unique(np.searchsorted(indptr, targets[1:-1]))
+    bounds = np.hstack([[0], bounds[(bounds > 0) & (bounds < nrows)], [nrows]])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def map_chunks(func, chunks):
+    "Return [func(start,stop) for start,stop in chunks], evaluated by thread pool"
+    if len(chunks) < 2:
+        return [func(start, stop) for start, stop in chunks]
+    return _get_pool().map(lambda chunk: func(*chunk), chunks)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Memoizing wrappers for scipy.optimize
+
+scipy.optimize calls the residual and the Jacobian through separate callables,
+usually at the same point. The wrapper evaluates the residual with sparsegrad
+once per point, and keeps the value and the Jacobian in a small LRU cache.
+
+Points are looked up by CRC32 fingerprint of their bytes, shape and dtype. A
+cached point is used only if it is bitwise equal to the argument, so that
+collisions of fingerprints do not give wrong results.
+"""
+
+import zlib
+from collections import OrderedDict
+import numpy as np
+from sparsegrad.impl import sparse
+from sparsegrad import forward
+from sparsegrad import functions
+
+__all__ = ['wrap', 'memoized_function']
+
+
+def _fingerprint(x):
+    return (x.shape, x.dtype.str, zlib.crc32(x.view(np.uint8)) & 0xffffffff)
+
+
+def _nbytes(J):
+    if J is None:
+        return 0
+    if isinstance(J, np.ndarray):
+        return J.nbytes
+    return J.data.nbytes + J.indices.nbytes + J.indptr.nbytes
+
+
+class _entry(object):
+    def __init__(self, x, y, seed):
+        self.x = x
+        self.y = y
+        self.seed = seed
+        self.f = np.array(functions.nvalue(y), dtype=np.result_type(x, float))
+        self.J = None
+
+    def same(self, x):
+        return self.x.shape == x.shape and self.x.dtype == x.dtype and \
+            np.array_equal(self.x.view(np.uint8), x.view(np.uint8))
+
+    @property
+    def nbytes(self):
+        # until the Jacobian is assembled, y keeps its unassembled form
+        deriv = getattr(self.y, 'deriv', None)
+        return self.x.nbytes + self.f.nbytes + _nbytes(self.J) + \
+            (deriv.nbytes if deriv is not None else 0)
+
+
+class memoized_function(object):
+    """
+    Matched fun, jac and hessp callables sharing one evaluation per point
+
+    Parameters
+    ----------
+    func : callable(x)
+        function, written for numpy and sparsegrad values
+    maxsize : int
+        maximum number of cached points
+    maxbytes : int, optional
+        maximum memory used by cached points, values and Jacobians. The most
+        recently used point is always kept.
+
+    For vector func, jac returns the Jacobian as CSR matrix, and hessp(x, p)
+    returns the Gauss-Newton approximation J^T J p of the Hessian of
+    0.5 |func(x)|^2 applied to p. It is exact when func is affine, or at its
+    root. hessp is therefore meant for least squares problems, and it is
+    not a Hessian of fun. For scalar func, jac returns the gradient as dense
+    vector, and hessp raises ValueError.
+
+    Counts of evaluations, cache hits and evictions are accumulated in stats.
+    """
+
+    def __init__(self, func, maxsize=4, maxbytes=None):
+        self.func = func
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.cache = OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        "Reset counters"
+        self.stats = dict(evaluations=0, hits=0, evictions=0)
+
+    def clear(self):
+        "Remove all cached points"
+        self.cache.clear()
+
+    @property
+    def nbytes(self):
+        "Memory used by cached points"
+        return sum(e.nbytes for e in self.cache.values())
+
+    def _evict(self):
+        while len(self.cache) > max(self.maxsize, 1) or \
+                len(self.cache) > 1 and self.maxbytes is not None and \
+                self.nbytes > self.maxbytes:
+            self.cache.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _lookup(self, x):
+        x = np.ascontiguousarray(x)
+        key = _fingerprint(x)
+        e = self.cache.get(key)
+        if e is not None and e.same(x):
+            self.stats['hits'] += 1
+            self.cache.pop(key)
+            self.cache[key] = e
+            return e
+        x = x.copy()
+        ax = forward.seed(x)
+        e = _entry(x, self.func(ax), ax)
+        self.stats['evaluations'] += 1
+        self.cache.pop(key, None)
+        self.cache[key] = e
+        self._evict()
+        return e
+
+    def fun(self, x):
+        "Return value of func at x"
+        return self._lookup(x).f
+
+    def jac(self, x):
+        "Return Jacobian (gradient for scalar func) at x"
+        e = self._lookup(x)
+        if e.J is None:
+            J = sparse.csr_matrix.fromcsr(functions.dvalue(e.y, e.seed))
+            if e.f.ndim == 0:
+                J = J.toarray().ravel()
+            e.J = J
+            e.y = e.seed = None
+            self._evict()
+        return e.J
+
+    def hessp(self, x, p):
+        "Return Gauss-Newton approximation of Hessian of 0.5 |func(x)|^2 at x, applied to p"
+        J = self.jac(x)
+        if J.ndim == 1:
+            raise ValueError(
+                'hessp is only available for vector func, as Gauss-Newton approximation')
+        return J.T.dot(J.dot(p))
+
+    def __call__(self, x):
+        return self.fun(x)
+
+
+def wrap(func, maxsize=4, maxbytes=None):
+    """
+    Return memoized_function for func, providing fun, jac and hessp for scipy.optimize
+
+    Example: scipy.optimize.least_squares(w.fun, x0, jac=w.jac), where w = wrap(func)
+    """
+    return memoized_function(func, maxsize=maxsize, maxbytes=maxbytes)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.optimize
+from numpy.testing import assert_almost_equal
+from sparsegrad.optimize import wrap
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+n = 20
+idx = np.arange(n)
+left = np.maximum(idx - 1, 0)
+right = np.minimum(idx + 1, n - 1)
+
+
+def bratu(x):
+    "Discretized Bratu problem with Dirichlet boundary conditions"
+    h2 = 1. / (n + 1)**2
+    interior = (x[left] - 2 * x + x[right]) / h2 + sg.exp(x)
+    return sg.where(np.logical_or(idx == 0, idx == n - 1), x, interior)
+
+
+def test_least_squares():
+    w = wrap(bratu)
+    r = scipy.optimize.least_squares(w.fun, np.zeros(n), jac=w.jac)
+    assert np.linalg.norm(bratu(r.x)) < 1e-6
+    assert w.stats['hits'] > 0
+    assert w.stats['evaluations'] == r.nfev
+
+
+def test_jac_hessp():
+    w = wrap(bratu)
+    x = np.linspace(0., 1., n)
+    J = forward.seed(x)
+    J = bratu(J).dvalue.toarray()
+    assert_almost_equal(w.fun(x), bratu(x))
+    assert_almost_equal(w.jac(x).toarray(), J)
+    p = np.cos(idx)
+    assert_almost_equal(w.hessp(x.copy(), p), J.T.dot(J.dot(p)))
+    assert w.stats['evaluations'] == 1
+    assert w.stats['hits'] == 2
+
+
+def test_hessp_finite_difference():
+    A = scipy.sparse.random(n + 5, n, density=0.3, random_state=0) + \
+        scipy.sparse.eye(n + 5, n)
+    b = np.cos(np.arange(n + 5))
+    w = wrap(lambda x: sg.dot(A, x) - b)
+    x = np.linspace(0., 1., n)
+    p = np.sin(idx)
+    # Hessian of 0.5 |func(x)|^2 from differences of its gradient J^T func(x)
+    h = 1e-6
+
+    def grad(x):
+        return w.jac(x).T.dot(w.fun(x))
+    fd = (grad(x + h * p) - grad(x - h * p)) / (2 * h)
+    assert_almost_equal(w.hessp(x, p), fd, decimal=5)
+
+
+def test_hessp_scalar():
+    w = wrap(lambda x: sg.sum(x**2))
+    try:
+        w.hessp(np.ones(n), np.ones(n))
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_minimize():
+    w = wrap(lambda x: sg.sum((x - idx)**2))
+    r = scipy.optimize.minimize(w.fun, np.zeros(n), jac=w.jac, method='BFGS')
+    assert_almost_equal(r.x, idx, decimal=5)
+    assert w.stats['evaluations'] == r.nfev
+
+
+def test_lru():
+    w = wrap(bratu, maxsize=2)
+    x = [np.full(n, i) for i in range(3)]
+    for y in x:
+        w.fun(y)
+    assert w.stats['evictions'] == 1
+    w.fun(x[2])
+    w.fun(x[1])
+    assert w.stats['hits'] == 2
+    w.fun(x[0])
+    assert w.stats['evaluations'] == 4
+    w.fun(x[1])
+    assert w.stats['hits'] == 3
+
+
+def test_maxbytes():
+    w = wrap(bratu, maxbytes=1)
+    w.jac(np.zeros(n))
+    w.jac(np.ones(n))
+    assert len(w.cache) == 1
+    assert w.stats['evictions'] == 1
+    w.jac(np.ones(n))
+    assert w.stats['evaluations'] == 2
+
+
+def test_nbytes():
+    x = np.ones(n)
+    w = wrap(bratu, maxbytes=4 * x.nbytes)
+    w.fun(x)
+    assert w.nbytes > 2 * x.nbytes
+    J = w.jac(x)
+    assert w.nbytes == 2 * x.nbytes + \
+        J.data.nbytes + J.indices.nbytes + J.indptr.nbytes
+    w.fun(np.zeros(n))
+    assert len(w.cache) == 1
+
+
+def test_dtypes():
+    w = wrap(bratu)
+    w.fun(np.zeros(n))
+    w.fun(np.zeros(n, dtype=np.float32))
+    w.fun(-np.zeros(n))
+    assert w.stats['evaluations'] == 3
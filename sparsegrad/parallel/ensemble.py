@@ -0,0 +1,292 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Ensemble evaluation of residual and Jacobian for many inputs
+
+The same residual is evaluated for many points (and parameter sets) in a pool
+of worker processes, which persists between calls. Inputs are written to
+shared memory, and so are the results: values and Jacobian data of all
+members are stored in a shared arena. The sparsity pattern common to the
+members is stored once. Members with a different pattern are returned through
+the pool in the usual way.
+"""
+
+import multiprocessing
+import numpy as np
+from sparsegrad.impl import sparse
+from sparsegrad import forward
+from sparsegrad import functions
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+__all__ = ['ensemble_jacobian', 'ensemble_result']
+
+
+class _shared_array(object):
+    "Array in shared memory created by the parent process"
+
+    def __init__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec = (self.shm.name, shape, dtype.str)
+
+    def release(self):
+        "Unlink shared memory, return if it is closed"
+        self.array = None
+        self.shm.unlink()
+        return self.close()
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # views are still referenced by results
+            return False
+        return True
+
+
+_member = {}
+
+
+def _init_worker(residual):
+    _member.clear()
+    _member.update(residual=residual, attached={})
+
+
+def _attach(specs):
+    "Return arrays given by specs, attaching shared memory not attached before"
+    attached = _member['attached']
+    names = set(spec[0] for spec in specs.values())
+    for name in list(attached):
+        if name not in names:
+            attached.pop(name)[0].close()
+    arrays = {}
+    for key, (name, shape, dtype) in specs.items():
+        if name not in attached:
+            shm = shared_memory.SharedMemory(name=name)
+            attached[name] = (shm, np.ndarray(
+                shape, dtype=dtype, buffer=shm.buf))
+        arrays[key] = attached[name][1]
+    return arrays
+
+
+def evaluate_member(residual, x, p):
+    "Evaluate residual at x with parameters p, return (value,data,indices,indptr)"
+    ax = forward.seed(x)
+    y = residual(ax) if p is None else residual(ax, p)
+    value = np.array(functions.nvalue(y))
+    dy = sparse.csr_matrix.fromcsr(functions.dvalue(y, ax))
+    nnz = dy.indptr[-1]
+    return value, dy.data[:nnz], dy.indices[:nnz], dy.indptr
+
+
+def _evaluate_worker(args):
+    i, specs = args
+    arrays = _attach(specs)
+    p = arrays['p'][i].copy() if 'p' in arrays else None
+    result = evaluate_member(_member['residual'], arrays['x'][i].copy(), p)
+    if 'data' in arrays:
+        value, data, indices, indptr = result
+        pattern = sparse.csr_pattern(arrays['indices'], arrays['indptr'], (
+            len(arrays['indptr']) - 1, arrays['x'].shape[1]))
+        jac = sparse.csr_pattern(indices, indptr, pattern.shape)
+        if value.shape == arrays['value'].shape[1:] and \
+                data.dtype == arrays['data'].dtype and \
+                sparse.same_pattern(jac, pattern):
+            arrays['value'][i] = value
+            arrays['data'][i] = data
+            return None
+    return result
+
+
+class ensemble_result(object):
+    """
+    Values and Jacobians of ensemble members
+
+    Member i is given by result[i] as forward value, or by value(i) and
+    jacobian(i). Members with the common pattern are views on the shared arena
+    of ensemble_jacobian, valid until it is called again or closed. values is
+    (members, rows) array of values of members, which have the common shape.
+    Members with a different pattern are kept in others.
+    """
+
+    def __init__(self, n, values, data, pattern, others):
+        self.n = n
+        self.values = values
+        self.data = data
+        self.pattern = pattern
+        self.others = others
+
+    def __len__(self):
+        return len(self.values)
+
+    def value(self, i):
+        "Return value of member i"
+        if i in self.others:
+            return self.others[i][0]
+        return self.values[i]
+
+    def jacobian(self, i):
+        "Return Jacobian of member i as CSR matrix"
+        if i in self.others:
+            value, data, indices, indptr = self.others[i]
+            return sparse.csr_matrix.fromarrays(
+                data, indices, indptr, (len(indptr) - 1, self.n))
+        return sparse.csr_matrix.fromarrays(
+            self.data[i], self.pattern.indices, self.pattern.indptr, self.pattern.shape)
+
+    def __getitem__(self, i):
+        value = self.value(i)
+        return forward.value(value=value, deriv=sparse.sdcsr(
+            mshape=(len(value) if value.shape else None, self.n), M=self.jacobian(i)))
+
+    def __iter__(self):
+        return iter([self[i] for i in range(len(self))])
+
+
+class ensemble_jacobian(object):
+    """
+    Evaluate residual and its Jacobian for many inputs in parallel
+
+    The worker processes, shared inputs and shared arena for results persist
+    between calls. The sparsity pattern is taken from the first member, and it
+    is kept while the members of later calls have the same pattern.
+
+    Parameters
+    ----------
+    residual : callable(x) or callable(x, p)
+        residual function, written for numpy and sparsegrad values. When
+        parameters are given, it receives parameter vector p of a member. When
+        the default start method is not fork, residual must be picklable.
+    n : int
+        length of x
+    processes : int, optional
+        number of worker processes, defaults to number of CPUs
+    context : str, optional
+        multiprocessing start method
+    dtype : dtype
+        dtype of x
+
+    Calling the object with (members, n) array X, and optionally (members, k)
+    array of parameters P, returns ensemble_result.
+    """
+
+    def __init__(self, residual, n, processes=None, context=None, dtype=np.float64):
+        if shared_memory is None:
+            raise NotImplementedError(
+                'ensemble_jacobian requires multiprocessing.shared_memory')
+        self.n = n
+        self.dtype = np.dtype(dtype)
+        self.pattern = None
+        self._arrays = {}
+        self._retired = []
+        # workers must share the resource tracker of this process, otherwise
+        # trackers of workers unlink shared memory attached by them on exit
+        resource_tracker.ensure_running()
+        ctx = multiprocessing.get_context(context)
+        self._pool = ctx.Pool(processes, initializer=_init_worker,
+                              initargs=(residual,))
+
+    def _array(self, key, shape, dtype):
+        "Return shared array key, reallocated if its shape or dtype changes"
+        a = self._arrays.get(key)
+        if a is not None and (a.array.shape != shape or a.array.dtype != dtype):
+            self._drop(key)
+            a = None
+        if a is None:
+            a = _shared_array(shape, dtype)
+            self._arrays[key] = a
+        return a.array
+
+    def _drop(self, *keys):
+        "Release shared arrays, arrays with views in results are closed later"
+        self._retired = [a for a in self._retired if not a.close()]
+        for key in keys:
+            a = self._arrays.pop(key, None)
+            if a is not None and not a.release():
+                self._retired.append(a)
+
+    def _specs(self):
+        return dict((key, a.spec) for key, a in self._arrays.items())
+
+    def _set_pattern(self, result):
+        value, data, indices, indptr = result
+        self._drop('indices', 'indptr')
+        self.pattern = sparse.csr_pattern(indices, indptr, (len(indptr) - 1, self.n))
+        self._array('indices', self.pattern.indices.shape,
+                    self.pattern.indices.dtype)[:] = self.pattern.indices
+        self._array('indptr', self.pattern.indptr.shape,
+                    self.pattern.indptr.dtype)[:] = self.pattern.indptr
+        self._data_dtype = data.dtype
+        self._value_shape = value.shape
+
+    def __call__(self, X, P=None):
+        X = np.asarray(X)
+        m = len(X)
+        self._array('x', (m, self.n), self.dtype)[:] = X
+        if P is not None:
+            P = np.asarray(P)
+            self._array('p', P.shape, P.dtype)[:] = P
+        else:
+            self._drop('p')
+        others = {}
+        start = 0
+        if self.pattern is None and m:
+            self._drop('value', 'data')
+            result = self._pool.apply(_evaluate_worker, ((0, self._specs()),))
+            self._set_pattern(result)
+            others[0] = result
+            start = 1
+        if self.pattern is not None:
+            values = self._array('value', (m,) + self._value_shape, self._data_dtype)
+            data = self._array('data', (m, self.pattern.nnz), self._data_dtype)
+        else:
+            values = np.empty((0, 0), dtype=self.dtype)
+            data = None
+        if 0 in others:
+            values[0] = others[0][0]
+            data[0] = others.pop(0)[1]
+        specs = self._specs()
+        results = self._pool.map(
+            _evaluate_worker, [(i, specs) for i in range(start, m)])
+        for i, result in zip(range(start, m), results):
+            if result is not None:
+                others[i] = result
+                if result[0].shape == values.shape[1:]:
+                    values[i] = result[0]
+        return ensemble_result(self.n, values, data, self.pattern, others)
+
+    def close(self):
+        "Stop worker processes and release shared memory"
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._drop(*list(self._arrays))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Parallel evaluation of residual and Jacobian on row blocks
+
+The residual is split into blocks of output rows. Each block is evaluated by
+a worker process, which reads x from shared memory. The Jacobians of the
+blocks are returned as CSR arrays and joined by offsetting indptr.
+"""
+
+import multiprocessing
+import zlib
+from collections import OrderedDict
+import numpy as np
+from sparsegrad.impl import sparse
+from sparsegrad import forward
+from sparsegrad import functions
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+__all__ = ['block', 'partition', 'parallel_jacobian']
+
+
+class block(object):
+    """
+    Block of rows of partitioned residual
+
+    rows are indices of residual entries evaluated in the block. halo contains
+    indices of entries of x, which are required to evaluate these rows. If halo
+    is None, the whole x is available to the block.
+
+    The residual evaluated on the block receives x restricted to halo, in local
+    numbering. Global indices are translated to local numbering by local().
+
+    cache_size is the number of index arrays with different contents, whose
+    local positions are kept by each block.
+    """
+
+    cache_size = 16
+
+    def __init__(self, rows, halo=None):
+        self.rows = np.asarray(rows)
+        if halo is not None:
+            halo = np.unique(np.asarray(halo))
+        self.halo = halo
+        self._local = {}
+        self._contents = OrderedDict()
+
+    def local(self, idx):
+        """
+        Return positions in local vector corresponding to global indices idx
+
+        Positions are cached, so that index arrays computed again in each
+        evaluation of the residual, such as (rows+1)%n, are translated once.
+        Read-only arrays are looked up by identity, and other arrays by their
+        contents. The result is read-only array.
+        """
+        if self.halo is None:
+            return idx
+        pos = sparse.readonly_cached(self._local, (), [idx], lambda: self._find(idx))
+        if pos is None:
+            pos = self._find_contents(np.asarray(idx))
+        return pos
+
+    def _find_contents(self, idx):
+        key = (idx.shape, idx.dtype.str, zlib.crc32(idx.tobytes()))
+        entry = self._contents.get(key)
+        if entry is not None and np.array_equal(entry[0], idx):
+            self._contents.move_to_end(key)
+            return entry[1]
+        pos = self._find(idx)
+        self._contents[key] = (idx.copy(), pos)
+        while len(self._contents) > self.cache_size:
+            self._contents.popitem(last=False)
+        return pos
+
+    def _find(self, idx):
+        pos = np.searchsorted(self.halo, idx)
+        if np.size(pos) and (np.amax(pos) >= len(self.halo) or
+                             np.any(np.take(self.halo, pos) != idx)):
+            raise ValueError('indices outside of halo of block')
+        if isinstance(pos, np.ndarray):
+            pos.flags.writeable = False
+        return pos
+
+    def __getstate__(self):
+        return dict(rows=self.rows, halo=self.halo)
+
+    def __setstate__(self, state):
+        self.rows = state['rows']
+        self.halo = state['halo']
+        self._local = {}
+        self._contents = OrderedDict()
+
+
+def partition(n, nblocks, halo=None):
+    """
+    Split n residual rows into nblocks contiguous blocks
+
+    halo : callable(rows), optional
+        function returning indices of x required to evaluate rows
+    """
+    bounds = np.linspace(0, n, nblocks + 1).astype(int)
+    blocks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows = np.arange(start, stop)
+        blocks.append(block(rows, None if halo is None else halo(rows)))
+    return blocks
+
+
+_worker = {}
+
+
+def _attach(name, n, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(n, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(residual, blocks, name, n, dtype):
+    _worker.clear()
+    shm, x = _attach(name, n, dtype)
+    _worker.update(residual=residual, blocks=blocks, shm=shm, x=x)
+
+
+def evaluate_block(residual, blk, x):
+    """
+    Evaluate residual on blk, return (value,data,indices,indptr) with column
+    indices in global numbering
+    """
+    if blk.halo is not None:
+        x = np.take(x, blk.halo)
+    else:
+        x = x.copy()
+    ax = forward.seed(x)
+    y = residual(ax, blk)
+    value = np.broadcast_to(functions.nvalue(y), blk.rows.shape)
+    dy = sparse.csr_matrix.fromcsr(functions.dvalue(y, ax))
+    indices = dy.indices
+    if blk.halo is not None:
+        indices = np.take(blk.halo, indices)
+    return np.array(value), dy.data[:dy.indptr[-1]], indices[:dy.indptr[-1]], dy.indptr
+
+
+def _evaluate_worker(i):
+    return evaluate_block(_worker['residual'], _worker['blocks'][i], _worker['x'])
+
+
+def _join(results, nrows, ncols):
+    "Join row blocks of results (value,data,indices,indptr) into vector and CSR matrix"
+    value = np.concatenate([r[0] for r in results])
+    M = sparse.csr_join([sparse.csr_matrix.fromarrays(data, indices, indptr, (
+        len(indptr) - 1, ncols)) for _, data, indices, indptr in results], (nrows, ncols))
+    return value, M
+
+
+class parallel_jacobian(object):
+    """
+    Evaluate residual and its Jacobian in parallel on row blocks
+
+    The worker processes and the halo index maps persist between calls, so that
+    the object is intended to be reused in Newton iterations.
+
+    Parameters
+    ----------
+    residual : callable(x, blk)
+        function returning residual entries blk.rows, with x restricted to blk.halo
+        (see block). When the default start method is not fork, residual must be
+        picklable.
+    n : int
+        length of x
+    blocks : list of block
+        row blocks, rows of all blocks must be permutation of range(nrows)
+    processes : int, optional
+        number of worker processes, defaults to number of CPUs
+    context : str, optional
+        multiprocessing start method
+    dtype : dtype
+        dtype of x
+
+    Calling the object with x returns forward value with the residual and its
+    Jacobian.
+    """
+
+    def __init__(self, residual, n, blocks, processes=None,
+                 context=None, dtype=np.float64):
+        if shared_memory is None:
+            raise NotImplementedError(
+                'parallel_jacobian requires multiprocessing.shared_memory')
+        self.n = n
+        self.dtype = np.dtype(dtype)
+        self.blocks = list(blocks)
+        order = np.hstack([b.rows for b in self.blocks]).astype(int)
+        self.nrows = len(order)
+        if not (np.sort(order) == np.arange(len(order))).all():
+            raise ValueError('rows of blocks are not a partition')
+        if (order == np.arange(len(order))).all():
+            self._inverse = None
+        else:
+            self._inverse = np.empty_like(order)
+            self._inverse[order] = np.arange(len(order))
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(n * self.dtype.itemsize, 1))
+        self._x = np.ndarray(n, dtype=self.dtype, buffer=self._shm.buf)
+        ctx = multiprocessing.get_context(context)
+        self._pool = ctx.Pool(processes, initializer=_init_worker, initargs=(
+            residual, self.blocks, self._shm.name, n, self.dtype))
+
+    def __call__(self, x):
+        self._x[:] = x
+        results = self._pool.map(_evaluate_worker, range(len(self.blocks)))
+        value, M = _join(results, self.nrows, self.n)
+        if self._inverse is not None:
+            value = np.take(value, self._inverse)
+            M = sparse.csr_matrix.getrows(M, self._inverse)
+        return forward.value(value=value, deriv=sparse.sdcsr(
+            mshape=(self.nrows, self.n), M=M))
+
+    def close(self):
+        "Stop worker processes and release shared memory"
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._x = None
+            self._shm.close()
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Exchange of objects between processes through shared memory
+
+Objects are pickled with protocol 5. The arrays of the object (for example
+values and Jacobians of forward values, in factored form) are stored
+out-of-band in one block of shared memory, and the pickled stream only holds
+their layout. Imported objects are views on the shared memory, so that no
+copies are made on the receiving side.
+"""
+
+import pickle
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+__all__ = ['shared_object', 'export_shared', 'import_shared', 'release_shared']
+
+_alignment = 64
+
+# shared memory attached by import_shared, by name
+_attached = {}
+
+
+class shared_object(object):
+    """
+    Handle of object exported to shared memory
+
+    The handle is small, and it can be passed to other processes, where the
+    object is obtained by import_shared. The exporting process owns the memory,
+    and it must call unlink() when the object is no longer used.
+    """
+
+    def __init__(self, name, payload, layout):
+        self.name = name
+        self.payload = payload
+        self.layout = layout
+        self._shm = None
+
+    def __getstate__(self):
+        return dict(name=self.name, payload=self.payload, layout=self.layout)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def nbytes(self):
+        "Size of out-of-band data"
+        return sum(size for _, size in self.layout)
+
+    def unlink(self):
+        "Release shared memory, called by the exporting process"
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def export_shared(obj):
+    "Export obj to shared memory, return shared_object handle"
+    if shared_memory is None or pickle.HIGHEST_PROTOCOL < 5:
+        raise NotImplementedError(
+            'export_shared requires pickle protocol 5 and multiprocessing.shared_memory')
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+    layout = []
+    offset = 0
+    for raw in raws:
+        offset = -(-offset // _alignment) * _alignment
+        layout.append((offset, raw.nbytes))
+        offset += raw.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for raw, (offset, size) in zip(raws, layout):
+        shm.buf[offset:offset + size] = raw
+        raw.release()
+    handle = shared_object(shm.name, payload, layout)
+    handle._shm = shm
+    return handle
+
+
+def import_shared(handle):
+    """
+    Return object exported to shared memory, as views on the shared memory
+
+    The memory stays attached until release_shared(handle) is called.
+    """
+    shm = handle._shm
+    if shm is None:
+        shm = _attached.get(handle.name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=handle.name)
+        _attached[handle.name] = shm
+    buffers = [shm.buf[offset:offset + size]
+               for offset, size in handle.layout]
+    return pickle.loads(handle.payload, buffers=buffers)
+
+
+def release_shared(handle):
+    """
+    Detach shared memory attached by import_shared
+
+    All objects imported from handle must be deleted before.
+    """
+    shm = _attached.pop(handle.name, None)
+    if shm is not None:
+        shm.close()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+from numpy.testing import assert_almost_equal
+from sparsegrad import forward
+from sparsegrad.parallel import ensemble_jacobian
+import sparsegrad.functions as sg
+
+n = 7
+i = np.arange(n)
+
+
+def residual(x, p):
+    return x[(i + 1) % n] - p[0] * x + x[(i - 1) % n] + p[1] * x**3
+
+
+def switched(x, p):
+    if p[0] > 0:
+        return residual(x, p)
+    return sg.exp(x)
+
+
+def check(result, func, X, P):
+    assert len(result) == len(X)
+    for j, (x, p) in enumerate(zip(X, P)):
+        y = func(forward.seed(x), p)
+        z = result[j]
+        assert_almost_equal(z.value, y.value)
+        assert_almost_equal(z.dvalue.toarray(), y.dvalue.toarray())
+        assert_almost_equal(result.values[j], y.value)
+
+
+def test_ensemble():
+    X = np.linspace(0., 1., 5 * n).reshape(5, n)
+    P = np.vstack([np.linspace(1., 2., 5), np.linspace(0.5, 1., 5)]).T
+    with ensemble_jacobian(residual, n, processes=2) as ens:
+        check(ens(X, P), residual, X, P)
+        pattern = ens.pattern
+        r = ens(X[:3] + 1., P[:3])
+        check(r, residual, X[:3] + 1., P[:3])
+        assert ens.pattern is pattern
+        assert not r.others
+
+
+def test_other_patterns():
+    X = np.linspace(0., 1., 4 * n).reshape(4, n)
+    P = np.asarray([[1., 1.], [-1., 0.], [2., 1.], [-1., 0.]])
+    with ensemble_jacobian(switched, n, processes=2) as ens:
+        r = ens(X, P)
+        check(r, switched, X, P)
+        assert sorted(r.others) == [1, 3]
+
+
+def test_no_parameters():
+    X = np.linspace(0., 1., 3 * n).reshape(3, n)
+    with ensemble_jacobian(sg.exp, n, processes=1) as ens:
+        r = ens(X)
+        for j, x in enumerate(X):
+            assert_almost_equal(r.jacobian(j).toarray(), np.diag(np.exp(x)))
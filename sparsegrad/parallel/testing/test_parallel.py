@@ -0,0 +1,108 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.parallel import block, partition, parallel_jacobian
+
+
+def residual(x):
+    n = 7
+    i = np.arange(n)
+    return x[(i + 1) % n] - 2 * x + x[(i - 1) % n] + x**3
+
+
+def block_residual(x, blk):
+    n = 7
+    rows = blk.rows
+    xc = x[blk.local(rows)]
+    xp = x[blk.local((rows + 1) % n)]
+    xm = x[blk.local((rows - 1) % n)]
+    return xp - 2 * xc + xm + xc**3
+
+
+def halo(rows):
+    return np.hstack([rows, (rows + 1) % 7, (rows - 1) % 7])
+
+
+def full_residual(x, blk):
+    return residual(x)[blk.rows]
+
+
+@parameterized([(block_residual, halo, 3), (full_residual, None, 2),
+                (block_residual, halo, 1)])
+def test_parallel_jacobian(func, h, nblocks):
+    x = np.linspace(0, 1, 7)
+    with parallel_jacobian(func, 7, partition(7, nblocks, h), processes=2) as pj:
+        for i in range(2):
+            y = residual(forward.seed(x))
+            z = pj(x)
+            assert_almost_equal(z.value, y.value)
+            assert_almost_equal(z.dvalue.toarray(), y.dvalue.toarray())
+            x = x + 1.
+
+
+def test_permuted_blocks():
+    x = np.linspace(0, 1, 7)
+    y = residual(forward.seed(x))
+    rows = [np.asarray([5, 0, 3]), np.asarray([1, 2, 4, 6])]
+    blocks = [block(r, halo(r)) for r in rows]
+    with parallel_jacobian(block_residual, 7, blocks, processes=2) as pj:
+        z = pj(x)
+    assert_almost_equal(z.value, y.value)
+    assert_almost_equal(z.dvalue.toarray(), y.dvalue.toarray())
+
+
+def test_outside_halo():
+    blk = block(np.arange(2), np.arange(3))
+    try:
+        blk.local(np.asarray([3]))
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_not_partition():
+    for rows in [[np.arange(3), np.asarray([3, 4, 10])], [np.arange(3), np.arange(2, 7)]]:
+        try:
+            parallel_jacobian(block_residual, 7, [block(r) for r in rows])
+        except ValueError:
+            pass
+        else:
+            assert False
+
+
+def test_local_cache():
+    blk = block(np.arange(2), np.arange(5))
+    pos = blk.local((np.arange(2) + 1) % 5)
+    assert_equal(pos, [1, 2])
+    for k in range(10):
+        assert blk.local((np.arange(2) + 1) % 5) is pos
+    for k in range(100):
+        blk.local(np.asarray([k % 5]))
+    assert len(blk._local) == 0
+    assert len(blk._contents) <= block.cache_size
+    idx = np.asarray([4, 0])
+    idx.flags.writeable = False
+    assert blk.local(idx) is blk.local(idx)
+    assert len(blk._local) == 1
+    del idx
+    assert len(blk._local) == 0
@@ -0,0 +1,95 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import multiprocessing
+import pickle
+import numpy as np
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+import sparsegrad.functions as sg
+from sparsegrad.parallel import export_shared, import_shared, release_shared
+
+
+def f(x):
+    return sg.exp(x[1:]) * x[:-1] + sg.sum(x)
+
+
+def values():
+    x = np.linspace(1, 2, 6)
+    return [f(forward.seed(x)), forward.seed(x) * 2.,
+            f(forward.seed_sparsity(x)), forward.seed(3.)**2]
+
+
+def check(a, b):
+    assert type(a) is type(b)
+    assert type(a.deriv) is type(b.deriv)
+    assert_almost_equal(a.value, b.value)
+    da, db = a.dvalue, b.dvalue
+    if hasattr(da, 'toarray'):
+        da, db = da.toarray(), db.toarray()
+    assert_almost_equal(da, db)
+
+
+@parameterized([(protocol,) for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1)])
+def test_pickle(protocol):
+    for y in values():
+        check(pickle.loads(pickle.dumps(y, protocol)), y)
+
+
+def test_out_of_band():
+    if pickle.HIGHEST_PROTOCOL < 5:
+        return
+    y = values()[0]
+    buffers = []
+    data = pickle.dumps(y, protocol=5, buffer_callback=buffers.append)
+    buffers = [bytearray(b.raw()) for b in buffers]
+    z = pickle.loads(data, buffers=buffers)
+    check(z, y)
+    assert any(np.shares_memory(z.deriv.M.data, np.frombuffer(b, dtype=np.uint8))
+               for b in buffers)
+
+
+def _remote_sum(handle):
+    y = import_shared(handle)
+    result = (y.value.sum(), y.dvalue.toarray().sum())
+    del y
+    release_shared(handle)
+    return result
+
+
+def test_shared():
+    try:
+        y = values()[0]
+        handle = export_shared(y)
+    except NotImplementedError:
+        return
+    try:
+        check(import_shared(handle), y)
+        pool = multiprocessing.get_context().Pool(1)
+        try:
+            v, d = pool.apply(_remote_sum, (handle,))
+        finally:
+            pool.terminate()
+            pool.join()
+        assert_almost_equal(v, y.value.sum())
+        assert_almost_equal(d, y.dvalue.toarray().sum())
+    finally:
+        import gc
+        gc.collect()
+        handle.unlink()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Vector-Jacobian products without forming the Jacobian
+
+Evaluation of function records a tape of operations. Each tape entry stores the
+local Jacobian in factored form :math:`diag(\\mathbf{p}) \\mathbf{M}`, where
+:math:`\\mathbf{M}` is a constant matrix (gather, broadcast, stacking or
+user supplied matrix). Row vector cotangent is propagated backwards, so that each
+backward step is a row scaling and a transposed sparse matrix-vector product.
+
+Memory requirements are bounded by the values stored on the tape, and not by
+the Jacobians.
+"""
+
+import itertools
+import numpy as np
+from sparsegrad.impl import sparse
+from sparsegrad import forward
+
+__all__ = ['tape_csr', 'vjp']
+
+_serial = itertools.count()
+
+
+def _rows(mshape):
+    return 1 if mshape[0] is None else mshape[0]
+
+
+def _placement(n, rows):
+    "Return matrix P with P[i,rows[i]]=1, of shape len(rows) x n"
+    rows = np.asarray(rows, dtype=sparse.index_dtype)
+    k = len(rows)
+    return sparse.csr_matrix.fromarrays(np.ones(k), rows, np.arange(k + 1), (k, n))
+
+
+def _broadcast_matrix(n):
+    return _placement(1, np.zeros(n))
+
+
+class _cumsum_matrix(object):
+    "Marker of lower triangular matrix of ones, which is the Jacobian of cumsum"
+
+    def __repr__(self):
+        return 'cumsum_matrix'
+
+
+_cumsum = _cumsum_matrix()
+
+
+class tape_csr(sparse.sdcsr):
+    """
+    Jacobian recorded on tape
+
+    Jacobian is not evaluated. Instead, each matrix stores edges (parent, p, M) with
+    local Jacobian :math:`diag(\\mathbf{p}) \\mathbf{M}` with respect to parent.
+    M is either None (identity), slice of rows of parent, lower triangular matrix
+    of ones for cumsum, or sparse matrix.
+    """
+
+    def __init__(self, mshape, edges=()):
+        super(tape_csr, self).__init__(mshape)
+        self.edges = tuple(edges)
+        self.serial = next(_serial)
+
+    def tovalue(self, out=None):
+        raise NotImplementedError(
+            'Jacobian is not available on tape, use vjp to calculate products')
+
+    def _edge(self, mshape, p):
+        if mshape[0] != self.mshape[0]:
+            return (self, p, _broadcast_matrix(_rows(mshape)))
+        return (self, p, None)
+
+    def chain(self, output, x):
+        mshape = self._mshape(output)
+        return self.__class__(mshape, [self._edge(mshape, x)])
+
+    def broadcast(self, output):
+        mshape = self._mshape(output)
+        if mshape[0] == self.mshape[0]:
+            return self
+        return self.__class__(mshape, [self._edge(mshape, 1.)])
+
+    @classmethod
+    def fma(cls, output, *terms):
+        mshape = terms[0][1]._mshape(output)
+        return cls(mshape, [d._edge(mshape, x) for x, d in terms])
+
+    fma2 = fma
+
+    def __add__(self, other):
+        return self.__class__(self.mshape, [(self, 1., None), (other, 1., None)])
+
+    def getitem_arrayp(self, output, idx):
+        mshape = self._mshape(output)
+        return self.__class__(
+            mshape, [(self, 1., _placement(self.mshape[0], idx))])
+
+    def getitem_plan(self, output, plan):
+        return self.getitem_arrayp(output, plan.normalized(self.mshape[0]))
+
+    def getitem_general(self, output, idx):
+        mshape = self._mshape(output)
+        rows = np.atleast_1d(np.arange(self.mshape[0])[idx])
+        return self.__class__(
+            mshape, [(self, 1., _placement(self.mshape[0], rows))])
+
+    def zero(self, output):
+        return self.__class__(self._mshape(output))
+
+    def rdot(self, y, other):
+        other = sparse.csr_matrix.fromcsr(other)
+        return self.__class__(self._mshape(y), [(self, 1., other)])
+
+    def sparsesum(self, output, plan):
+        return self.rdot(output, plan.matrix())
+
+    def dot_data(self, y, structure, x):
+        return self.__class__(self._mshape(
+            y), [(self, 1., structure.dot_data(x))])
+
+    def sum(self):
+        mshape = (None, self.mshape[1])
+        if self.mshape[0] is None:
+            return self.__class__(mshape, [(self, 1., None)])
+        ones = _broadcast_matrix(self.mshape[0]).T.tocsr()
+        return self.__class__(mshape, [(self, 1., ones)])
+
+    def cumsum(self, output):
+        if self.mshape[0] is None:
+            return self.broadcast(output)
+        return self.__class__(self._mshape(output), [(self, 1., _cumsum)])
+
+    def vstack(self, output, parts):
+        edges = []
+        offset = 0
+        for p in parts:
+            n = _rows(p.mshape)
+            edges.append((p, 1., slice(offset, offset + n)))
+            offset += n
+        return self.__class__(self._mshape(output), edges)
+
+    def __repr__(self):
+        return '<tape_csr mshape=%r serial=%r edges=%d>' % (
+            self.mshape, self.serial, len(self.edges))
+
+    def backward(self, r):
+        """
+        Propagate cotangent r backwards, return dict of cotangents of leaves of tape
+
+        r has the shape of value, which this matrix is Jacobian of
+        """
+        nodes = {}
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.serial in nodes:
+                continue
+            nodes[node.serial] = node
+            stack.extend(parent for parent, _, _ in node.edges)
+        cotangents = {self.serial: r}
+        leaves = {}
+        for serial in sorted(nodes, reverse=True):
+            node = nodes[serial]
+            try:
+                c = cotangents.pop(serial)
+            except KeyError:
+                continue
+            if not node.edges:
+                leaves[serial] = c
+            for parent, p, M in node.edges:
+                t = p * c
+                if M is None:
+                    v = t
+                elif isinstance(M, slice):
+                    v = np.atleast_1d(t)[M]
+                elif M is _cumsum:
+                    v = np.cumsum(np.atleast_1d(t)[::-1])[::-1]
+                else:
+                    v = M.T.dot(np.atleast_1d(t))
+                if parent.mshape[0] is None:
+                    v = np.sum(v)
+                try:
+                    cotangents[parent.serial] = cotangents[parent.serial] + v
+                except KeyError:
+                    cotangents[parent.serial] = v
+        return leaves
+
+
+def vjp(f, x, r):
+    r"""
+    Return :math:`(\mathbf{y}, \mathbf{r}^T \mathbf{J})`, where :math:`\mathbf{y}=\mathbf{f}(\mathbf{x})`
+    and :math:`\mathbf{J}` is the Jacobian of :math:`\mathbf{f}` at :math:`\mathbf{x}`
+
+    The Jacobian is not formed. r must have the shape of y.
+    """
+    x = np.asarray(x)
+    n = len(x) if x.shape else None
+    root = tape_csr((n, n))
+    y = f(forward.value(value=x, deriv=root))
+    r = np.asarray(r)
+    g = None
+    if isinstance(y, forward.value):
+        if r.shape != y.value.shape:
+            raise ValueError('shape of r does not match the shape of f(x)')
+        g = y.deriv.backward(r).get(root.serial)
+        y = y.value
+    if g is None:
+        g = np.zeros(x.shape, dtype=np.result_type(x, r))
+    return y, g
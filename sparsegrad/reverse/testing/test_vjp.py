@@ -0,0 +1,88 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.reverse import vjp, tape_csr
+from sparsegrad.testing.test_basic import all_functions
+from sparsegrad.testing.utils import lambdify
+import sparsegrad.functions as sg
+
+A = scipy.sparse.csr_matrix(np.arange(25.).reshape(5, 5) % 3)
+
+test_functions = [
+    'x[::-1] * x + x[np.asarray([0, 0, 1, 2, 4])].sum()',
+    'stack(x[1:] - x[:-1], 2., sum(x**2))',
+    'where(x > 1.5, x**2, -x)',
+    'dot(A, sin(x)) * x[2]',
+    'x[3] * x + 1.',
+    'x[3]',
+    'stack(x, x[0])[np.asarray([5, 0])] * 3.',
+    'cumsum(x**2) * x',
+    'cumprod(x)',
+    'cumprod(x - 1.5) + cumsum(x[0])'
+]
+
+
+def check_vjp(x, f):
+    y = f(forward.seed(x))
+    r = np.linspace(-1., 2., y.value.size).reshape(y.value.shape)
+    value, g = vjp(f, x, r)
+    assert_almost_equal(value, y.value)
+    J = y.dvalue
+    expected = J.T.dot(np.atleast_1d(r)) if scipy.sparse.issparse(J) else J * r
+    assert_almost_equal(np.ravel(g), np.ravel(expected))
+
+
+@parameterized([(f,) for f in test_functions])
+def test_vjp(f):
+    ns = dict(sg.__dict__)
+    ns['A'] = A
+    ns['np'] = np
+    check_vjp(np.linspace(1., 2., 5), lambda x: eval(f, ns, dict(x=x)))
+
+
+@parameterized([(f,) for f, _ in all_functions])
+def test_elementwise(f):
+    x = np.linspace(0.1, 0.9, 4)
+    check_vjp(x, lambdify(f, dict(ns='sg')))
+
+
+def test_scalar():
+    y, g = vjp(lambda x: x**3 * np.ones(3), 2., np.ones(3))
+    assert_almost_equal(y, 8. * np.ones(3))
+    assert_almost_equal(g, 36.)
+
+
+def test_constant():
+    y, g = vjp(lambda x: np.ones(2), np.ones(3), np.ones(2))
+    assert_almost_equal(g, np.zeros(3))
+
+
+def test_tovalue():
+    J = tape_csr((3, 3))
+    for kwargs in [dict(), dict(out=scipy.sparse.csr_matrix((3, 3)))]:
+        try:
+            J.tovalue(**kwargs)
+        except NotImplementedError:
+            pass
+        else:
+            assert False
@@ -0,0 +1,237 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Newton's method with reuse of Jacobian, factorization and fill-reducing ordering
+
+Fill-reducing ordering of the Jacobian and index maps for converting it to
+permuted CSC format are cached while the sparsity pattern of the Jacobian does
+not change. Stale factorization (and the Jacobian) are reused for several
+iterations while convergence is fast enough (modified Newton's method).
+"""
+
+import time
+import numpy as np
+from sparsegrad import impl
+from sparsegrad.impl import sparse
+from sparsegrad import forward
+from sparsegrad import functions
+
+__all__ = ['sparse_lu', 'sparse_ilu', 'newton_solver']
+
+scipy_linalg = impl.scipy.sparse.linalg
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class _timer(object):
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = _clock()
+
+    def __exit__(self, *args):
+        self.stats[self.phase] += _clock() - self.start
+
+
+class sparse_lu(object):
+    """
+    Sparse LU factorization reusing column ordering
+
+    Column ordering is calculated by SuperLU when the sparsity pattern of the matrix
+    changes. For matrices with the same pattern, the columns are permuted using
+    cached index map, and the factorization uses natural ordering.
+    """
+
+    def __init__(self, permc_spec='COLAMD', **options):
+        self.permc_spec = permc_spec
+        self.options = options
+        self.pattern = None
+        self.columns = None
+        self.orderings = 0
+        self.factor = None
+
+    def _factorize(self, A, permc_spec):
+        return scipy_linalg.splu(A, permc_spec=permc_spec, **self.options)
+
+    def _analyse(self, A, perm_c):
+        # SuperLU factorizes A*Pc, whose column j is column argsort(perm_c)[j] of A
+        columns = np.argsort(perm_c)
+        nnz = A.indptr[-1]
+        ids = sparse.csr_matrix.fromarrays(
+            np.arange(nnz), A.indices[:nnz], A.indptr, A.shape).tocsc()[:, columns]
+        self.map = ids.data
+        self.indices = ids.indices
+        self.indptr = ids.indptr
+        self.columns = columns
+        self.pattern = A
+
+    def factorize(self, A):
+        "Factorize matrix A"
+        A = sparse.csr_matrix.fromcsr(A)
+        if sparse.same_pattern(A, self.pattern):
+            B = impl.scipy.sparse.csc_matrix((np.take(
+                A.data, self.map), self.indices, self.indptr), shape=A.shape)
+            self.factor = self._factorize(B, 'NATURAL')
+            self.permuted = True
+        else:
+            self.factor = self._factorize(A.tocsc(), self.permc_spec)
+            self._analyse(A, self.factor.perm_c)
+            self.orderings += 1
+            self.permuted = False
+
+    def solve(self, b):
+        "Return solution of A x = b, A being factorized matrix"
+        z = self.factor.solve(b)
+        if not self.permuted:
+            return z
+        x = np.empty_like(z)
+        x[self.columns] = z
+        return x
+
+
+class sparse_ilu(sparse_lu):
+    "Incomplete LU factorization reusing column ordering, intended as preconditioner"
+
+    def _factorize(self, A, permc_spec):
+        return scipy_linalg.spilu(A, permc_spec=permc_spec, **self.options)
+
+
+def _krylov(method, A, b, M, tol):
+    try:
+        return method(A, b, M=M, rtol=tol, atol=0.)
+    except TypeError:
+        return method(A, b, M=M, tol=tol, atol=0.)
+
+
+class newton_solver(object):
+    """
+    Newton's method for residual(x) = 0
+
+    The Jacobian and its factorization are reused (modified Newton's method) until
+    the residual norm decreases slower than by factor rate in an iteration, or for
+    at most max_reuse iterations. Iterations with stale Jacobian evaluate only the
+    residual value.
+
+    Parameters
+    ----------
+    residual : callable(x)
+        residual function, written for numpy and sparsegrad values
+    tol : float
+        absolute tolerance of residual norm
+    maxiter : int
+        maximum number of iterations
+    linear : str
+        'lu' for direct solver, or name of scipy.sparse.linalg Krylov solver
+        ('gmres', 'bicgstab', ...) preconditioned by incomplete LU
+    ltol : float
+        relative tolerance of Krylov solver
+    rate : float
+        required ratio of residual norms in iterations with stale Jacobian
+    max_reuse : int
+        maximum number of iterations with the same Jacobian
+    factorization : sparse_lu, optional
+        factorization object, to be shared between solvers
+
+    Timings of phases (evaluate, jacobian, factorize, solve) and counts of
+    iterations, Jacobian evaluations, factorizations and orderings are accumulated
+    in stats.
+    """
+
+    def __init__(self, residual, tol=1e-8, maxiter=50, linear='lu', ltol=1e-8,
+                 rate=0.5, max_reuse=5, factorization=None, verbose=False):
+        self.residual = residual
+        self.tol = tol
+        self.maxiter = maxiter
+        self.linear = linear
+        self.ltol = ltol
+        self.rate = rate
+        self.max_reuse = max_reuse
+        self.verbose = verbose
+        if factorization is None:
+            factorization = sparse_lu() if linear == 'lu' else sparse_ilu()
+        self.factorization = factorization
+        self.reset_stats()
+
+    def reset_stats(self):
+        "Reset timings and counters"
+        self.stats = dict(evaluate=0., jacobian=0., factorize=0., solve=0.,
+                          iterations=0, jacobians=0, factorizations=0)
+
+    def _jacobian(self, x):
+        with _timer(self.stats, 'jacobian'):
+            ax = forward.seed(x)
+            y = self.residual(ax)
+            f = np.array(functions.nvalue(y), dtype=np.result_type(x, float))
+            J = sparse.csr_matrix.fromcsr(functions.dvalue(y, ax))
+        self.stats['jacobians'] += 1
+        with _timer(self.stats, 'factorize'):
+            self.factorization.factorize(J)
+        self.stats['factorizations'] += 1
+        self.J = J
+        return f
+
+    def _step(self, f):
+        with _timer(self.stats, 'solve'):
+            if self.linear == 'lu':
+                return self.factorization.solve(-f), 0
+            M = scipy_linalg.LinearOperator(
+                self.J.shape, matvec=self.factorization.solve, dtype=self.J.dtype)
+            return _krylov(getattr(scipy_linalg, self.linear),
+                           self.J, -f, M, self.ltol)
+
+    def solve(self, x0):
+        "Return solution starting from initial guess x0"
+        x = np.array(x0, dtype=np.result_type(x0, float))
+        refresh = True
+        reused = 0
+        fprev = None
+        for i in range(1, self.maxiter + 1):
+            self.stats['iterations'] += 1
+            if not refresh:
+                with _timer(self.stats, 'evaluate'):
+                    f = np.asarray(functions.nvalue(self.residual(x)))
+                fnorm = np.linalg.norm(f)
+                if fnorm < self.tol:
+                    return x
+                refresh = fnorm > self.rate * fprev or reused >= self.max_reuse
+            if refresh:
+                f = self._jacobian(x)
+                fnorm = np.linalg.norm(f)
+                if fnorm < self.tol:
+                    return x
+                reused = 0
+            if self.verbose:
+                print('\tNonlinear iteration {i}, |F|={f}, Jacobian age {age}'.format(
+                    i=i, f=fnorm, age=reused))
+            delta, status = self._step(f)
+            if status:
+                if not refresh:
+                    self._jacobian(x)
+                    delta, status = self._step(f)
+                if status:
+                    raise RuntimeError(
+                        'linear solver did not converge to tolerance {ltol}'.format(ltol=self.ltol))
+            x += delta
+            reused += 1
+            refresh = False
+            fprev = fnorm
+        raise RuntimeError(
+            'did not converge to tolerance {tol}'.format(tol=self.tol))
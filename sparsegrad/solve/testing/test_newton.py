@@ -0,0 +1,88 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad.solve import newton_solver, sparse_lu
+import sparsegrad.functions as sg
+
+n = 30
+idx = np.arange(n)
+left = np.maximum(idx - 1, 0)
+right = np.minimum(idx + 1, n - 1)
+
+
+def bratu(x):
+    "Discretized Bratu problem with Dirichlet boundary conditions"
+    h2 = 1. / (n + 1)**2
+    interior = (x[left] - 2 * x + x[right]) / h2 + sg.exp(x)
+    return sg.where(np.logical_or(idx == 0, idx == n - 1), x, interior)
+
+
+@parameterized([('lu',), ('gmres',), ('bicgstab',)])
+def test_newton(linear):
+    solver = newton_solver(bratu, tol=1e-9, linear=linear, ltol=1e-12)
+    x = solver.solve(np.zeros(n))
+    assert np.linalg.norm(bratu(x)) < 1e-9
+    assert solver.stats['jacobians'] <= solver.stats['iterations']
+    x2 = solver.solve(np.zeros(n) + 0.01)
+    assert_almost_equal(x, x2)
+    assert solver.factorization.orderings == 1
+
+
+def test_reuse():
+    solver = newton_solver(bratu, tol=1e-9, rate=0.9, max_reuse=10)
+    solver.solve(np.zeros(n))
+    assert solver.stats['jacobians'] < solver.stats['iterations']
+    assert solver.stats['evaluate'] > 0.
+
+
+def test_lu_permuted():
+    np.random.seed(0)
+    A = scipy.sparse.random(20, 20, density=0.2, format='csr') + \
+        10 * scipy.sparse.eye(20, format='csr')
+    b = np.random.rand(20)
+    lu = sparse_lu()
+    for scale in [1., 2.]:
+        lu.factorize(A * scale)
+        assert_almost_equal((A * scale).dot(lu.solve(b)), b)
+    assert lu.permuted and lu.orderings == 1
+
+
+def test_lu_fill():
+    np.random.seed(0)
+    A = scipy.sparse.random(200, 200, density=0.02, format='csr') + \
+        10 * scipy.sparse.eye(200, format='csr')
+    lu = sparse_lu()
+    lu.factorize(A)
+    nnz = lu.factor.L.nnz + lu.factor.U.nnz
+    lu.factorize(2 * A)
+    assert lu.permuted
+    assert lu.factor.L.nnz + lu.factor.U.nnz == nnz
+
+
+def test_not_converged():
+    solver = newton_solver(lambda x: x**2 + 1., maxiter=5)
+    try:
+        solver.solve(np.ones(2))
+    except RuntimeError:
+        pass
+    else:
+        assert False
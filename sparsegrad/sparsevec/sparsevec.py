@@ -16,7 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-__all__ = ['sparsevec', 'sparsesum', 'sparsesum_bare']
+__all__ = ['sparsevec', 'sparsesum', 'sparsesum_bare', 'sparsesum_plan']
 
 import sparsegrad.impl.sparsevec as impl_sparsevec
 from . import routing
@@ -30,6 +30,8 @@ def sparsesum(terms, **kwargs):
         (a.v for a in terms), default=impl_sparsevec)
     return routing.sparsesum(impl, terms, **kwargs)
 
+sparsesum_plan = impl_sparsevec.sparsesum_plan
+
 sparsevec = GenericFunction('sparsevec')
 sparsevec.add((object, object, object), impl_sparsevec.sparsevec)
 
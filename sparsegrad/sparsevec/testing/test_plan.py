@@ -0,0 +1,95 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import weakref
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_equal, assert_raises
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.reverse import vjp
+from sparsegrad.sparsevec import *
+
+x = np.linspace(1., 2., 4)
+idx = [np.asarray([0, 3, 3, 1]), np.asarray([3, 0, 5, 5])]
+
+
+def readonly(i):
+    i = i.copy()
+    i.flags.writeable = False
+    return i
+
+
+def f(x, idx=idx, plan=None, return_sparse=False):
+    y = sparsesum([sparsevec(6, idx[0], x), sparsevec(6, idx[1], x**2)],
+                  plan=plan, return_sparse=return_sparse)
+    return y.v if return_sparse else y
+
+
+@parameterized([(False,), (True,)])
+def test_plan(return_sparse):
+    ref = f(forward.seed(x), return_sparse=return_sparse)
+    J = ref.dvalue.toarray()
+    plan = sparsesum_plan(6, idx, compressed=return_sparse)
+    frozen = [readonly(i) for i in idx]
+    for kwargs in [dict(plan=plan), dict(idx=frozen)]:
+        for k in range(3):
+            y = f(forward.seed(x), return_sparse=return_sparse, **kwargs)
+            assert_almost_equal(y.value, ref.value)
+            assert_almost_equal(y.dvalue.toarray(), J)
+            s = f(forward.seed_sparsity(x), return_sparse=return_sparse,
+                  **kwargs).sparsity.toarray()
+            assert_equal(s, J != 0)
+            r = np.linspace(-1., 2., len(ref.value))
+            _, g = vjp(lambda x: f(x, return_sparse=return_sparse, **kwargs), x, r)
+            assert_almost_equal(g, J.T.dot(r))
+
+
+def test_sparse_result():
+    plan = sparsesum_plan(6, idx, compressed=True)
+    y = sparsesum([sparsevec(6, idx[0], x), sparsevec(6, idx[1], x)],
+                  plan=plan, return_sparse=True)
+    assert_equal(y.idx, [0, 1, 3, 5])
+    assert_almost_equal(y.v, [x[0] + x[1], x[3], x[1] + x[2] + x[0], x[2] + x[3]])
+    assert plan.size == 4
+    assert not plan.unique
+
+
+def test_cached():
+    frozen = [readonly(i) for i in idx]
+    assert sparsesum_plan.cached(6, frozen) is sparsesum_plan.cached(6, frozen)
+    assert sparsesum_plan.cached(6, idx) is None
+
+
+def test_released():
+    plan = sparsesum_plan(6, idx)
+    J = forward.seed(np.hstack([x, x**2])).dvalue
+    expected = plan.reduce_rows(J).toarray()
+    for k in range(3):
+        J = J.copy()
+        assert_almost_equal(plan.reduce_rows(J).toarray(), expected)
+        ref = weakref.ref(J)
+        J = J.copy()
+        assert ref() is None
+
+
+def test_errors():
+    plan = sparsesum_plan(6, idx)
+    assert_raises(ValueError, f, x, plan=plan, return_sparse=True)
+    assert_raises(ValueError, sparsesum_plan, 5, idx)
+    assert_raises(ValueError, sparsesum, [sparsevec(6, idx[0], x), sparsevec(
+        6, idx[1], x)], plan=plan, check_unique=True)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Out-of-core evaluation of Jacobians
+
+The residual is evaluated on blocks of consecutive output rows, one block at
+a time. The Jacobian of each block is appended to files holding CSR arrays,
+so that only one block is kept in memory. The result is CSR matrix backed by
+memory mapped files, which are loaded by the operating system on access.
+
+Files are named path.indptr, path.indices, path.data and path.json, the last
+one containing shape and dtypes.
+"""
+
+import json
+import numpy as np
+from sparsegrad.impl import sparse
+from sparsegrad.parallel.parallel import evaluate_block
+
+__all__ = ['stream_jacobian', 'load_jacobian']
+
+
+def _filename(path, kind):
+    return '{}.{}'.format(path, kind)
+
+
+def _memmap(path, kind, dtype, n):
+    if not n:
+        # empty files cannot be memory mapped
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(_filename(path, kind), dtype=dtype, mode='r', shape=(n,))
+
+
+def load_jacobian(path):
+    "Return CSR matrix backed by memory mapped files written by stream_jacobian"
+    with open(_filename(path, 'json')) as f:
+        meta = json.load(f)
+    shape = tuple(meta['shape'])
+    index_dtype = np.dtype(meta['index_dtype'])
+    M = sparse.csr_matrix()
+    # arrays are assigned directly, to avoid conversion of index dtype which
+    # would load them into memory
+    M.indptr = _memmap(path, 'indptr', index_dtype, shape[0] + 1)
+    M.indices = _memmap(path, 'indices', index_dtype, meta['nnz'])
+    M.data = _memmap(path, 'data', np.dtype(meta['dtype']), meta['nnz'])
+    M._shape = shape
+    return M
+
+
+def stream_jacobian(residual, x, blocks, path,
+                    progress=None, index_dtype=np.int64):
+    """
+    Evaluate residual and its Jacobian block by block, writing the Jacobian to files
+
+    Parameters
+    ----------
+    residual : callable(x, blk)
+        function returning residual entries blk.rows, with x restricted to
+        blk.halo, as in sparsegrad.parallel
+    x : vector
+        point of evaluation
+    blocks : list of sparsegrad.parallel.block
+        row blocks, which must be consecutive ranges of rows, in order
+    path : str
+        prefix of names of files
+    progress : callable(rows,nrows,nnz), optional
+        called after each block with number of rows and nonzeros written so far
+    index_dtype : dtype
+        dtype of index arrays, the default allows more than 2**31 nonzeros
+
+    Returns (value, J), where value is residual vector and J is CSR matrix
+    returned by load_jacobian(path).
+    """
+    x = np.asarray(x)
+    blocks = list(blocks)
+    nrows = sum(len(blk.rows) for blk in blocks)
+    index_dtype = np.dtype(index_dtype)
+    indptr = np.memmap(_filename(path, 'indptr'),
+                       dtype=index_dtype, mode='w+', shape=(nrows + 1,))
+    indptr[0] = 0
+    value = None
+    dtype = None
+    start, nnz = 0, 0
+    with open(_filename(path, 'indices'), 'wb') as f_indices, \
+            open(_filename(path, 'data'), 'wb') as f_data:
+        for blk in blocks:
+            rows = np.asarray(blk.rows)
+            stop = start + len(rows)
+            if not np.array_equal(rows, np.arange(start, stop)):
+                raise ValueError(
+                    'blocks must be consecutive ranges of rows, in order')
+            v, data, indices, blk_indptr = evaluate_block(residual, blk, x)
+            if value is None:
+                value = np.empty(nrows, dtype=v.dtype)
+                dtype = data.dtype
+            value[start:stop] = v
+            np.asarray(indices, dtype=index_dtype).tofile(f_indices)
+            np.asarray(data, dtype=dtype).tofile(f_data)
+            indptr[start + 1:stop + 1] = blk_indptr[1:] + nnz
+            start, nnz = stop, nnz + len(data)
+            if progress is not None:
+                progress(start, nrows, nnz)
+    indptr.flush()
+    del indptr
+    if value is None:
+        value = np.zeros(0, dtype=x.dtype)
+        dtype = x.dtype
+    with open(_filename(path, 'json'), 'w') as f:
+        json.dump(dict(shape=[nrows, len(x)], nnz=nnz, dtype=dtype.str,
+                       index_dtype=index_dtype.str), f)
+    return value, load_jacobian(path)
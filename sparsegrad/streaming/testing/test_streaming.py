@@ -0,0 +1,85 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.parallel import block, partition
+from sparsegrad.streaming import stream_jacobian, load_jacobian
+
+n = 9
+
+
+def residual(x):
+    i = np.arange(n)
+    return x[(i + 1) % n] - 2 * x + x[(i - 1) % n] + x**3
+
+
+def block_residual(x, blk):
+    rows = blk.rows
+    xc = x[blk.local(rows)]
+    xp = x[blk.local((rows + 1) % n)]
+    xm = x[blk.local((rows - 1) % n)]
+    return xp - 2 * xc + xm + xc**3
+
+
+def halo(rows):
+    return np.hstack([rows, (rows + 1) % n, (rows - 1) % n])
+
+
+class temporary_directory(object):
+    def __enter__(self):
+        self.path = tempfile.mkdtemp()
+        return self.path
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+@parameterized([(1,), (4,), (9,)])
+def test_stream(nblocks):
+    x = np.linspace(0, 1, n)
+    y = residual(forward.seed(x))
+    calls = []
+    with temporary_directory() as d:
+        path = os.path.join(d, 'J')
+        value, J = stream_jacobian(block_residual, x, partition(
+            n, nblocks, halo), path, progress=lambda *args: calls.append(args))
+        assert isinstance(J.data, np.memmap)
+        assert_almost_equal(value, y.value)
+        assert_almost_equal(J.toarray(), y.dvalue.toarray())
+        assert_almost_equal(load_jacobian(path).toarray(), y.dvalue.toarray())
+        del J
+    assert len(calls) == nblocks
+    assert calls[-1][:2] == (n, n)
+
+
+def test_order():
+    x = np.linspace(0, 1, n)
+    blocks = partition(n, 3, halo)[::-1]
+    with temporary_directory() as d:
+        try:
+            stream_jacobian(block_residual, x, blocks, os.path.join(d, 'J'))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('ValueError expected')
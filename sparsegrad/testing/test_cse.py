@@ -0,0 +1,98 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import gc
+import threading
+import numpy as np
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+n = 6
+idx = np.arange(n)
+left = np.maximum(idx - 1, 0)
+
+
+def shallow_water(eta, u):
+    "Residual with repeated subexpressions"
+    flux = eta * u
+    r1 = flux[left] - eta * u + sg.exp(u * eta)
+    r2 = u**2 + eta * u * u**2 - sg.sin(eta[left])
+    return sg.hstack([r1, r2 + sg.sin(eta[left])])
+
+
+def test_cse():
+    x = np.linspace(0.5, 1.5, 2 * n)
+    ref = shallow_water(*forward.seed_many(eta=x[:n], u=x[n:]))
+    with forward.cse() as scope:
+        seeds = forward.seed_many(eta=x[:n], u=x[n:])
+        y = shallow_water(*seeds)
+    assert_almost_equal(y.value, ref.value)
+    assert_almost_equal(y.dvalue.toarray(), ref.dvalue.toarray())
+    assert scope.stats['hits'] == 6
+    assert not scope.cache
+
+
+@parameterized([('x + 1.', 'x + 2.'), ('x * np.ones(n)', 'x * np.full(n, 2.)'),
+                ('x[left]', 'x[idx]'), ('x[1:]', 'x[2:]'), ('sg.exp(x)', 'sg.log(x)')])
+def test_different(f, g):
+    namespace = dict(np=np, sg=sg, n=n, idx=idx, left=left)
+    f = eval('lambda x: ' + f, namespace)
+    g = eval('lambda x: ' + g, namespace)
+    x = forward.seed(np.linspace(1., 2., n))
+    with forward.cse() as scope:
+        assert f(x) is f(x)
+        assert f(x) is not g(x)
+        assert_almost_equal(g(x).value, g(x.value))
+
+
+def test_mutated_constant():
+    x = forward.seed(np.linspace(1., 2., n))
+    c = np.ones(n)
+    with forward.cse():
+        y = x * c
+        c[0] = 2.
+        z = x * c
+    assert y is not z
+    assert_almost_equal(z.value, x.value * c)
+
+
+def test_released():
+    with forward.cse() as scope:
+        x = forward.seed(np.linspace(1., 2., n))
+        y = x * x
+        assert len(scope.cache) == 1
+        del x, y
+        gc.collect()
+        assert not scope.cache
+
+
+def test_threads():
+    x = np.linspace(0.5, 1.5, n)
+    results = []
+
+    def other():
+        a = forward.seed(x)
+        results.append(a * a)
+    with forward.cse() as scope:
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+    assert scope.stats == dict(hits=0, misses=0)
+    assert_almost_equal(results[0].dvalue.toarray(), np.diag(2 * x))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+test_functions = [
+    ('sg.cumsum(x)', lambda x: np.tril(np.ones((len(x), len(x))))),
+    ('sg.cumsum(x[::-1]**2)', lambda x: np.tril(
+        np.ones((len(x), len(x)))).dot(np.diag(2 * x[::-1]))[:, ::-1]),
+    ('sg.diff(x)', lambda x: np.diff(np.eye(len(x)), axis=0)),
+    ('sg.diff(x, n=2)', lambda x: np.diff(np.eye(len(x)), n=2, axis=0)),
+    ('sg.roll(x, 2)', lambda x: np.roll(np.eye(len(x)), 2, axis=0)),
+    ('sg.roll(x, -1)', lambda x: np.roll(np.eye(len(x)), -1, axis=0)),
+    ('sg.cumprod(x)', None)]
+
+test_vectors = [np.ones(0), np.asarray([2.]), np.asarray([1., -2., 3., 0.5]),
+                np.asarray([1., 0., 3., 4.]), np.asarray([0., 2., 0., 3., 5.])]
+
+
+def cumprod_jacobian(x):
+    n = len(x)
+    J = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i + 1):
+            J[i, j] = np.prod(np.delete(x[:i + 1], j))
+    return J
+
+
+@parameterized([(f, df, x) for f, df in test_functions for x in test_vectors])
+def test_cumulative(f, df, x):
+    func = eval('lambda x: ' + f, dict(sg=sg, np=np))
+    if df is None:
+        df = cumprod_jacobian
+    y = func(forward.seed(x))
+    assert_almost_equal(y.value, func(x))
+    if len(y.value):
+        assert_almost_equal(y.dvalue.toarray(), df(x))
+
+
+def test_cumsum_nnz():
+    x = forward.seed(np.ones(6))
+    assert sg.cumsum(x[3:]).dvalue.nnz == 6
+    assert sg.diff(x).dvalue.nnz == 10
+
+
+@parameterized([('sg.cumsum(x)',), ('sg.cumprod(x)',), ('sg.diff(x)',), ('sg.roll(x, 1)',)])
+def test_sparsity(f):
+    func = eval('lambda x: ' + f, dict(sg=sg, np=np))
+    x = np.asarray([1., 0., 2., 3.])
+    J = func(forward.seed(x + 1.)).dvalue.toarray()
+    S = func(forward.seed_sparsity(x)).sparsity.toarray()
+    assert_almost_equal(S, J != 0)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+n = 6
+idx = np.arange(n)
+left = np.maximum(idx - 1, 0)
+
+
+def residual(x, xdot):
+    return xdot * sg.exp(x) - (x[left] - x) + xdot[left]**2
+
+
+@parameterized([(0.5,), (2.,), (0.,)])
+def test_dae(alpha):
+    x = np.linspace(0., 1., n)
+    xdot = np.cos(idx)
+    seeds = forward.seed_dae(x, xdot)
+    J = seeds.jacobian(residual(*seeds))
+    Jx = residual(forward.seed(x), xdot).dvalue.toarray()
+    Jxdot = residual(x, forward.seed(xdot)).dvalue.toarray()
+    assert_almost_equal(J.dx.toarray(), Jx)
+    assert_almost_equal(J.dxdot.toarray(), Jxdot)
+    assert_almost_equal(J(alpha).toarray(), Jx + alpha * Jxdot)
+    assert J(alpha).nnz == np.count_nonzero((Jx != 0) | (Jxdot != 0))
+
+
+def test_previous():
+    x = np.linspace(0., 1., n)
+    seeds = forward.seed_dae(x, np.ones(n))
+    J1 = seeds.jacobian(residual(*seeds))
+    seeds = forward.seed_dae(x + 1., np.ones(n))
+    J2 = seeds.jacobian(residual(*seeds), previous=J1)
+    assert J2.map is J1.map
+    seeds = forward.seed_dae(x, np.ones(n))
+    J3 = seeds.jacobian(residual(seeds['x'], np.ones(n)), previous=J1)
+    assert J3.map is not J1.map
+    assert_almost_equal(J3(3.).toarray(), J3.dx.toarray())
+
+
+def test_out():
+    x = np.linspace(0., 1., n)
+    seeds = forward.seed_dae(x, np.ones(n))
+    J = seeds.jacobian(residual(*seeds))
+    out = scipy.sparse.csr_matrix(np.ones((n, n)))
+    assert J(2., out=out) is out
+    assert_almost_equal(out.toarray(), J(2.).toarray())
+
+
+def test_complex():
+    x = np.linspace(0., 1., n) * (1. + 1.j)
+    xdot = np.cos(idx) + 0.5j
+    seeds = forward.seed_dae(x, xdot)
+    J = seeds.jacobian(residual(*seeds))
+    Jx = residual(forward.seed(x), xdot).dvalue.toarray()
+    Jxdot = residual(x, forward.seed(xdot)).dvalue.toarray()
+    assert_almost_equal(J(0.5j).toarray(), Jx + 0.5j * Jxdot)
+
+
+def test_empty():
+    seeds = forward.seed_dae(np.zeros(0), np.zeros(0))
+    J = seeds.jacobian(seeds['x'] * seeds['xdot'])
+    assert J(2.).shape == (0, 0)
+    J = seeds.jacobian(sg.sum(seeds['x']) + np.ones(3))
+    assert J(2.).shape == (3, 0)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal, assert_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.impl import sparse
+from sparsegrad.sparsevec import sparsesum_bare
+import sparsegrad.functions as sg
+
+x = np.linspace(1., 2., 5)
+A = scipy.sparse.csr_matrix(np.arange(25.).reshape(5, 5) % 3)
+B = scipy.sparse.csr_matrix(np.eye(5)[[0, 2, 4]] + np.eye(5)[[1, 1, 3]])
+test_functions = [
+    'x[::-1] * x + x[np.asarray([0, 0, 1, 2, 4])].sum()',
+    'stack(x[1:] - x[:-1], 2., sum(x**2))',
+    'where(x > 1.5, x**2, -x)',
+    'dot(A, sin(x)) * x[2]',
+    'x[3] * x + 1.',
+    'x[3]',
+    'exp(x[0]) * np.linspace(0., 1., 40) + x[1]',
+    'cumsum(x) * cumprod(x - 1.)',
+    'diff(x)[1:] + roll(x, 2)[1:4]',
+    'sparsesum_bare(7, [(np.asarray([0, 6, 0, 1, 2]), x), (np.asarray([6, 1]), x[:2]**2)])',
+    'segment_max(x * x[::-1], np.asarray([1, 1, 0, 2, 2]), 4)',
+    'matrix(exp(x)[np.asarray([0, 1, 2, 3, 4, 0])], sparse.csr_structure.fromcsr(B)).dot(x)'
+]
+
+
+def evaluate(f, x):
+    ns = dict(sg.__dict__)
+    ns.update(A=A, B=B, np=np, sparse=sparse, sparsesum_bare=sparsesum_bare,
+              matrix=forward.matrix)
+    return eval(f, ns, dict(x=x))
+
+
+@parameterized([(f, kwargs) for f in test_functions for kwargs in [
+    {}, dict(columns=np.asarray([1, 3])), dict(dx=np.arange(15.).reshape(5, 3))]])
+def test_dense(f, kwargs):
+    y = evaluate(f, forward.seed(x, dense=True, **kwargs))
+    expected = evaluate(f, forward.seed(x, dense=False, **kwargs))
+    assert_almost_equal(y.value, expected.value)
+    J = y.dvalue
+    assert isinstance(J, scipy.sparse.csr_matrix)
+    assert_almost_equal(J.toarray(), expected.dvalue.toarray())
+    assert J.indptr[-1] == J.shape[0] * J.shape[1]
+
+
+def test_select():
+    assert isinstance(forward.seed(x[:2]).deriv, sparse.dense_sdcsr)
+    assert not isinstance(forward.seed(x).deriv, sparse.dense_sdcsr)
+    assert isinstance(forward.seed(np.ones(100), dx=np.ones(
+        (100, 3))).deriv, sparse.dense_sdcsr)
+    assert not isinstance(forward.seed(np.ones(100), columns=np.arange(
+        3)).deriv, sparse.dense_sdcsr)
+    assert not isinstance(forward.seed(np.ones(100)).deriv, sparse.dense_sdcsr)
+    assert not isinstance(forward.seed(1.).deriv, sparse.dense_sdcsr)
+
+
+def test_pattern():
+    a = forward.seed(x, dx=np.ones((5, 2)))
+    J = (a * x).dvalue
+    J0 = (a * (x - x[2])).dvalue
+    assert sparse.same_pattern(J, J0)
+
+
+def test_dtype():
+    for dtype in [np.float32, np.int32, np.float64]:
+        a = forward.seed(x.astype(dtype), dense=False)
+        b = forward.seed(x.astype(dtype), dense=True)
+        for f in [lambda a: a, lambda a: 2 * a, lambda a: a[::-1]]:
+            assert f(b).dvalue.dtype == f(a).dvalue.dtype
+
+
+def test_out():
+    y = forward.seed(x) * x[::-1]
+    out = scipy.sparse.csr_matrix(np.ones((5, 5)))
+    sg.dvalue(y, forward.seed(x), out=out)
+    assert_equal(out.toarray(), np.diag(x[::-1]))
@@ -18,8 +18,10 @@
 
 import numpy as np
 import scipy.sparse
+from numpy.testing import assert_almost_equal
 from sparsegrad import forward
 from sparsegrad.functions import dot
+from sparsegrad.impl import sparse
 from sparsegrad.testing.utils import check_general
 from parameterized import parameterized
 
@@ -58,3 +60,52 @@ def _test_dot():
 @parameterized(_test_dot)
 def test_dot(func, x, M):
     func(x, M)
+
+
+def laplacian_structure(n):
+    "Structure of 1D Laplacian, and for each stored entry its two end nodes"
+    A = scipy.sparse.diags([np.ones(n - 1), np.ones(n), np.ones(n - 1)],
+                           [-1, 0, 1], format='csr')
+    return sparse.csr_structure.fromcsr(A)
+
+
+def weighted_laplacian(x, structure):
+    "Laplacian with conductivity depending on x, as forward matrix"
+    rows = np.repeat(np.arange(structure.shape[0]), np.diff(structure.indptr))
+    cols = structure.indices
+    k = 1. + x**2
+    data = np.where(rows == cols, -2., 1.) * (k[rows] + k[cols])
+    return forward.matrix(data, structure)
+
+
+def weighted_laplacian_gathers(x, structure):
+    A = weighted_laplacian(x, structure)
+    rows = np.repeat(np.arange(structure.shape[0]), np.diff(structure.indptr))
+    terms = A.data * x[structure.indices]
+    return dot(scipy.sparse.csr_matrix((np.ones(structure.nnz), (rows, structure.entries)),
+                                       shape=(structure.shape[0], structure.nnz)), terms)
+
+
+@parameterized([(n,) for n in [1, 2, 5]])
+def test_forward_matrix(n):
+    np.random.seed(0)
+    x = np.random.rand(n)
+    structure = laplacian_structure(n)
+    y = dot(weighted_laplacian(forward.seed(x), structure), forward.seed(x))
+    y2 = weighted_laplacian_gathers(forward.seed(x), structure)
+    assert_almost_equal(y.value, y2.value)
+    assert_almost_equal(y.dvalue.toarray(), y2.dvalue.toarray())
+    z = weighted_laplacian(forward.seed(x), structure).dot(x)
+    assert_almost_equal(z.value, y.value)
+    A = weighted_laplacian(x, structure).value
+    assert_almost_equal(dot(A, forward.seed(x)).dvalue.toarray() + z.dvalue.toarray(),
+                        y.dvalue.toarray())
+
+
+@parameterized([(n,) for n in [1, 5]])
+def test_forward_matrix_sparsity(n):
+    x = np.zeros(n)
+    structure = laplacian_structure(n)
+    y = dot(weighted_laplacian(forward.seed_sparsity(x), structure),
+            forward.seed_sparsity(x))
+    assert (y.sparsity.toarray() == (laplacian_structure(n).tocsr(np.ones(structure.nnz)).toarray() != 0)).all()
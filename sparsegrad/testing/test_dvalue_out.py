@@ -0,0 +1,115 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.impl import sparse
+import sparsegrad.functions as sg
+
+
+def f(x):
+    return sg.exp(x[1:]) * x[:-1] + sg.sum(x[::2]**2)
+
+
+def superset(J, extra=3, seed=0):
+    "Return matrix with pattern of J and extra entries, with unsorted indices"
+    r = np.random.RandomState(seed)
+    P = abs(J) + scipy.sparse.csr_matrix((np.ones(extra), (r.randint(
+        0, J.shape[0], extra), r.randint(0, J.shape[1], extra))), shape=J.shape)
+    P = scipy.sparse.csr_matrix(P)
+    for i in range(P.shape[0]):
+        row = slice(P.indptr[i], P.indptr[i + 1])
+        P.indices[row] = P.indices[row][::-1]
+    P.has_sorted_indices = False
+    P.data.fill(np.nan)
+    return P
+
+
+@parameterized([(n,) for n in [2, 5, 10]])
+def test_out(n):
+    x = np.linspace(1, 2, n)
+    J = f(forward.seed(x)).dvalue
+    out = superset(J)
+    data = out.data
+    for k in range(3):
+        seed = forward.seed(x * (k + 1))
+        y = f(seed)
+        r = sg.dvalue(y, seed, out=out)
+        assert r is out and out.data is data
+        assert_almost_equal(out.toarray(), y.dvalue.toarray())
+
+
+def test_same_pattern():
+    x = np.linspace(1, 2, 6)
+    out = f(forward.seed(x)).dvalue.copy()
+    y = f(forward.seed(2 * x))
+    y.deriv.tovalue(out=out)
+    assert_almost_equal(out.toarray(), y.dvalue.toarray())
+
+
+def test_identity_and_constant():
+    x = forward.seed(np.linspace(1, 2, 4))
+    out = scipy.sparse.csr_matrix(np.ones((4, 4)))
+    sg.dvalue(x * 3., x, out=out)
+    assert_almost_equal(out.toarray(), 3. * np.eye(4))
+    sg.dvalue(np.ones(4), x, out=out)
+    assert_almost_equal(out.toarray(), np.zeros((4, 4)))
+
+
+def test_duplicates():
+    M = sparse.csr_matrix.fromarrays(np.asarray(
+        [1., 2., 3.]), [1, 1, 0], [0, 2, 3], (2, 2))
+    out = scipy.sparse.csr_matrix(np.ones((2, 2)))
+    sparse.csr_assign(out, M, np.asarray([1., 10.]))
+    assert_almost_equal(out.toarray(), [[0., 3.], [30., 0.]])
+
+
+def test_sparsity():
+    x = np.linspace(1, 2, 5)
+    out = superset(f(forward.seed(x)).dvalue)
+    seed = forward.seed_sparsity(x)
+    sg.dvalue(f(seed), seed, out=out)
+    assert_almost_equal(out.toarray(), f(
+        forward.seed_sparsity(x)).sparsity.toarray())
+
+
+def test_violation():
+    x = np.linspace(1, 2, 5)
+    out = scipy.sparse.csr_matrix(scipy.sparse.eye(4, 5))
+    try:
+        f(forward.seed(x)).deriv.tovalue(out=out)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError expected')
+
+
+@parameterized([(False,), (True,)])
+def test_wrong_shape(dense):
+    x = forward.seed(np.linspace(1, 2, 40), dense=dense)
+    out = scipy.sparse.csr_matrix(np.ones((2, 2)))
+    for y in [x * 3., x * np.linspace(1, 2, 40), f(x)]:
+        try:
+            y.deriv.tovalue(out=out)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('ValueError expected')
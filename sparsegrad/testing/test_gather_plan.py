@@ -0,0 +1,90 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_equal
+from parameterized import parameterized
+import sparsegrad
+from sparsegrad import forward
+import sparsegrad.functions as sg
+from sparsegrad.impl.sparse import readonly_cached
+
+x = np.linspace(1., 2., 6)
+test_indices = [np.asarray([0, 5, 2, 2]), np.asarray([-1, 0, -6, 3]),
+                np.asarray([True, False, True, False, False, True]),
+                np.zeros(0, dtype=int)]
+test_functions = ['x[i]', 'sg.exp(x)[i]', '(x * x[::-1])[i]', 'sg.sin(x[::-1])[i] * x[i]']
+
+
+def readonly(i):
+    i = i.copy()
+    i.flags.writeable = False
+    return i
+
+
+@parameterized([(f, i) for f in test_functions for i in test_indices])
+def test_plan(f, i):
+    namespace = dict(sg=sg)
+    f = eval('lambda x, i: ' + f, namespace)
+    ref = f(forward.seed(x), i)
+    J = ref.dvalue.toarray()
+    for j in [sparsegrad.gather_plan(i), readonly(i)]:
+        for k in range(2):
+            y = f(forward.seed(x), j)
+            assert_almost_equal(y.value, ref.value)
+            assert_almost_equal(y.dvalue.toarray(), J)
+            s = f(forward.seed_sparsity(x), j).sparsity.toarray()
+            assert_equal(s, J != 0)
+
+
+def test_numpy():
+    p = sparsegrad.gather_plan([3, -1, 0])
+    assert_equal(x[p], x[[3, -1, 0]])
+    assert_equal(np.asarray(p), [3, -1, 0])
+    assert len(p) == 3
+
+
+def test_reuse():
+    i = np.asarray([0, 5, 2, 2])
+    p = sparsegrad.gather_plan(i)
+    a = forward.seed(x, dense=False)
+    b = a * a
+    assert a[p].deriv.M is a[p].deriv.M
+    assert b[p].deriv.M is b[p].deriv.M
+    assert a[readonly(i)].deriv.M is not a[i].deriv.M
+    r = readonly(i)
+    assert a[r].deriv.M is a[r].deriv.M
+
+
+def test_negative_array():
+    i = np.asarray([-1, 0])
+    J = forward.seed(x)[i].dvalue.toarray()
+    assert_equal(J, np.eye(6)[[5, 0]])
+
+
+def test_readonly_cached():
+    cache = {}
+    i = readonly(np.arange(3))
+    build = lambda: object()
+    r = readonly_cached(cache, ('a',), [i], build)
+    assert readonly_cached(cache, ('a',), [i], build) is r
+    assert readonly_cached(cache, ('b',), [i], build) is not r
+    assert readonly_cached(cache, ('a',), [np.arange(3)], build) is None
+    assert len(cache) == 2
+    del i
+    assert len(cache) == 0
@@ -0,0 +1,65 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.impl import sparse
+import sparsegrad.functions as sg
+
+idx = np.asarray([0, 0, 1, 3, 2])
+
+
+@parameterized([('x[idx]', 'x[idx.copy()]'), ('x[1:4]', 'x[1:4]'),
+                ('sg.exp(x)[idx]', '(1.5 * x)[idx]'), ('x[idx][1:]', 'x[idx][1:]'),
+                ('x[2] + np.ones(3)', 'x[2] * np.ones(3)')])
+def test_shared(f, g):
+    namespace = dict(np=np, sg=sg, idx=idx)
+    f = eval('lambda x: ' + f, namespace)
+    g = eval('lambda x: ' + g, namespace)
+    x = forward.seed(np.linspace(1., 2., 4), dense=False)
+    a = f(x)
+    b = g(x)
+    assert a.deriv.M is b.deriv.M
+    y = a * b + b
+    assert y.deriv.M is a.deriv.M
+    ref = f(forward.seed(x.value)).dvalue.toarray() * b.value[:, np.newaxis] + \
+        g(forward.seed(x.value)).dvalue.toarray() * (a.value + 1.)[:, np.newaxis]
+    assert_almost_equal(y.dvalue.toarray(), ref)
+
+
+def test_different():
+    x = forward.seed(np.linspace(1., 2., 4), dense=False)
+    a = x[idx]
+    b = x[idx[::-1].copy()]
+    assert a.deriv.M is not b.deriv.M
+    M = a.deriv.M.copy()
+    M.data[0] = 2.
+    assert sparse.intern_csr(M) is M
+    assert sparse.intern_csr(M.copy()) is M
+
+
+def test_mutated_dvalue():
+    x = forward.seed(np.linspace(1., 2., 4), dense=False)
+    a = x[idx]
+    b = forward.seed(np.linspace(3., 4., 4), dense=False)[idx]
+    assert a.deriv.M is b.deriv.M
+    J = a.dvalue
+    J.data[:] = 5.
+    assert_almost_equal(b.dvalue.toarray(), np.eye(4)[idx])
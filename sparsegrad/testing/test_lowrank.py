@@ -0,0 +1,84 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import pickle
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.impl import sparse
+import sparsegrad.functions as sg
+
+n = 50
+x = np.linspace(1., 2., n)
+A = scipy.sparse.diags([1., -2., 1.], [-1, 0, 1], shape=(n - 5, n), format='csr')
+segments = np.arange(n) % 7
+test_functions = [
+    'x - sum(x) / n',
+    'exp(x - sum(x) / n) * sum(x**2) + x[::-1]',
+    '(x - sum(x))[np.asarray([3, 0, 0, 49])] * sum(sin(x))',
+    '(x * sum(x))[5:20] + sum(x)',
+    'dot(A, x * sum(x)) - sum(x**2)',
+    'cumsum(x + sum(x))',
+    'segment_sum(x * sum(x), segments, 8)',
+    'sum(x * sum(x)) * x',
+    'stack(x * sum(x), x)',
+    'where(x > 1.5, x, sum(x))'
+]
+
+
+def evaluate(f, x):
+    ns = dict(sg.__dict__)
+    ns.update(A=A, np=np, n=n, segments=segments)
+    return eval(f, ns, dict(x=x))
+
+
+@parameterized([(f,) for f in test_functions])
+def test_lowrank(f):
+    y = evaluate(f, forward.seed(x))
+    threshold = sparse.sdcsr.lowrank_threshold
+    try:
+        sparse.sdcsr.lowrank_threshold = None
+        expected = evaluate(f, forward.seed(x))
+    finally:
+        sparse.sdcsr.lowrank_threshold = threshold
+    assert not isinstance(expected.deriv, sparse.lowrank_sdcsr)
+    assert_almost_equal(y.value, expected.value)
+    J = expected.dvalue.toarray()
+    assert_almost_equal(y.dvalue.toarray(), J)
+    S, U, V = y.dfactors
+    assert_almost_equal(S.toarray() + U.dot(V.T), J)
+    v = np.linspace(-1., 1., n)
+    assert_almost_equal(y.doperator.dot(v), J.dot(v))
+    r = np.linspace(-1., 1., J.shape[0])
+    assert_almost_equal(y.doperator.rmatvec(r), J.T.dot(r))
+
+
+def test_factors():
+    y = forward.seed(x)
+    z = y - sg.sum(y) / n
+    assert isinstance(z.deriv, sparse.lowrank_sdcsr)
+    S, U, V = z.dfactors
+    assert S.nnz == n
+    assert U.shape == (n, 1) and V.shape == (n, 1)
+    z = pickle.loads(pickle.dumps(z * sg.sum(y)))
+    assert isinstance(z.deriv, sparse.lowrank_sdcsr)
+    assert z.deriv.U.shape == (n, 1)
+    S, U, V = y.dfactors
+    assert U.shape == (n, 0) and V.shape == (n, 0)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal, assert_equal
+from parameterized import parameterized
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+A = scipy.sparse.csr_matrix(np.asarray(
+    [[1., 0., 2., 0.], [0., 0., 3., 4.], [5., 0., 0., 1.]]))
+
+# pairs of numpy expression and equivalent sparsegrad expression
+test_functions = [
+    ('np.exp(x)', 'sg.exp(x)'),
+    ('np.sin(x) * np.cos(x)', 'sg.sin(x) * sg.cos(x)'),
+    ('np.abs(-x)', 'abs(-x)'),
+    ('np.positive(x) * np.negative(x)', '-x * x'),
+    ('np.sqrt(np.square(x))', 'sg.sqrt(sg.square(x))'),
+    ('np.add(x, 1.)', 'x + 1.'),
+    ('np.ones(4) * x', 'x * np.ones(4)'),
+    ('np.arange(4.) - x', '-x + np.arange(4.)'),
+    ('np.ones(4) / x', 'sg.reciprocal(x)'),
+    ('np.power(2., x)', 'sg.exp(x * np.log(2.))'),
+    ('np.sum(x * x)', 'sg.sum(x * x)'),
+    ('np.dot(A, x)', 'sg.dot(A, x)'),
+    ('np.dot(A.toarray(), x)', 'sg.dot(A, x)'),
+    ('np.where(np.arange(4) > 1, x, 0.)', 'sg.where(np.arange(4) > 1, x, 0.)'),
+    ('np.hstack([x, np.ones(2)])', 'sg.hstack([x, np.ones(2)])'),
+    ('np.cumsum(x)', 'sg.cumsum(x)'),
+    ('np.diff(x, n=2)', 'sg.diff(x, n=2)'),
+    ('np.roll(x, 1)', 'sg.roll(x, 1)')]
+
+
+@parameterized(test_functions)
+def test_protocol(f, g):
+    namespace = dict(np=np, sg=sg, A=A)
+    f = eval('lambda x: ' + f, namespace)
+    g = eval('lambda x: ' + g, namespace)
+    x = np.asarray([1., 2., 0.5, 3.])
+    y = f(forward.seed(x))
+    z = g(forward.seed(x))
+    assert isinstance(y, forward.value)
+    assert_almost_equal(y.value, z.value)
+    assert_almost_equal(y.dvalue.toarray(), z.dvalue.toarray())
+
+
+def test_numeric():
+    x = forward.seed(np.asarray([1., -2., 0.5]))
+    assert_equal(np.less(x, 0.), [False, True, False])
+    assert_equal(np.greater(0., x), [False, True, False])
+    assert_equal(np.isfinite(x), [True, True, True])
+    assert_equal(np.floor(x), [1., -2., 0.])
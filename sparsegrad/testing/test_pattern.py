@@ -0,0 +1,90 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal, assert_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.impl import sparse
+import sparsegrad.functions as sg
+
+
+def random_csr(n, m, seed):
+    return scipy.sparse.random(n, m, density=0.3, format='csr', random_state=seed)
+
+
+def pattern_of(M):
+    A = scipy.sparse.csr_matrix(M, copy=True)
+    A.data.fill(1.)
+    return A.toarray()
+
+
+@parameterized([(n, m, k) for n in [0, 1, 5] for m in [0, 3, 8] for k in [1, 6]])
+def test_kernels(n, m, k):
+    A, B, C = random_csr(n, m, 0), random_csr(n, m, 1), random_csr(m, k, 2)
+    pA, pB, pC = [sparse.csr_pattern.fromcsr(M) for M in (A, B, C)]
+    assert_equal(pA.union(pB).tocsr().toarray(), pattern_of(A + B))
+    assert_equal(pA.dot(pC).tocsr().toarray(),
+                 pattern_of(pattern_of(A).dot(pattern_of(C))) > 0)
+    assert_equal(pA.sum().tocsr().toarray(), pattern_of(A).sum(axis=0,
+                                                             keepdims=True) > 0)
+    rows = np.arange(n)[::-1]
+    assert_equal(pA.getrows(rows).tocsr().toarray(), pattern_of(A)[rows])
+    assert_equal(sparse.csr_pattern.vstack([pA, pB]).tocsr().toarray(),
+                 np.vstack([pattern_of(A), pattern_of(B)]))
+
+
+def test_fromcsr_duplicates():
+    A = scipy.sparse.csr_matrix(
+        (np.ones(4), [2, 0, 2, 1], [0, 3, 4]), shape=(2, 3))
+    p = sparse.csr_pattern.fromcsr(A)
+    assert_equal(p.indices, [0, 2, 1])
+    assert_equal(p.indptr, [0, 2, 3])
+
+
+def test_no_data():
+    x = forward.seed_sparsity(np.linspace(1, 2, 5))
+    y = x[1:] * x[:-1] + sg.sum(x)
+    assert isinstance(y.deriv.M, sparse.csr_pattern)
+    assert_equal(y.sparsity.toarray(), np.ones((4, 5)))
+
+
+def test_no_cancellation():
+    A = scipy.sparse.csr_matrix(np.asarray([[1., -1.], [1., 1.]]))
+    x = forward.seed_sparsity(np.ones(2))
+    y = sg.dot(A, x + x[::-1])
+    assert_equal(y.sparsity.toarray(), np.ones((2, 2)))
+    assert_almost_equal(sg.dot(A, forward.seed(np.ones(2)) + forward.seed(
+        np.ones(2))[::-1]).dvalue.toarray(), [[0., 0.], [2., 2.]])
+
+
+def test_threaded():
+    from sparsegrad.impl import threadpool
+    A, C = random_csr(50, 40, 0), random_csr(40, 30, 1)
+    saved = dict(threadpool.settings)
+    threadpool.configure(threads=3, threshold=0)
+    try:
+        pA, pC = sparse.csr_pattern.fromcsr(A), sparse.csr_pattern.fromcsr(C)
+        assert_equal(pA.dot(pC).tocsr().toarray(),
+                     pattern_of(A).dot(pattern_of(C)) > 0)
+        B = random_csr(50, 40, 2)
+        assert_equal(pA.union(sparse.csr_pattern.fromcsr(B)).tocsr().toarray(),
+                     pattern_of(A + B))
+    finally:
+        threadpool.configure(**saved)
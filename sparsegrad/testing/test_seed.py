@@ -0,0 +1,73 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+
+def f(x):
+    return sg.stack(x[::-1] * x, sg.sum(x**2), sg.exp(x[1:]) - x[:-1])
+
+
+test_columns = [np.asarray([0]), np.asarray([3, 1]), np.asarray([2, 2, 0]),
+                np.asarray([True, False, True, False, True]), np.zeros(0, dtype=int)]
+
+
+@parameterized([(c,) for c in test_columns])
+def test_columns(columns):
+    x = np.linspace(1., 2., 5)
+    full = f(forward.seed(x)).dvalue.toarray()
+    y = f(forward.seed(x, columns=columns))
+    assert y.dvalue.shape == (full.shape[0], len(np.arange(5)[columns]))
+    assert_almost_equal(y.dvalue.toarray(), full[:, columns])
+    sp = f(forward.seed_sparsity(x, columns=columns)).sparsity.toarray()
+    assert ((full[:, columns] != 0) <= (sp != 0)).all()
+
+
+@parameterized([(np.random.RandomState(0).rand(5, 2),),
+                (scipy.sparse.random(5, 3, density=0.4, random_state=0),),
+                (np.linspace(0., 1., 5),)])
+def test_dx(dx):
+    x = np.linspace(1., 2., 5)
+    full = f(forward.seed(x)).dvalue
+    y = f(forward.seed(x, dx=dx))
+    expected = full.dot(dx.reshape(5, -1) if isinstance(dx, np.ndarray) else dx)
+    if scipy.sparse.issparse(expected):
+        expected = expected.toarray()
+    assert_almost_equal(y.dvalue.toarray(), expected)
+
+
+def test_scalar_dx():
+    y = forward.seed(2., dx=[1., 3.])**2
+    assert_almost_equal(y.dvalue.toarray(), [[4., 12.]])
+    z = (forward.seed(2., dx=[1., 3.]) * np.ones(3)).sum()
+    assert_almost_equal(z.dvalue.toarray(), [[3., 9.]])
+
+
+def test_invalid():
+    for kwargs in [dict(columns=[0], dx=np.ones((3, 1))), dict(dx=np.ones((2, 2)))]:
+        try:
+            forward.seed(np.ones(3), **kwargs)
+        except ValueError:
+            pass
+        else:
+            assert False
@@ -0,0 +1,62 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+from numpy.testing import assert_almost_equal
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+
+def residuals(eta, u, v):
+    r_eta = eta * u - v[::-1]
+    r_u = sg.exp(u) * eta[0]
+    r_v = v**2 + sg.sum(u)
+    return r_eta, r_u, r_v
+
+
+def fields():
+    return np.linspace(1., 2., 4), np.linspace(-1., 1., 4), np.linspace(0., 1., 4)
+
+
+def test_seed_many():
+    eta, u, v = fields()
+    x = forward.seed(np.hstack([eta, u, v]))
+    r = residuals(x[:4], x[4:8], x[8:])
+    full = sg.stack(*r).dvalue.toarray()
+    s = forward.seed_many(('eta', eta), ('u', u), v=v)
+    assert s.names == ['eta', 'u', 'v']
+    r2 = residuals(*s)
+    J = s.jacobian(*zip(['eta', 'u', 'v'], r2))
+    assert_almost_equal(J.bmat().toarray(), full)
+    for i, row in enumerate(s.names):
+        for j, column in enumerate(s.names):
+            assert_almost_equal(J[row, column].toarray(),
+                                full[4 * i:4 * i + 4, 4 * j:4 * j + 4])
+    single = s.jacobian(sg.stack(*r2))
+    assert_almost_equal(single['u'].toarray(), full[:, 4:8])
+    assert_almost_equal(single.bmat().toarray(), full)
+
+
+def test_constant_and_scalar():
+    s = forward.seed_many(a=2., b=np.ones(3))
+    J = s.jacobian(('x', s['a'] * s['b']), ('y', np.zeros(2)), ('z', s['a']**2))
+    assert_almost_equal(J['x', 'a'].toarray(), np.ones((3, 1)))
+    assert_almost_equal(J['x', 'b'].toarray(), 2 * np.eye(3))
+    assert J['y', 'b'].shape == (2, 3) and J['y', 'b'].nnz == 0
+    assert_almost_equal(J['z', 'a'].toarray(), [[4.]])
+    assert J.bmat().shape == (6, 4)
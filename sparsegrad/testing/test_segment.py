@@ -0,0 +1,77 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.reverse import vjp
+import sparsegrad.functions as sg
+
+segment_ids = np.asarray([0, 2, 2, 0, 2, 3, 0])
+test_values = [np.asarray([2., -1.8, 1.7, 1.5, -1.3, 1.2, 1.]),
+               np.asarray([0., 2., 0., 3., 4., 5., 1.]),
+               np.asarray([0., 2., 1., 3., 0., 5., 1.])]
+test_functions = ['segment_sum', 'segment_max', 'segment_min', 'segment_prod']
+references = dict(segment_sum=(np.add, 0.), segment_max=(np.maximum, -np.inf),
+                  segment_min=(np.minimum, np.inf), segment_prod=(np.multiply, 1.))
+
+
+def readonly(i):
+    i = i.copy()
+    i.flags.writeable = False
+    return i
+
+
+def numerical_jacobian(f, x, h=1e-7):
+    y = f(x)
+    with np.errstate(invalid='ignore'):
+        J = np.asarray([f(x + h * e) - y for e in np.eye(len(x))]).T / h
+    J[np.isinf(y)] = 0.
+    return J
+
+
+@parameterized([(f, x, n) for f in test_functions for x in test_values for n in [4, 5]])
+def test_segment(name, x, n):
+    ufunc, initial = references[name]
+    expected = np.full(n, initial)
+    ufunc.at(expected, segment_ids, x)
+    for ids in [segment_ids, readonly(segment_ids)]:
+        def f(x): return getattr(sg, name)(x, ids, n)
+        assert_equal(f(x), expected)
+        y = f(forward.seed(x))
+        assert_equal(y.value, expected)
+        J = y.dvalue.toarray()
+        assert_almost_equal(J, numerical_jacobian(f, x), decimal=5)
+        s = f(forward.seed_sparsity(x)).sparsity.toarray()
+        assert ((J != 0) <= s).all()
+        r = np.linspace(-1., 2., n)
+        _, g = vjp(f, x, r)
+        assert_almost_equal(g, J.T.dot(r))
+
+
+def test_ties():
+    x = np.asarray([1., 3., 3.])
+    J = sg.segment_max(forward.seed(x), np.zeros(3, dtype=int), 1).dvalue
+    assert_equal(J.toarray(), [[0., 1., 0.]])
+
+
+def test_integer():
+    y = sg.segment_max(np.asarray([3, 1]), np.asarray([1, 1]), 3)
+    assert_equal(y, [np.iinfo(y.dtype).min, 3, np.iinfo(y.dtype).min])
+    assert_equal(sg.segment_sum(np.asarray([3, 1]), np.asarray([1, 1]), 2), [0, 4])
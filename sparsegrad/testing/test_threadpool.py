@@ -0,0 +1,70 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+from sparsegrad.impl import threadpool
+from sparsegrad.impl import sparse
+import sparsegrad.functions as sg
+
+
+def f(x):
+    n = len(x.value)
+    i = np.arange(n)
+    A = scipy.sparse.csr_matrix(np.triu(np.ones((n, n))))
+    y = x[(i + 1) % n] * x - x[(i + 3) % n] * x[::-1] + sg.sum(x**2)
+    return sg.dot(A, y) + sg.where(x.value > 0.5, y, x)
+
+
+def evaluate(x, threads):
+    saved = dict(threadpool.settings)
+    threadpool.configure(threads=threads, threshold=0)
+    try:
+        return f(forward.seed(x))
+    finally:
+        threadpool.configure(**saved)
+
+
+@parameterized([(n, threads) for n in [0, 1, 2, 7, 50] for threads in [2, 3]])
+def test_threaded(n, threads):
+    x = np.linspace(0, 1, n)
+    serial = evaluate(x, 1)
+    threaded = evaluate(x, threads)
+    assert_almost_equal(threaded.value, serial.value)
+    assert_almost_equal(threaded.dvalue.toarray(), serial.dvalue.toarray())
+
+
+def test_row_chunks():
+    threadpool.configure(threads=4)
+    try:
+        indptr = np.asarray([0, 5, 5, 6, 10, 20])
+        chunks = threadpool.row_chunks(indptr)
+        assert chunks[0][0] == 0 and chunks[-1][1] == 5
+        assert all(a[1] == b[0] for a, b in zip(chunks[:-1], chunks[1:]))
+    finally:
+        threadpool.configure(threads=1)
+
+
+def test_join():
+    M = scipy.sparse.random(10, 4, density=0.5, format='csr', random_state=0)
+    J = sparse.csr_join([sparse.csr_rows(M, 0, 3), sparse.csr_rows(M, 3, 3),
+                         sparse.csr_rows(M, 3, 10)], M.shape)
+    assert_almost_equal(J.toarray(), M.toarray())
@@ -43,3 +43,19 @@ def test_scalar(*args):
 @parameterized(product(functions_with_where, test_vectors, namespaces=['sg']))
 def test_vector(*args):
     verify_vector(*args)
+
+
+def test_branch():
+    import sparsegrad.forward as forward
+    import sparsegrad.functions as sg
+    from numpy.testing import assert_almost_equal
+    x = np.asarray(test_scalars)
+    cond = x > 0.
+
+    def f(x):
+        return sg.branch(cond, lambda idx: x[idx]**2, lambda idx: sg.sin(x[idx]))
+    y = f(forward.seed(x))
+    assert_almost_equal(y.value, np.where(cond, x**2, np.sin(x)))
+    assert_almost_equal(y.dvalue.toarray(), np.diag(
+        np.where(cond, 2 * x, np.cos(x))))
+    assert_almost_equal(f(x), y.value)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8; -*-
+#
+# sparsegrad - automatic calculation of sparse gradient
+# Copyright (C) 2016-2018 Marek Zdzislaw Szymanski (marek@marekszymanski.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3,
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import pickle
+import numpy as np
+import scipy.sparse
+from numpy.testing import assert_almost_equal
+from parameterized import parameterized
+from sparsegrad import forward
+import sparsegrad.functions as sg
+
+x0 = np.linspace(1, 2, 4)
+
+
+@parameterized([('0. * x',), ('x * 0',), ('sg.sum(0. * x)',), ('(0. * x)[::2]',),
+                ('(0. * x)[np.asarray([0, 0, 3])]',), ('sg.stack(0. * x, 0. * x)',),
+                ('sg.dot(scipy.sparse.eye(4).tocsr(), x * 0.)',),
+                ('sg.exp(0. * x)',), ('0. * x + 0. * x',)])
+def test_zero(expr):
+    y = eval(expr, dict(sg=sg, np=np, scipy=scipy,
+                        x=forward.seed(x0)))
+    assert y.deriv.iszero
+    d = y.dvalue
+    if hasattr(d, 'toarray'):
+        assert d.nnz == 0
+        d = d.toarray()
+    assert_almost_equal(d, 0.)
+
+
+def test_propagation():
+    x = forward.seed(x0)
+    y = sg.stack(x, np.ones(2), 0. * x[0]) + 0. * sg.stack(x, x, x)[:7]
+    J = np.vstack([np.eye(4), np.zeros((3, 4))])
+    assert not y.deriv.iszero
+    assert_almost_equal(y.dvalue.toarray(), J)
+    out = scipy.sparse.csr_matrix(np.ones((7, 4)))
+    sg.dvalue(0. * sg.stack(x, x[:3]), x, out=out)
+    assert_almost_equal(out.toarray(), 0.)
+
+
+@parameterized([(True,), (False,)])
+def test_where(value):
+    x = forward.seed(x0)
+    y = sg.where(np.ones(4, dtype=bool) * value, x, x[::-1])
+    assert y.dvalue.nnz == 4
+    assert_almost_equal(y.value, x0 if value else x0[::-1])
+
+
+def test_sparsity():
+    x = forward.seed_sparsity(x0)
+    assert_almost_equal((0. * x).sparsity.toarray(), np.eye(4))
+    assert_almost_equal(sg.stack(x, np.ones(2)).sparsity.toarray(),
+                        np.vstack([np.eye(4), np.zeros((2, 4))]))
+
+
+def test_pickle():
+    x = forward.seed(x0)
+    y = pickle.loads(pickle.dumps(0. * x))
+    assert y.deriv.iszero
@@ -54,12 +54,20 @@ def _check_grad(a, b):
         assert_almost_equal(err, 0.)
 
 
+def _seeds(x):
+    "Return forward values of x, with Jacobians propagated as sparse and dense matrices"
+    if not np.shape(x):
+        return [forward.seed(x)]
+    return [forward.seed(x, dense=dense) for dense in (False, True)]
+
+
 def check_vector(x, f, df):
-    y = f(forward.seed(x))
-    d = np.atleast_1d(df(x) * np.ones_like(y.value))
-    dy = scipy.sparse.spdiags(d, 0, len(d), len(d), format='csr')
-    assert_almost_equal(y.value, f(x))
-    _check_grad(y.dvalue, dy)
+    for seed in _seeds(x):
+        y = f(seed)
+        d = np.atleast_1d(df(x) * np.ones_like(y.value))
+        dy = scipy.sparse.spdiags(d, 0, len(d), len(d), format='csr')
+        assert_almost_equal(y.value, f(x))
+        _check_grad(y.dvalue, dy)
 
 
 def verify_vector(settings, x, f, df):
@@ -69,17 +77,18 @@ def verify_vector(settings, x, f, df):
 
 
 def check_vector_scalar(x, v, f, df):
-    y = f(forward.seed(x), v)
-    assert_almost_equal(y.value, f(x, v))
-    assert y.dvalue.shape == (len(y.value), 1)
-    assert_almost_equal(y.dvalue.toarray().ravel(), df(x, v))
+    for seed in _seeds(x):
+        y = f(seed, v)
+        assert_almost_equal(y.value, f(x, v))
+        assert y.dvalue.shape == (len(y.value), 1)
+        assert_almost_equal(y.dvalue.toarray().ravel(), df(x, v))
 
 
 def check_general(x, f, grad):
-    y = f(forward.seed(x))
-    dy = grad
-    assert_almost_equal(y.value, f(x))
-    _check_grad(y.dvalue, dy)
+    for seed in _seeds(x):
+        y = f(seed)
+        assert_almost_equal(y.value, f(x))
+        _check_grad(y.dvalue, grad)
 
 
 def product(functions, values, namespaces=None):